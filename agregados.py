@@ -0,0 +1,205 @@
+# Arquivo: agregados.py
+"""
+Agregados de notas fiscais mantidos por triggers
+
+tb_agregados_notas guarda, por dimensão (total, referencia, uf, tipo_servico,
+recolhimento) e chave, a quantidade de notas, o valor total e o ISS. Os valores
+são somados em centavos inteiros para que inserções e exclusões sucessivas não
+acumulem erro de ponto flutuante. tb_contadores guarda a quantidade de linhas de
+tb_fornecedores e tb_config_tomador. As triggers (migração 4) mantêm as duas
+tabelas atualizadas, então as estatísticas são lidas sem varrer tb_notas_fiscais.
+"""
+
+# dimensão -> expressão da chave sobre tb_notas_fiscais ({p} = "NEW.", "OLD." ou "")
+# Alterar uma dimensão exige uma nova migração que recrie as triggers e recalcule.
+DIMENSOES = {
+    "total": "''",
+    "referencia": "COALESCE({p}referencia, '')",
+    "uf": "COALESCE({p}uf, '')",
+    "tipo_servico": "COALESCE({p}tipo_servico, '')",
+    "recolhimento": "COALESCE(CAST({p}recolhimento_id AS TEXT), '')",
+}
+
+# Centavos de uma nota: mesma expressão nas triggers e no recálculo
+CENTAVOS_VALOR = "CAST(ROUND(COALESCE({p}valor_nf, 0) * 100) AS INTEGER)"
+CENTAVOS_ISS = "CAST(ROUND(COALESCE({p}valor_nf, 0) * COALESCE({p}aliquota, 0)) AS INTEGER)"
+
+TABELAS_CONTADAS = ("tb_fornecedores", "tb_config_tomador")
+
+
+def sql_agregados(condicao=""):
+    """
+    SELECT (dimensao, chave, quantidade, valor_centavos, iss_centavos) das notas
+
+    :param condicao: Cláusula WHERE opcional sobre tb_notas_fiscais; como ela se repete em
+        cada dimensão, use parâmetros nomeados (ex.: "WHERE referencia = :referencia")
+    """
+    partes = []
+    for dimensao, chave in DIMENSOES.items():
+        partes.append(f"""
+            SELECT '{dimensao}' AS dimensao, {chave.format(p='')} AS chave, COUNT(*) AS quantidade,
+                   SUM({CENTAVOS_VALOR.format(p='')}) AS valor_centavos,
+                   SUM({CENTAVOS_ISS.format(p='')}) AS iss_centavos
+            FROM tb_notas_fiscais {condicao} GROUP BY 2
+        """)
+    return " UNION ALL ".join(partes)
+
+
+def sql_triggers_agregados():
+    """Comandos CREATE TRIGGER que mantêm tb_agregados_notas e tb_contadores"""
+    colunas = "referencia, uf, tipo_servico, recolhimento_id, valor_nf, aliquota"
+
+    def acumular(p, sinal):
+        return "".join(f"""
+            INSERT INTO tb_agregados_notas (dimensao, chave, quantidade, valor_centavos, iss_centavos)
+            VALUES ('{dimensao}', {chave.format(p=p)}, {sinal}1,
+                    {sinal}{CENTAVOS_VALOR.format(p=p)}, {sinal}{CENTAVOS_ISS.format(p=p)})
+            ON CONFLICT (dimensao, chave) DO UPDATE SET
+                quantidade = quantidade + excluded.quantidade,
+                valor_centavos = valor_centavos + excluded.valor_centavos,
+                iss_centavos = iss_centavos + excluded.iss_centavos;""" for dimensao, chave in DIMENSOES.items())
+
+    comandos = [
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_agregados_ins AFTER INSERT ON tb_notas_fiscais
+            BEGIN {acumular("NEW.", "")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_agregados_del AFTER DELETE ON tb_notas_fiscais
+            BEGIN {acumular("OLD.", "-")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_agregados_upd AFTER UPDATE OF {colunas} ON tb_notas_fiscais
+            BEGIN {acumular("OLD.", "-")} {acumular("NEW.", "")} END""",
+    ]
+    for tabela in TABELAS_CONTADAS:
+        comandos.append(f"""CREATE TRIGGER IF NOT EXISTS tr_{tabela}_contador_ins AFTER INSERT ON {tabela}
+            BEGIN UPDATE tb_contadores SET quantidade = quantidade + 1 WHERE tabela = '{tabela}'; END""")
+        comandos.append(f"""CREATE TRIGGER IF NOT EXISTS tr_{tabela}_contador_del AFTER DELETE ON {tabela}
+            BEGIN UPDATE tb_contadores SET quantidade = quantidade - 1 WHERE tabela = '{tabela}'; END""")
+    return comandos
+
+
+def recalcular_agregados(cursor):
+    """Reconstrói tb_agregados_notas e tb_contadores a partir das tabelas (dentro da transação do chamador)"""
+    cursor.execute("DELETE FROM tb_agregados_notas")
+    cursor.execute(f"""
+        INSERT INTO tb_agregados_notas (dimensao, chave, quantidade, valor_centavos, iss_centavos)
+        {sql_agregados()}
+    """)
+    # A linha 'total' precisa existir mesmo com a tabela de notas vazia
+    cursor.execute("""
+        INSERT OR IGNORE INTO tb_agregados_notas (dimensao, chave, quantidade, valor_centavos, iss_centavos)
+        VALUES ('total', '', 0, 0, 0)
+    """)
+    cursor.execute("DELETE FROM tb_contadores")
+    for tabela in TABELAS_CONTADAS:
+        cursor.execute(f"INSERT INTO tb_contadores (tabela, quantidade) SELECT '{tabela}', COUNT(*) FROM {tabela}")
+
+
+def _linha_para_dict(chave, quantidade, valor_centavos, iss_centavos):
+    return {
+        "chave": chave,
+        "quantidade": quantidade,
+        "valor_total": valor_centavos / 100,
+        "valor_iss": iss_centavos / 100,
+    }
+
+
+def estatisticas(conn):
+    """
+    Totais gerais (notas, fornecedores, tomadores, valor e ISS) lidos dos agregados
+
+    Inclui as competências arquivadas pelas linhas de tb_arquivo_agregados (sem abrir os arquivos).
+    """
+    total = conn.execute("""
+        SELECT COALESCE(SUM(quantidade), 0), COALESCE(SUM(valor_centavos), 0), COALESCE(SUM(iss_centavos), 0)
+        FROM (
+            SELECT quantidade, valor_centavos, iss_centavos
+            FROM tb_agregados_notas WHERE dimensao = 'total' AND chave = ''
+            UNION ALL
+            SELECT quantidade, valor_centavos, iss_centavos
+            FROM tb_arquivo_agregados WHERE dimensao = 'total'
+        )
+    """).fetchone()
+    contadores = dict(conn.execute("SELECT tabela, quantidade FROM tb_contadores").fetchall())
+    return {
+        "total_notas": total[0],
+        "total_fornecedores": contadores.get("tb_fornecedores", 0),
+        "total_tomadores": contadores.get("tb_config_tomador", 0),
+        "valor_total": total[1] / 100,
+        "valor_iss": total[2] / 100,
+    }
+
+
+def estatisticas_por(conn, dimensao):
+    """
+    Quebra dos agregados por uma dimensão (tabela quente mais competências arquivadas)
+
+    :raises ValueError: se a dimensão não existir
+    """
+    if dimensao not in DIMENSOES or dimensao == "total":
+        raise ValueError(f"Dimensão inválida: {dimensao}")
+
+    linhas = conn.execute("""
+        SELECT chave, SUM(quantidade), SUM(valor_centavos), SUM(iss_centavos)
+        FROM (
+            SELECT chave, quantidade, valor_centavos, iss_centavos FROM tb_agregados_notas WHERE dimensao = ?
+            UNION ALL
+            SELECT chave, quantidade, valor_centavos, iss_centavos FROM tb_arquivo_agregados WHERE dimensao = ?
+        )
+        GROUP BY chave
+        HAVING SUM(quantidade) > 0
+        ORDER BY chave
+    """, (dimensao, dimensao)).fetchall()
+    resultado = [_linha_para_dict(*linha) for linha in linhas]
+
+    if dimensao == "recolhimento":
+        nomes = {str(id_): nome for id_, nome in conn.execute(
+            "SELECT id, recolhimento FROM tb_tipo_de_recolhimento"
+        )}
+        for item in resultado:
+            item["descricao"] = nomes.get(item["chave"], "")
+    return resultado
+
+
+def quantidade(conn, dimensao, chave):
+    """Quantidade de notas com a chave na dimensão (tabela quente mais competências arquivadas)"""
+    if dimensao not in DIMENSOES:
+        raise ValueError(f"Dimensão inválida: {dimensao}")
+    return conn.execute("""
+        SELECT COALESCE(SUM(quantidade), 0)
+        FROM (
+            SELECT quantidade FROM tb_agregados_notas WHERE dimensao = :dimensao AND chave = :chave
+            UNION ALL
+            SELECT quantidade FROM tb_arquivo_agregados WHERE dimensao = :dimensao AND chave = :chave
+        )
+    """, {"dimensao": dimensao, "chave": chave}).fetchone()[0]
+
+
+def verificar_agregados(conn):
+    """
+    Recalcula os agregados do zero e compara com o que as triggers mantiveram
+
+    :return: Lista de tuplas (dimensao, chave, mantido, recalculado) com as divergências
+    """
+    mantidos = {
+        (dimensao, chave): (quantidade, valor, iss)
+        for dimensao, chave, quantidade, valor, iss in conn.execute(
+            "SELECT dimensao, chave, quantidade, valor_centavos, iss_centavos FROM tb_agregados_notas"
+        )
+        if quantidade or valor or iss or dimensao == "total"
+    }
+    recalculados = {
+        (dimensao, chave): (quantidade, valor or 0, iss or 0)
+        for dimensao, chave, quantidade, valor, iss in conn.execute(sql_agregados())
+    }
+    recalculados.setdefault(("total", ""), (0, 0, 0))
+
+    divergencias = [
+        (dimensao, chave, mantidos.get((dimensao, chave)), recalculados.get((dimensao, chave)))
+        for dimensao, chave in sorted(set(mantidos) | set(recalculados))
+        if mantidos.get((dimensao, chave)) != recalculados.get((dimensao, chave))
+    ]
+
+    contadores = dict(conn.execute("SELECT tabela, quantidade FROM tb_contadores").fetchall())
+    for tabela in TABELAS_CONTADAS:
+        real = conn.execute(f"SELECT COUNT(*) FROM {tabela}").fetchone()[0]
+        if contadores.get(tabela) != real:
+            divergencias.append(("contador", tabela, contadores.get(tabela), real))
+    return divergencias
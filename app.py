@@ -1,18 +1,82 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Flask, render_template, stream_template, request, redirect, url_for, flash, get_flashed_messages, jsonify, Response, stream_with_context, g, send_file
 from werkzeug.utils import secure_filename
+import logging
 import os
-import pandas as pd
-from datetime import datetime
-from database import DatabaseManager, get_application_path
-import tempfile
+import time
+from configuracao_log import configurar_logging
+from database import DatabaseManager, ORDENACOES_NOTAS, get_application_path
+from exportacao_txt import arquivo_exemplo
+from particionamento import GerenciadorParticoes
+from tarefas import GerenciadorTarefas
+import uuid
+import journal
+import metricas
+
+# Nível e formato vêm de LOG_LEVEL e LOG_FORMAT
+configurar_logging()
 
 app = Flask(__name__)
 app.secret_key = 'chave_secreta_app_rest_gyn'
 
-# Instanciar o gerenciador de banco de dados
-db = DatabaseManager()
-db.insert_klb_tomador()
+# Instanciar o gerenciador de banco de dados (pool e PRAGMAs configuráveis por variável de ambiente)
+db_pragmas = {}
+if os.environ.get('DB_CACHE_SIZE'):
+    db_pragmas['cache_size'] = int(os.environ['DB_CACHE_SIZE'])
+if os.environ.get('DB_MMAP_SIZE'):
+    db_pragmas['mmap_size'] = int(os.environ['DB_MMAP_SIZE'])
+if os.environ.get('DB_BUSY_TIMEOUT'):
+    db_pragmas['busy_timeout'] = int(os.environ['DB_BUSY_TIMEOUT'])
+
+db = DatabaseManager(
+    os.environ.get('DB_FILE', 'app_rest_gyn.db'),
+    pool_size=int(os.environ.get('DB_POOL_SIZE', 5)),
+    pragmas=db_pragmas
+)
+# Partições por tomador: pasta dos arquivos, conexões por arquivo e quantos ficam abertos
+db.particoes = GerenciadorParticoes(
+    db,
+    os.environ.get('TOMADORES_PASTA'),
+    pool_size=int(os.environ.get('TOMADORES_POOL_SIZE', 3)),
+    maximo_abertas=int(os.environ.get('TOMADORES_MAX_ABERTOS', 32))
+)
+
+# Estado do pool e do cache de referência, lidos a cada coleta de /metrics
+metricas.REGISTRO.medidor(
+    "db_pool_conexoes", "Conexões do pool por estado",
+    lambda: {(estado,): db.pool_stats()[estado] for estado in ('criadas', 'em_uso', 'ociosas', 'tamanho')},
+    ("estado",)
+)
+metricas.REGISTRO.medidor(
+    "db_pool_eventos", "Esperas e timeouts acumulados do pool",
+    lambda: {(evento,): db.pool_stats()[evento] for evento in ('reutilizadas', 'esperas', 'timeouts')},
+    ("evento",)
+)
+metricas.REGISTRO.medidor(
+    "cache_referencia_eventos", "Acertos e cargas do cache de dados de referência",
+    lambda: {(evento,): db.referencias.stats()[evento] for evento in ('acertos', 'cargas')},
+    ("evento",)
+)
+metricas.REGISTRO.medidor(
+    "db_particoes_abertas", "Partições por tomador com pool aberto",
+    lambda: db.particoes.stats()['abertas']
+)
+metricas.REGISTRO.medidor(
+    "cache_apuracao_eventos", "Acertos e cálculos do cache de apuração do ISS",
+    lambda: {(evento,): db.apuracoes.stats()[evento] for evento in ('acertos', 'calculos')},
+    ("evento",)
+)
+
+metricas.REGISTRO.medidor(
+    "cache_exportacao_eventos", "Acertos, gerações e descartes do cache de exportações",
+    lambda: {(evento,): db.exportacoes.stats()[evento] for evento in ('acertos', 'geracoes', 'descartes')},
+    ("evento",)
+)
+metricas.REGISTRO.medidor(
+    "snapshot_colunar_eventos", "Leituras e gerações de partições do snapshot colunar",
+    lambda: {(evento,): db.snapshot.stats()[evento] for evento in ('leituras', 'geracoes')},
+    ("evento",)
+)
 
 # Configurações para upload de arquivos
 UPLOAD_FOLDER = os.path.join(get_application_path(), 'uploads')
@@ -22,40 +86,222 @@ ALLOWED_EXTENSIONS = {'txt'}
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+# Tarefas em segundo plano: artefatos ficam em TAREFAS_PASTA por TAREFAS_RETENCAO segundos
+app.config['TAREFAS_PASTA'] = os.environ.get('TAREFAS_PASTA', os.path.join(get_application_path(), 'tarefas'))
+tarefas = GerenciadorTarefas(
+    db,
+    app.config['TAREFAS_PASTA'],
+    max_workers=int(os.environ.get('TAREFAS_WORKERS', 2)),
+    retencao=int(os.environ.get('TAREFAS_RETENCAO', 3600))
+)
+tarefas.limpar()
+
+# Paginação da API de notas fiscais
+app.config['NOTAS_PAGE_SIZE'] = int(os.environ.get('NOTAS_PAGE_SIZE', 100))
+app.config['NOTAS_PAGE_SIZE_MAX'] = int(os.environ.get('NOTAS_PAGE_SIZE_MAX', 1000))
+# Listagem da tela inicial (páginas numeradas)
+app.config['INDEX_PAGE_SIZE'] = int(os.environ.get('INDEX_PAGE_SIZE', 50))
+
+# Cache de exportações (Excel/TXT) em disco: pasta e tamanho máximo (MB; 0 desliga)
+if os.environ.get('EXPORT_CACHE_PASTA'):
+    db.exportacoes.pasta = os.environ['EXPORT_CACHE_PASTA']
+db.exportacoes.limite_bytes = int(os.environ.get('EXPORT_CACHE_MAX_MB', 200)) * 1024 * 1024
+
+# Snapshot colunar das notas: pasta e intervalo (segundos) da atualização em segundo plano (0 desliga;
+# as partições desatualizadas continuam sendo regeradas quando lidas)
+if os.environ.get('SNAPSHOT_PASTA'):
+    db.snapshot.pasta = os.environ['SNAPSHOT_PASTA']
+db.snapshot.iniciar(int(os.environ.get('SNAPSHOT_INTERVALO', 300)))
+
+# TXT de todos os tomadores em um ZIP: arquivos gerados ao mesmo tempo, no máximo
+app.config['EXPORT_TOMADORES_WORKERS'] = int(os.environ.get('EXPORT_TOMADORES_WORKERS', 4))
+
+# Tempo (segundos) que o navegador pode reutilizar UFs/municípios sem revalidar o ETag
+app.config['REFERENCIA_MAX_AGE'] = int(os.environ.get('REFERENCIA_MAX_AGE', 3600))
+
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+
+@app.before_request
+def identificar_usuario():
+    """Usuário gravado no journal: cabeçalho X-Usuario, usuário autenticado pelo servidor ou IP"""
+    journal.definir_usuario(request.headers.get('X-Usuario') or request.remote_user or request.remote_addr)
+
+@app.after_request
+def registrar_duracao(response):
+    """Duração da requisição: histograma por rota e log (DEBUG) com os campos estruturados"""
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is None:
+        return response
+    duracao = time.perf_counter() - inicio
+    rota = request.url_rule.rule if request.url_rule else '<desconhecida>'
+    if metricas.HABILITADO:
+        metricas.HTTP_DURACAO.observar(duracao, rota, request.method, str(response.status_code))
+    response.headers['Server-Timing'] = f'app;dur={duracao * 1000:.1f}'
+    if app.logger.isEnabledFor(logging.DEBUG):
+        app.logger.debug(
+            "%s %s %s %.1f ms", request.method, request.path, response.status_code, duracao * 1000,
+            extra={'rota': rota, 'metodo': request.method, 'status': response.status_code,
+                   'duracao_ms': round(duracao * 1000, 3)}
+        )
+    return response
+
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 @app.route('/')
 def index():
-    notas_fiscais = db.get_all_notas_fiscais()
-    return render_template('index.html', notas_fiscais=notas_fiscais)
+    """
+    Tela inicial: uma página da listagem de notas, com filtros, ordenação e links de página
+
+    Query string: os filtros de /api/notas, page (1...), page_size, ordem (ver
+    database.ORDENACOES_NOTAS) e direcao (asc/desc). O template é renderizado em
+    streaming e as notas (notas_fiscais) são lidas do banco enquanto a tabela é enviada;
+    o total vem dos agregados quando não há filtro ou só há referência.
+    """
+    filtros = filtros_listagem_request()
+    por_pagina = request.args.get('page_size', app.config['INDEX_PAGE_SIZE'], type=int)
+    por_pagina = max(1, min(por_pagina, app.config['NOTAS_PAGE_SIZE_MAX']))
+    pagina = max(1, request.args.get('page', 1, type=int))
+    ordem = request.args.get('ordem', 'dt_emissao')
+    direcao = request.args.get('direcao', 'desc')
+
+    try:
+        total = db.contar_notas(filtros)
+        notas_fiscais = db.iter_notas_fiscais_pagina(filtros, pagina, por_pagina, ordem, direcao)
+    except ValueError as e:
+        flash(str(e), 'error')
+        if request.args:
+            return redirect(url_for('index'))
+        notas_fiscais, total = [], 0
+    except Exception as e:
+        app.logger.error("Erro ao listar notas fiscais: %s", e)
+        flash('Erro ao listar notas fiscais', 'error')
+        notas_fiscais, total = [], 0
+
+    paginacao = _paginacao_index(total or 0, pagina, por_pagina, ordem, direcao.lower())
+    # A sessão é gravada antes do corpo em streaming: as mensagens são retiradas dela
+    # agora e ficam no contexto da requisição para o get_flashed_messages do template
+    get_flashed_messages(with_categories=True)
+    response = Response(
+        stream_template('index.html', notas_fiscais=notas_fiscais, paginacao=paginacao, filtros=filtros),
+        mimetype='text/html'
+    )
+    # Devolve a conexão ao pool mesmo se o cliente desconectar no meio da tabela
+    if hasattr(notas_fiscais, 'close'):
+        response.call_on_close(notas_fiscais.close)
+    return response
+
+def _paginacao_index(total, pagina, por_pagina, ordem, direcao, vizinhas=2):
+    """
+    Dados de paginação para o template: total, páginas, URLs (primeira, anterior,
+    próxima, última, janela de páginas numeradas) e a URL de ordenação de cada coluna
+    """
+    paginas = max(1, -(-total // por_pagina))
+    args = request.args.to_dict()
+    args.pop('page', None)
+
+    def url_pagina(numero):
+        return url_for('index', **args, page=numero)
+
+    ordenar = {}
+    for coluna in ORDENACOES_NOTAS:
+        # Clicar na coluna atual inverte a direção; uma nova coluna começa decrescente
+        nova_direcao = 'asc' if coluna == ordem and direcao == 'desc' else 'desc'
+        ordenar[coluna] = url_for('index', **{**args, 'ordem': coluna, 'direcao': nova_direcao})
+
+    janela = range(max(1, pagina - vizinhas), min(paginas, pagina + vizinhas) + 1)
+    return {
+        'total': total,
+        'pagina': pagina,
+        'paginas': paginas,
+        'por_pagina': por_pagina,
+        'inicio': min(total, (pagina - 1) * por_pagina + 1),
+        'fim': min(total, pagina * por_pagina),
+        'ordem': ordem,
+        'direcao': direcao,
+        'primeira': url_pagina(1) if pagina > 1 else None,
+        'anterior': url_pagina(pagina - 1) if pagina > 1 else None,
+        'proxima': url_pagina(pagina + 1) if pagina < paginas else None,
+        'ultima': url_pagina(paginas) if pagina < paginas else None,
+        'links': [{'numero': n, 'url': url_pagina(n), 'atual': n == pagina} for n in janela],
+        'ordenar': ordenar,
+    }
 
 @app.route('/api/notas')
 def get_notas():
+    """
+    Lista as notas fiscais paginadas por cursor (dt_emissao, id)
+
+    Parâmetros de query: referencia, cnpj, fornecedor, fornecedor_id, dt_inicio,
+    dt_fim, recolhimento, page_size e cursor. O corpo continua sendo a lista de notas;
+    o cursor da próxima página vai no cabeçalho X-Next-Cursor (e no Link rel="next").
+    Sem page_size nem cursor a resposta é a lista completa, como antes da paginação
+    (o dashboard em static/js/notas.js carrega a tabela assim), enviada em streaming.
+    """
+    return _pagina_notas(db, 'get_notas')
+
+def filtros_listagem_request():
+    """Filtros da listagem de notas (os de montar_filtro_notas) lidos da query string"""
+    return {
+        chave: request.args.get(chave)
+        for chave in ('referencia', 'cnpj', 'fornecedor', 'fornecedor_id',
+                      'dt_inicio', 'dt_fim', 'recolhimento')
+        if request.args.get(chave)
+    }
+
+def _pagina_notas(banco, endpoint, **argumentos_rota):
+    filtros = filtros_listagem_request()
+    if 'page_size' not in request.args and 'cursor' not in request.args:
+        return _todas_notas(banco, filtros)
+    page_size = request.args.get('page_size', app.config['NOTAS_PAGE_SIZE'], type=int)
+    page_size = max(1, min(page_size, app.config['NOTAS_PAGE_SIZE_MAX']))
+
     try:
-        notas_df = db.get_all_notas_fiscais()
-        if notas_df.empty:
-            return jsonify([])
-            
-        # Convert DataFrame to list of dictionaries
-        notas_list = notas_df.to_dict('records')
-        
-        # Format dates and numbers
-        for nota in notas_list:
-            if 'dt_emissao' in nota and nota['dt_emissao']:
-                nota['dt_emissao'] = pd.to_datetime(nota['dt_emissao']).strftime('%Y-%m-%d')
-            if 'dt_pagamento' in nota and nota['dt_pagamento']:
-                nota['dt_pagamento'] = pd.to_datetime(nota['dt_pagamento']).strftime('%Y-%m-%d')
-            if 'valor_nf' in nota:
-                nota['valor_nf'] = float(nota['valor_nf']) if nota['valor_nf'] else 0
-            if 'aliquota' in nota:
-                nota['aliquota'] = float(nota['aliquota']) if nota['aliquota'] else 0
-                
-        return jsonify(notas_list)
+        notas, proximo_cursor = banco.get_notas_fiscais_page(
+            filtros, request.args.get('cursor'), page_size
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error("Erro ao obter notas fiscais: %s", e)
+        return jsonify({'error': str(e)}), 500
+
+    response = jsonify(notas)
+    response.headers['X-Page-Size'] = str(page_size)
+    if proximo_cursor:
+        args = request.args.to_dict()
+        args.update(argumentos_rota, cursor=proximo_cursor, page_size=page_size)
+        response.headers['X-Next-Cursor'] = proximo_cursor
+        response.headers['Link'] = f'<{url_for(endpoint, **args)}>; rel="next"'
+    return response
+
+def _todas_notas(banco, filtros):
+    """Lista completa de notas em JSON, lida página a página (keyset) enquanto é enviada"""
+    lote = app.config['NOTAS_PAGE_SIZE_MAX']
+    try:
+        # A primeira página é lida antes da resposta: filtro inválido ainda vira 400
+        notas, proximo_cursor = banco.get_notas_fiscais_page(filtros, None, lote)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"Erro ao obter notas fiscais: {e}")
+        app.logger.error("Erro ao obter notas fiscais: %s", e)
         return jsonify({'error': str(e)}), 500
 
+    def gerar(notas, proximo_cursor):
+        separador = '['
+        while True:
+            for nota in notas:
+                yield separador + app.json.dumps(nota)
+                separador = ','
+            if not proximo_cursor:
+                break
+            notas, proximo_cursor = banco.get_notas_fiscais_page(filtros, proximo_cursor, lote)
+        yield '[]' if separador == '[' else ']'
+
+    return Response(stream_with_context(gerar(notas, proximo_cursor)), mimetype='application/json')
+
 @app.route('/nota', methods=['GET', 'POST'])
 def nota_fiscal():
     if request.method == 'POST':
@@ -121,7 +367,12 @@ def nota_fiscal():
             
             # Verificar se é edição ou cadastro novo
             nota_id = request.form.get('nota_id')
-            if nota_id:
+            duplicada_id = db.encontrar_nota_duplicada(
+                dados['cnpj'], dados['num_nf'], dados['referencia'], ignorar_id=nota_id or None
+            )
+            if duplicada_id is not None:
+                flash(f'Nota fiscal já cadastrada (ID {duplicada_id}) com o mesmo CNPJ, número e referência', 'warning')
+            elif nota_id:
                 # Atualizar nota fiscal existente
                 if db.update_nota_fiscal(nota_id, nota_fiscal_data):
                     flash('Nota fiscal atualizada com sucesso!', 'success')
@@ -169,10 +420,87 @@ def excluir_nota(nota_id):
         flash('Erro ao excluir nota fiscal', 'error')
     return redirect(url_for('index'))
 
+def _resposta_lote(operacao, **parametros):
+    """
+    Executa uma operação em lote do DatabaseManager com o corpo JSON da requisição
+
+    Corpo: {"filtros": {...}, "ids": [...], "simular": true|false, ...}. Responde com
+    as linhas afetadas (ou que seriam afetadas, na simulação).
+    """
+    corpo = request.get_json(silent=True) or {}
+    try:
+        resultado = operacao(**{nome: valor(corpo) for nome, valor in parametros.items()},
+                             simular=bool(corpo.get('simular')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if resultado is None:
+        return jsonify({'error': 'Erro ao executar a operação em lote'}), 500
+    return jsonify(resultado)
+
+def _filtros_lote(corpo):
+    filtros = corpo.get('filtros') or {}
+    if not isinstance(filtros, dict):
+        raise ValueError('"filtros" deve ser um objeto')
+    return filtros
+
+def _ids_lote(corpo):
+    ids = corpo.get('ids')
+    if ids is not None and not isinstance(ids, list):
+        raise ValueError('"ids" deve ser uma lista')
+    return ids
+
+@app.route('/api/notas/excluir', methods=['POST'])
+def excluir_notas_lote():
+    """Exclui as notas de um filtro (referencia, dt_inicio, dt_fim, cnpj, fornecedor_id, ...) e/ou lista de IDs"""
+    return _resposta_lote(db.excluir_notas_lote, filtros=_filtros_lote, ids=_ids_lote)
+
+@app.route('/api/notas/atualizar', methods=['POST'])
+def atualizar_notas_lote():
+    """Aplica {"campos": {...}} às notas do filtro e/ou lista de IDs ("permitir_duplicadas" opcional)"""
+    return _resposta_lote(
+        db.atualizar_notas_lote, filtros=_filtros_lote, ids=_ids_lote,
+        dados=lambda corpo: corpo.get('campos') or {},
+        permitir_duplicadas=lambda corpo: bool(corpo.get('permitir_duplicadas')),
+    )
+
+@app.route('/api/notas/<int:nota_id>', methods=['PATCH'])
+def atualizar_nota(nota_id):
+    """Atualiza só os campos enviados no corpo JSON"""
+    try:
+        atualizada = db.update_nota_fiscal(nota_id, request.get_json(silent=True) or {})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not atualizada:
+        return jsonify({'error': 'Nota fiscal não encontrada ou sem campos válidos'}), 404
+    return jsonify(db.get_nota_fiscal_by_id(nota_id))
+
+@app.route('/api/fornecedores/excluir', methods=['POST'])
+def excluir_fornecedores_lote():
+    """Exclui fornecedores por filtro (uf, municipio, sem_notas) e/ou lista de IDs; os com notas ficam"""
+    return _resposta_lote(db.excluir_fornecedores_lote, filtros=_filtros_lote, ids=_ids_lote)
+
+@app.route('/api/tomadores/excluir', methods=['POST'])
+def excluir_tomadores_lote():
+    """Exclui os tomadores da lista de IDs"""
+    return _resposta_lote(db.excluir_tomadores_lote, ids=_ids_lote)
+
+def resposta_referencia(dados, versao):
+    """
+    JSON de dados de referência com ETag (versão da tabela) e Cache-Control
+
+    Responde 304 quando o navegador envia If-None-Match com a versão atual.
+    """
+    response = jsonify(dados)
+    if versao is not None:
+        response.set_etag(f"ref-{versao}")
+        response.headers['Cache-Control'] = f"public, max-age={app.config['REFERENCIA_MAX_AGE']}"
+        response.make_conditional(request)
+    return response
+
 @app.route('/municipios/<uf>', methods=['GET'])
 def get_municipios(uf):
-    municipios = db.get_municipios_by_uf(uf)
-    return jsonify(municipios)
+    versao, municipios = db.get_municipios_versionado(uf)
+    return resposta_referencia(municipios, versao)
 
 @app.route('/fornecedor/<cnpj>', methods=['GET'])
 def get_fornecedor(cnpj):
@@ -191,10 +519,30 @@ def get_codigo_municipio():
     uf = request.args.get('uf')
     municipio = request.args.get('municipio')
     if uf and municipio:
-        codigo = db.get_cod_municipio(uf, municipio)
-        return jsonify({'codigo': codigo})
+        versao, codigo = db.get_cod_municipio_versionado(uf, municipio)
+        return resposta_referencia({'codigo': codigo}, versao)
     return jsonify({'codigo': ''})
 
+@app.route('/api/busca')
+def buscar():
+    """
+    Typeahead: busca por prefixo, sem acentos, em fornecedores, municípios e notas
+
+    Parâmetros: q (texto digitado), tipo (lista separada por vírgula: fornecedores,
+    municipios, notas), limite (por tipo) e uf (restringe municípios).
+    """
+    tipos = [t for t in request.args.get('tipo', '').split(',') if t] or None
+    try:
+        resultado = db.buscar(
+            request.args.get('q', ''),
+            tipos=tipos,
+            limite=request.args.get('limite', 10, type=int),
+            uf=request.args.get('uf') or None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(resultado)
+
 @app.route('/importar-municipios', methods=['GET', 'POST'])
 def importar_municipios():
     if request.method == 'POST':
@@ -216,19 +564,54 @@ def importar_municipios():
             arquivo.save(filepath)
             
             try:
-                if db.import_municipios_from_txt(filepath):
-                    flash('Municípios importados com sucesso!', 'success')
+                relatorio = db.import_municipios_from_txt(filepath)
+                if relatorio:
+                    flash(
+                        f"Municípios importados com sucesso! {relatorio['inseridos']} novos, "
+                        f"{relatorio['atualizados']} atualizados, {relatorio['rejeitados']} rejeitados "
+                        f"({relatorio['linhas_por_segundo']} linhas/s)",
+                        'success'
+                    )
+                    for erro in relatorio['erros'][:10]:
+                        flash(f"Linha {erro['linha']}: {erro['erro']}", 'warning')
                 else:
                     flash('Erro ao importar municípios', 'error')
             except Exception as e:
                 flash(f'Erro ao importar municípios: {str(e)}', 'error')
-            
-            # Remover arquivo após importação
-            os.remove(filepath)
+            finally:
+                # Remover arquivo após importação
+                os.remove(filepath)
             return redirect(url_for('index'))
     
     return render_template('importar_municipios.html')
 
+@app.route('/api/notas/importar', methods=['POST'])
+def importar_notas():
+    """Importa notas fiscais em lote (CSV, TXT delimitado ou XLSX) e devolve o relatório em JSON"""
+    from importacao_notas import EXTENSOES_IMPORTACAO
+
+    arquivo = request.files.get('arquivo')
+    if not arquivo or arquivo.filename == '':
+        return jsonify({'error': 'Nenhum arquivo enviado'}), 400
+
+    filename = secure_filename(arquivo.filename)
+    extensao = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extensao not in EXTENSOES_IMPORTACAO:
+        return jsonify({'error': f'Formato não suportado: {extensao or filename}'}), 400
+
+    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    arquivo.save(filepath)
+    try:
+        relatorio = db.import_notas_from_file(filepath, duplicadas=request.values.get('duplicadas', 'rejeitar'))
+        return jsonify(relatorio)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error("Erro ao importar notas fiscais: %s", e)
+        return jsonify({'error': str(e)}), 500
+    finally:
+        os.remove(filepath)
+
 @app.route('/tomadores', methods=['GET'])
 def listar_tomadores():
     tomadores = db.get_all_tomadores()
@@ -271,7 +654,7 @@ def insert_tomador(self, dados):
             usuario = dados.get('usuario', '').strip()
             
             if not razao_social:
-                print("Erro: Razão Social é obrigatória")
+                app.logger.warning("Razão Social é obrigatória")
                 return False
             
             # Inserir apenas os campos básicos para garantir compatibilidade
@@ -282,13 +665,13 @@ def insert_tomador(self, dados):
             """, (razao_social, cnpj, inscricao, usuario))
             
             # Registrar os dados inseridos para debug
-            print(f"Tomador inserido: {razao_social}, {cnpj}, {inscricao}, {usuario}")
+            app.logger.info("Tomador inserido: %s, %s, %s, %s", razao_social, cnpj, inscricao, usuario)
             
             conn.commit()
             return True
             
         except Exception as e:
-            print(f"Erro detalhado ao inserir tomador: {str(e)}")
+            app.logger.error("Erro detalhado ao inserir tomador: %s", e)
             conn.rollback()
             return False
         finally:
@@ -308,7 +691,7 @@ def adicionar_tomador():
         }
         
         # Adicionar log para debug
-        print(f"Dados recebidos do formulário: {dados}")
+        app.logger.debug("Dados recebidos do formulário: %s", dados)
         
         # Validações básicas
         if not dados['razao_social']:
@@ -344,8 +727,7 @@ def excluir_tomador(tomador_id):
 def editar_tomador(tomador_id):
     """Edita um tomador existente"""
     # Obter dados do tomador
-    tomadores = db.get_all_tomadores()
-    tomador = next((t for t in tomadores if t[0] == tomador_id), None)
+    tomador = db.get_tomador_by_id(tomador_id)
     
     if not tomador:
         flash('Tomador não encontrado', 'danger')
@@ -378,50 +760,91 @@ def editar_tomador(tomador_id):
     # Para GET, renderizar o formulário com dados preenchidos
     return render_template('form_tomador.html', edit_mode=True, tomador=tomador)
 
+def filtros_notas_request():
+    """Filtros de notas (referencia, dt_inicio, dt_fim, cnpj, fornecedor_id) da query string ou do formulário"""
+    return {
+        chave: request.values.get(chave)
+        for chave in ('referencia', 'dt_inicio', 'dt_fim', 'cnpj', 'fornecedor_id')
+        if request.values.get(chave)
+    }
+
+def enviar_e_remover(caminho, tamanho_bloco=64 * 1024):
+    """Envia um arquivo temporário em blocos e o remove ao final (ou se o download for interrompido)"""
+    try:
+        with open(caminho, 'rb') as arquivo:
+            while True:
+                bloco = arquivo.read(tamanho_bloco)
+                if not bloco:
+                    break
+                yield bloco
+    finally:
+        os.remove(caminho)
+
+def _revalidar_exportacao(response, chave):
+    """ETag (chave do cache) e Cache-Control: o navegador guarda o arquivo e revalida a cada pedido"""
+    if chave:
+        response.set_etag(chave)
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+def _exportacao_nao_modificada(chave):
+    """304 se o navegador já tem o arquivo desta chave (mesmos filtros e mesma versão dos dados)"""
+    if chave and request.method == 'GET' and chave in request.if_none_match:
+        return _revalidar_exportacao(Response(status=304), chave)
+    return None
+
 @app.route('/exportar-excel', methods=['GET', 'POST'])
 def exportar_excel():
+    """
+    Exporta as notas para Excel (aba de notas e resumo por fornecedor)
+
+    Aceita os mesmos filtros de /exportar-txt, tomador_id e resumo=0 para omitir o resumo.
+    O arquivo fica no cache de exportações até os dados mudarem (ETag/If-None-Match).
+    """
+    parametros = _parametros_exportacao()
     try:
-        # Criar arquivo temporário
-        temp_file = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
-        temp_file.close()
-        
-        if db.export_to_excel(temp_file.name):
-            # Enviar arquivo para download
-            return send_file(
-                temp_file.name,
-                as_attachment=True,
-                download_name='notas_fiscais.xlsx',
-                mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-            )
+        chave = db.exportacoes.chave('xlsx', **parametros)
+        nao_modificada = _exportacao_nao_modificada(chave)
+        if nao_modificada is not None:
+            return nao_modificada
+        if chave is None:
+            gerado = None
         else:
-            flash('Erro ao exportar dados', 'error')
-            return redirect(url_for('index'))
+            gerado = db.exportacoes.gerar(chave, 'xlsx', lambda caminho: db.export_to_excel(caminho, **parametros))
     except Exception as e:
         flash(f'Erro ao exportar para Excel: {str(e)}', 'error')
         return redirect(url_for('index'))
+    if gerado is None:
+        flash('Erro ao exportar dados', 'error')
+        return redirect(url_for('index'))
+
+    caminho, temporario = gerado
+    mimetype = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+    if temporario:
+        # Maior que o cache inteiro: enviado e removido, como antes do cache
+        response = Response(
+            enviar_e_remover(caminho),
+            mimetype=mimetype,
+            headers={
+                'Content-Disposition': 'attachment; filename=notas_fiscais.xlsx',
+                'Content-Length': str(os.path.getsize(caminho)),
+            }
+        )
+        return _revalidar_exportacao(response, chave)
+    response = send_file(caminho, mimetype=mimetype, as_attachment=True, download_name='notas_fiscais.xlsx',
+                         conditional=False)
+    return _revalidar_exportacao(response, chave)
 
 @app.route('/exportar-txt-especifico', methods=['GET', 'POST'])
 def exportar_txt_especifico():
+    """Baixa o arquivo de exemplo do layout TXT da prefeitura"""
     try:
-        # Criar arquivo temporário
-        temp_file = tempfile.NamedTemporaryFile(suffix='.txt', delete=False, mode='w', encoding='utf-8')
-        
-        # Escrever o conteúdo específico
-        content = """H242545920250610KLB ACCOUTING CONTABILIDADE EMPRESARIAL EIRELI                                                      
-09238316000190 N                                                                                                                                                                                        
-20250610marcelo.santos@kblcontabilidade.com.br2.9.7N                                                                                                                                                      
-D00000100000000000000012345678000190Empresa ABC Ltda                                  12.345.678/0001-900000000005000000000000000175002025011520250115                                                  J                         050022025011500350300000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000000017500000000000000000000000000000000000000
-T000010000000000"""
-        
-        temp_file.write(content)
-        temp_file.close()
-        
-        # Enviar arquivo para download
-        return send_file(
-            temp_file.name,
-            as_attachment=True,
-            download_name='exportacao_especifica.txt',
-            mimetype='text/plain'
+        content = arquivo_exemplo()
+        return Response(
+            content,
+            mimetype='text/plain',
+            headers={'Content-Disposition': 'attachment; filename=exportacao_especifica.txt'}
         )
     except Exception as e:
         flash(f'Erro ao exportar para TXT: {str(e)}', 'error')
@@ -429,26 +852,71 @@ T000010000000000"""
 
 @app.route('/exportar-txt', methods=['GET', 'POST'])
 def exportar_txt():
+    """
+    Exporta as notas para o TXT da prefeitura em streaming
+
+    Filtros opcionais (query string ou formulário): referencia, dt_inicio, dt_fim,
+    cnpj, fornecedor_id e tomador_id (dados do cabeçalho).
+    """
     try:
-        # Criar arquivo temporário
-        temp_file = tempfile.NamedTemporaryFile(suffix='.txt', delete=False, mode='w', encoding='utf-8')
-        temp_file.close()
-        
-        if db.export_to_txt(temp_file.name):
-            # Enviar arquivo para download
-            return send_file(
-                temp_file.name,
-                as_attachment=True,
-                download_name='notas_fiscais.txt',
-                mimetype='text/plain'
-            )
-        else:
-            flash('Erro ao exportar dados para TXT', 'error')
-            return redirect(url_for('index'))
+        return resposta_txt(db, filtros_notas_request(), request.values.get('tomador_id', type=int),
+                            'notas_fiscais.txt')
     except Exception as e:
         flash(f'Erro ao exportar para TXT: {str(e)}', 'error')
         return redirect(url_for('index'))
 
+def resposta_txt(banco, filtros, tomador_id, nome_arquivo):
+    """
+    TXT da prefeitura do cache de exportações ou gerado em streaming (e guardado ao terminar)
+
+    :raises ValueError: se o tomador não for encontrado
+    """
+    chave = banco.exportacoes.chave('txt', filtros, tomador_id=tomador_id)
+    nao_modificada = _exportacao_nao_modificada(chave)
+    if nao_modificada is not None:
+        return nao_modificada
+    caminho = banco.exportacoes.obter(chave, 'txt') if chave else None
+    if caminho is not None:
+        response = send_file(caminho, mimetype='text/plain', as_attachment=True, download_name=nome_arquivo,
+                             conditional=False)
+        return _revalidar_exportacao(response, chave)
+
+    pedacos = banco.iter_export_txt(filtros, tomador_id)
+    if chave:
+        pedacos = banco.exportacoes.gravar_e_repassar(chave, 'txt', pedacos)
+    response = Response(
+        stream_with_context(pedacos),
+        mimetype='text/plain',
+        headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'}
+    )
+    return _revalidar_exportacao(response, chave)
+
+@app.route('/exportar-txt-tomadores', methods=['GET', 'POST'])
+def exportar_txt_tomadores():
+    """
+    ZIP com o TXT da prefeitura de cada tomador (cabeçalho do próprio cadastro), em streaming
+
+    Filtros de /exportar-txt, tomadores=1,2 (padrão: todos) e workers (arquivos gerados
+    ao mesmo tempo, até EXPORT_TOMADORES_WORKERS). O resumo.json do ZIP traz origem,
+    tamanho, tempo e erro de cada tomador.
+    """
+    maximo = app.config['EXPORT_TOMADORES_WORKERS']
+    workers = max(1, min(request.values.get('workers', maximo, type=int), maximo))
+    tomadores = request.values.get('tomadores')
+    try:
+        if tomadores:
+            tomadores = [int(t) for t in tomadores.split(',') if t.strip()]
+        pedacos = db.iter_export_txt_tomadores(filtros_notas_request(), tomadores or None, workers)
+    except ValueError as e:
+        flash(f'Erro ao exportar para TXT: {str(e)}', 'error')
+        return redirect(url_for('index'))
+
+    return Response(
+        stream_with_context(pedacos),
+        mimetype='application/zip',
+        headers={'Content-Disposition': 'attachment; filename=notas_fiscais_tomadores.zip'}
+    )
+
 @app.route('/limpar-notas', methods=['POST'])
 def limpar_notas():
     if request.form.get('confirmar') == 'sim':
@@ -469,51 +937,13 @@ def limpar_tomadores():
 
 @app.route('/api/estatisticas')
 def get_estatisticas():
-    conn = db.create_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            
-            # Total de notas fiscais
-            cursor.execute("SELECT COUNT(*) FROM tb_notas_fiscais")
-            total_notas = cursor.fetchone()[0]
-            
-            # Total de fornecedores
-            cursor.execute("SELECT COUNT(*) FROM tb_fornecedores")
-            total_fornecedores = cursor.fetchone()[0]
-            
-            # Total de tomadores
-            cursor.execute("SELECT COUNT(*) FROM tb_config_tomador")
-            total_tomadores = cursor.fetchone()[0]
-            
-            # Valor total das notas
-            cursor.execute("SELECT COALESCE(SUM(valor_nf), 0) FROM tb_notas_fiscais")
-            valor_total = float(cursor.fetchone()[0] or 0)
-            
-            # Valor total do ISS
-            cursor.execute("SELECT COALESCE(SUM(valor_nf * aliquota / 100), 0) FROM tb_notas_fiscais")
-            valor_iss = float(cursor.fetchone()[0] or 0)
-            
-            return jsonify({
-                'total_notas': total_notas,
-                'total_fornecedores': total_fornecedores,
-                'total_tomadores': total_tomadores,
-                'valor_total': valor_total,
-                'valor_iss': valor_iss
-            })
-            
-        except Exception as e:
-            print(f"Erro ao obter estatísticas: {e}")
-            return jsonify({
-                'total_notas': 0,
-                'total_fornecedores': 0,
-                'total_tomadores': 0,
-                'valor_total': 0,
-                'valor_iss': 0
-            }), 500
-        finally:
-            conn.close()
-    
+    try:
+        estatisticas = db.get_estatisticas()
+        if estatisticas is not None:
+            return jsonify(estatisticas)
+    except Exception as e:
+        app.logger.error("Erro ao obter estatísticas: %s", e)
+
     return jsonify({
         'total_notas': 0,
         'total_fornecedores': 0,
@@ -522,6 +952,299 @@ def get_estatisticas():
         'valor_iss': 0
     }), 500
 
+@app.route('/api/estatisticas/<dimensao>')
+def get_estatisticas_por(dimensao):
+    """
+    Quantidade, valor total e ISS por referencia, uf, tipo_servico ou recolhimento (agregados),
+    ou por mes_emissao, mes_pagamento ou fornecedor (snapshot colunar)
+    """
+    try:
+        return jsonify(db.get_estatisticas_por(dimensao))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/apuracao')
+def get_apuracao():
+    """
+    Apuração do ISS da competência (?referencia=MM/AAAA[&tomador_id=]): totais, ISS devido e retido
+    por fornecedor, tipo de serviço e base de cálculo, e alertas. Valores em centavos.
+    """
+    return _resposta_apuracao(db, request.args.get('tomador_id', type=int))
+
+def _resposta_apuracao(banco, tomador_id=None):
+    try:
+        apuracao = banco.apurar(request.args.get('referencia', ''), tomador_id)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if apuracao is None:
+        return jsonify({'error': 'Erro ao apurar o ISS'}), 500
+    resposta = jsonify(apuracao)
+    resposta.headers['X-Apuracao-Versao'] = apuracao['versao']
+    return resposta
+
+def _banco_tomador(tomador_id):
+    """Partição do tomador; retorna (banco, None) ou (None, resposta 404)"""
+    try:
+        return db.banco_tomador(tomador_id), None
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 404)
+
+@app.route('/api/tomadores/<int:tomador_id>/notas')
+def get_notas_tomador(tomador_id):
+    """Notas da partição do tomador (mesmos parâmetros de /api/notas)"""
+    banco, erro = _banco_tomador(tomador_id)
+    return erro or _pagina_notas(banco, 'get_notas_tomador', tomador_id=tomador_id)
+
+@app.route('/api/tomadores/<int:tomador_id>/estatisticas')
+def get_estatisticas_tomador(tomador_id):
+    banco, erro = _banco_tomador(tomador_id)
+    if erro:
+        return erro
+    estatisticas = banco.get_estatisticas()
+    if estatisticas is None:
+        return jsonify({'error': 'Erro ao obter estatísticas'}), 500
+    return jsonify(estatisticas)
+
+@app.route('/api/tomadores/<int:tomador_id>/apuracao')
+def get_apuracao_tomador(tomador_id):
+    """Apuração do ISS (?referencia=MM/AAAA) das notas da partição do tomador"""
+    banco, erro = _banco_tomador(tomador_id)
+    return erro or _resposta_apuracao(banco, tomador_id)
+
+@app.route('/api/tomadores/<int:tomador_id>/notas/excluir', methods=['POST'])
+def excluir_notas_tomador(tomador_id):
+    banco, erro = _banco_tomador(tomador_id)
+    return erro or _resposta_lote(banco.excluir_notas_lote, filtros=_filtros_lote, ids=_ids_lote)
+
+@app.route('/api/tomadores/<int:tomador_id>/notas/atualizar', methods=['POST'])
+def atualizar_notas_tomador(tomador_id):
+    banco, erro = _banco_tomador(tomador_id)
+    return erro or _resposta_lote(
+        banco.atualizar_notas_lote, filtros=_filtros_lote, ids=_ids_lote,
+        dados=lambda corpo: corpo.get('campos') or {},
+        permitir_duplicadas=lambda corpo: bool(corpo.get('permitir_duplicadas')),
+    )
+
+@app.route('/api/tomadores/<int:tomador_id>/exportar-txt')
+def exportar_txt_tomador(tomador_id):
+    """TXT da prefeitura com as notas da partição do tomador, em streaming"""
+    banco, erro = _banco_tomador(tomador_id)
+    if erro:
+        return erro
+    try:
+        return resposta_txt(banco, filtros_notas_request(), tomador_id, f'notas_fiscais_tomador_{tomador_id}.txt')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+@app.route('/api/relatorios/tomadores')
+def relatorio_tomadores():
+    """
+    Estatísticas de cada tomador com partição e o consolidado, consultados em paralelo
+
+    ?referencia=MM/AAAA inclui a apuração do ISS; ?tomadores=1,2 restringe os tomadores.
+    Valores da apuração em centavos.
+    """
+    tomadores = request.args.get('tomadores')
+    try:
+        if tomadores:
+            tomadores = [int(t) for t in tomadores.split(',') if t.strip()]
+        relatorio = db.relatorio_tomadores(request.args.get('referencia') or None, tomadores or None)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(relatorio)
+
+@app.route('/api/pool')
+def get_pool_stats():
+    """Estatísticas do pool de conexões do banco de dados"""
+    return jsonify(db.pool_stats())
+
+@app.route('/api/arquivo')
+def listar_arquivadas():
+    """Competências arquivadas com quantidade, valor e ISS (centavos)"""
+    return jsonify(db.listar_arquivadas())
+
+def _resposta_arquivo(operacao):
+    referencia = (request.get_json(silent=True) or {}).get('referencia') or request.values.get('referencia', '')
+    try:
+        resumo = operacao(referencia)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if resumo is None:
+        return jsonify({'error': 'Erro ao mover a competência'}), 500
+    return jsonify(resumo)
+
+@app.route('/api/arquivo/arquivar', methods=['POST'])
+def arquivar_referencia():
+    """Move a competência fechada {"referencia": "MM/AAAA"} para o arquivo do ano"""
+    return _resposta_arquivo(db.arquivar_referencia)
+
+@app.route('/api/arquivo/restaurar', methods=['POST'])
+def restaurar_referencia():
+    """Devolve a competência arquivada {"referencia": "MM/AAAA"} para a tabela de notas"""
+    return _resposta_arquivo(db.restaurar_referencia)
+
+def _tabelas_journal(valor):
+    if isinstance(valor, str):
+        valor = [t.strip() for t in valor.split(',')]
+    return [t for t in valor or () if t] or None
+
+@app.route('/api/journal')
+def alteracoes_journal():
+    """
+    Alterações (antes/depois) registradas depois do seq ?desde=, em ordem
+
+    ?limite= (até 5000) e ?tabelas=tb_notas_fiscais,tb_fornecedores. Para acompanhar,
+    repita com desde=ultimo enquanto "mais" for true.
+    """
+    try:
+        feed = db.alteracoes_journal(
+            request.args.get('desde', 0, type=int), request.args.get('limite', 1000, type=int),
+            _tabelas_journal(request.args.get('tabelas'))
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if feed is None:
+        return jsonify({'error': 'Erro ao ler o journal'}), 500
+    response = jsonify(feed)
+    response.headers['X-Journal-Versao'] = str(feed['atual'])
+    return response
+
+@app.route('/api/journal/desfazer', methods=['POST'])
+def desfazer_alteracoes():
+    """Reverte as alterações posteriores a {"desde": seq} ou {"momento": "AAAA-MM-DD HH:MM:SS"} (UTC)"""
+    corpo = request.get_json(silent=True) or {}
+    desde = corpo.get('desde')
+    if desde is None and not corpo.get('momento'):
+        return jsonify({'error': 'Informe desde (seq do journal) ou momento'}), 400
+    try:
+        resumo = db.desfazer_alteracoes(
+            int(desde) if desde is not None else None, corpo.get('momento'),
+            _tabelas_journal(corpo.get('tabelas')), bool(corpo.get('simular'))
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    if resumo is None:
+        return jsonify({'error': 'Erro ao desfazer alterações'}), 500
+    return jsonify(resumo)
+
+def _tabelas_duplicatas():
+    tabelas = request.values.get('tabelas')
+    return [t.strip() for t in tabelas.split(',') if t.strip()] if tabelas else None
+
+@app.route('/api/duplicatas')
+def relatorio_duplicatas():
+    """Simulação: grupos e registros duplicados por tabela (?tabelas=tb_uf,tb_notas_fiscais)"""
+    try:
+        relatorio = db.deduplicar(_tabelas_duplicatas())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if relatorio is None:
+        return jsonify({'error': 'Erro ao verificar duplicatas'}), 500
+    return jsonify(relatorio)
+
+@app.route('/api/duplicatas/mesclar', methods=['POST'])
+def mesclar_duplicatas():
+    """Reaponta as referências para o registro mantido e remove os duplicados"""
+    try:
+        relatorio = db.deduplicar(_tabelas_duplicatas(), executar=True)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if relatorio is None:
+        return jsonify({'error': 'Erro ao mesclar duplicatas'}), 500
+    return jsonify(relatorio)
+
+def _parametros_exportacao():
+    return {
+        'filtros': filtros_notas_request(),
+        'tomador_id': request.values.get('tomador_id', type=int),
+        'resumo': request.values.get('resumo', '1') != '0',
+    }
+
+def _salvar_arquivo_tarefa(extensoes):
+    """Salva o arquivo enviado na pasta de tarefas; retorna (caminho, None) ou (None, resposta de erro)"""
+    arquivo = request.files.get('arquivo')
+    if not arquivo or arquivo.filename == '':
+        return None, (jsonify({'error': 'Nenhum arquivo enviado'}), 400)
+    filename = secure_filename(arquivo.filename)
+    extensao = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extensao not in extensoes:
+        return None, (jsonify({'error': f'Formato não suportado: {extensao or filename}'}), 400)
+    caminho = os.path.join(app.config['TAREFAS_PASTA'], f"entrada_{uuid.uuid4().hex}_{filename}")
+    arquivo.save(caminho)
+    return caminho, None
+
+@app.route('/api/tarefas/<tipo>', methods=['POST'])
+def criar_tarefa(tipo):
+    """
+    Agenda uma importação ou exportação e responde 202 com o ID da tarefa
+
+    Tipos: exportar_excel e exportar_txt (mesmos filtros de /exportar-excel),
+    importar_municipios e importar_notas (arquivo no campo "arquivo"). Com
+    particao=<tomador_id> a tarefa usa o arquivo do tomador.
+    """
+    particao = request.values.get('particao', type=int)
+    if particao is not None:
+        _, erro = _banco_tomador(particao)
+        if erro:
+            return erro
+
+    if tipo in ('exportar_excel', 'exportar_txt'):
+        parametros = _parametros_exportacao()
+    elif tipo in ('importar_municipios', 'importar_notas'):
+        from importacao_notas import EXTENSOES_IMPORTACAO
+
+        extensoes = ALLOWED_EXTENSIONS if tipo == 'importar_municipios' else EXTENSOES_IMPORTACAO
+        caminho, erro = _salvar_arquivo_tarefa(extensoes)
+        if erro:
+            return erro
+        parametros = {'arquivo': caminho}
+        if tipo == 'importar_notas':
+            parametros['duplicadas'] = request.values.get('duplicadas', 'rejeitar')
+    else:
+        return jsonify({'error': f'Tipo de tarefa inválido: {tipo}'}), 404
+    if particao is not None:
+        parametros['particao'] = particao
+
+    tarefa_id = tarefas.submeter(tipo, parametros)
+    resposta = jsonify({'id': tarefa_id, 'status': 'pendente', 'url': url_for('get_tarefa', tarefa_id=tarefa_id)})
+    resposta.status_code = 202
+    resposta.headers['Location'] = url_for('get_tarefa', tarefa_id=tarefa_id)
+    return resposta
+
+@app.route('/api/tarefas')
+def listar_tarefas():
+    return jsonify(tarefas.listar(request.args.get('limite', 50, type=int)))
+
+@app.route('/api/tarefas/<tarefa_id>')
+def get_tarefa(tarefa_id):
+    """Status, processadas, total, percentual e eta_segundos da tarefa"""
+    tarefa = tarefas.obter(tarefa_id)
+    if tarefa is None:
+        return jsonify({'error': 'Tarefa não encontrada'}), 404
+    if tarefa['disponivel']:
+        tarefa['download'] = url_for('download_tarefa', tarefa_id=tarefa_id)
+    return jsonify(tarefa)
+
+@app.route('/api/tarefas/<tarefa_id>/cancelar', methods=['POST'])
+def cancelar_tarefa(tarefa_id):
+    if not tarefas.cancelar(tarefa_id):
+        return jsonify({'error': 'Tarefa não encontrada ou já finalizada'}), 409
+    return jsonify({'id': tarefa_id, 'cancelamento_solicitado': True}), 202
+
+@app.route('/api/tarefas/<tarefa_id>/download')
+def download_tarefa(tarefa_id):
+    """Baixa o artefato de uma tarefa concluída (disponível até a limpeza por retenção)"""
+    artefato = tarefas.artefato(tarefa_id)
+    if artefato is None:
+        return jsonify({'error': 'Artefato não disponível'}), 404
+    caminho, nome = artefato
+    return send_file(caminho, as_attachment=True, download_name=nome)
+
+@app.route('/metrics')
+def get_metrics():
+    """Métricas no formato de texto do Prometheus"""
+    return Response(metricas.REGISTRO.renderizar(), content_type=metricas.CONTENT_TYPE)
+
 @app.route('/fornecedores')
 def listar_fornecedores():
     """Lista todos os fornecedores cadastrados"""
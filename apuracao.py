@@ -0,0 +1,440 @@
+# Arquivo: apuracao.py
+"""
+Apuração do ISS por competência (referência) e tomador
+
+As notas da competência vêm da partição da referência no snapshot colunar
+(snapshot_colunar.py, mapeada em memória e já em centavos) ou, sem ele, são
+lidas do cursor em lotes e montadas em colunas (arrays NumPy); todo o cálculo
+é vetorizado e feito em centavos inteiros:
+
+- valor da nota em centavos (arredondado uma vez, como nos agregados);
+- alíquota em centésimos de ponto percentual (2,5% -> 250);
+- ISS = valor_centavos * aliquota_centesimos / 10000, arredondado meio-para-cima.
+
+O tipo de serviço define se há ISS e se ele é retido pelo tomador
+(REGRAS_TIPO_SERVICO). Prestador de fora do país ou não cadastrado em Goiânia
+tem o ISS sempre retido. A mesma regra, em versão escalar (iss_nota), é usada
+no registro de detalhe da exportação TXT, então o arquivo fecha com a apuração.
+
+O resultado fica em cache por (tomador, referência). A versão de cada
+referência é um contador em tb_versao_referencia, incrementado por triggers
+(migração 9) a cada alteração de nota, e fornecedores e tomadores têm
+contadores em tb_versao_dados: alterar uma nota só invalida a sua competência.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from snapshot_colunar import colunas_apuracao
+
+logger = logging.getLogger(__name__)
+
+# código do tipo de serviço (dois primeiros caracteres) -> (há ISS, retido pelo tomador)
+REGRAS_TIPO_SERVICO = {
+    "00": (True, True),    # Normal
+    "02": (False, False),  # Imune
+    "03": (True, True),    # Art. 54 do CTM (responsabilidade do tomador)
+    "04": (True, False),   # Liminar: exigibilidade discutida pelo prestador
+    "05": (True, True),    # Simples Nacional (alíquota informada na nota)
+    "07": (True, False),   # ISS Estimado: recolhido pelo prestador
+    "08": (False, False),  # Não incidência
+    "09": (False, False),  # Isento
+    "10": (True, False),   # Imposto Fixo: recolhido pelo prestador
+}
+# Tipo ausente ou desconhecido é apurado como normal (e aparece nos alertas)
+TIPO_PADRAO = "00"
+
+# Faixa legal da alíquota do ISS (LC 116/2003), em centésimos de ponto percentual
+ALIQUOTA_MINIMA = 200
+ALIQUOTA_MAXIMA = 500
+
+# Notas listadas por alerta no resultado
+MAX_NOTAS_ALERTA = 20
+
+# Tabelas (além das notas) cujo contador em tb_versao_dados entra na versão da apuração
+TABELAS_VERSIONADAS = ("tb_fornecedores", "tb_config_tomador")
+
+# Colunas da nota que alteram a apuração (UPDATE só dessas colunas muda a versão)
+COLUNAS_APURACAO = (
+    "referencia", "cnpj", "fornecedor_id", "tipo_servico", "base_calculo",
+    "aliquota", "valor_nf", "fora_pais", "cadastrado_goiania",
+)
+
+# Texto normalizado, números convertidos como na aritmética das triggers dos agregados
+# e indicadores Sim/Não já no SQL: o Python só monta as colunas
+SQL_NOTAS_APURACAO = """
+    SELECT nf.id,
+           COALESCE(TRIM(nf.cnpj), ''),
+           COALESCE(TRIM(f.descricao_fornecedor), ''),
+           COALESCE(TRIM(nf.tipo_servico), ''),
+           COALESCE(TRIM(nf.base_calculo), ''),
+           CAST(nf.aliquota AS REAL),
+           CAST(nf.valor_nf AS REAL),
+           UPPER(SUBSTR(TRIM(COALESCE(nf.fora_pais, '')), 1, 1)) = 'S',
+           UPPER(SUBSTR(TRIM(COALESCE(nf.cadastrado_goiania, '')), 1, 1)) = 'S'
+    FROM tb_notas_fiscais nf
+    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+    WHERE nf.referencia = ?
+"""
+
+# (coluna, dtype NumPy) na ordem de SQL_NOTAS_APURACAO
+COLUNAS = [
+    ("id", "int64"),
+    ("cnpj", "object"),
+    ("fornecedor", "object"),
+    ("tipo_servico", "object"),
+    ("base_calculo", "object"),
+    ("aliquota", "float64"),
+    ("valor_nf", "float64"),
+    ("fora_pais", "bool"),
+    ("cadastrado_goiania", "bool"),
+]
+
+ALERTAS = {
+    "valor_ausente": "Nota sem valor",
+    "valor_negativo": "Valor da nota negativo",
+    "valor_zero": "Valor da nota igual a zero",
+    "aliquota_fora_da_faixa": "Alíquota fora da faixa de 2% a 5% em nota tributada",
+    "tipo_servico_desconhecido": "Tipo de serviço ausente ou desconhecido (apurado como normal)",
+    "cnpj_invalido": "CNPJ/CPF sem 14 ou 11 dígitos",
+}
+
+
+def sql_triggers_versao_referencia():
+    """Comandos CREATE TRIGGER que incrementam tb_versao_referencia a cada alteração de nota"""
+    def incrementar(p):
+        # Versão inicial pelo relógio: um banco recriado do zero não repete versões antigas
+        return f"""
+            INSERT INTO tb_versao_referencia (referencia, versao)
+            VALUES (COALESCE({p}referencia, ''), CAST(strftime('%s', 'now') AS INTEGER))
+            ON CONFLICT (referencia) DO UPDATE SET versao = versao + 1;"""
+
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_versao_referencia_ins AFTER INSERT ON tb_notas_fiscais
+            BEGIN {incrementar("NEW.")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_versao_referencia_del AFTER DELETE ON tb_notas_fiscais
+            BEGIN {incrementar("OLD.")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_versao_referencia_upd
+            AFTER UPDATE OF {', '.join(COLUNAS_APURACAO)} ON tb_notas_fiscais
+            BEGIN {incrementar("OLD.")} {incrementar("NEW.")} END""",
+    ]
+
+
+def _sim(valor):
+    return str(valor or "").strip().upper().startswith("S")
+
+
+def centavos(valor):
+    """Valor em reais -> centavos inteiros (meio para longe do zero, como o ROUND do SQLite)"""
+    if valor is None or valor == "":
+        return 0
+    valor = float(valor) * 100
+    return int(valor + 0.5) if valor >= 0 else -int(-valor + 0.5)
+
+
+def iss_nota(valor_centavos, aliquota, tipo_servico, fora_pais=None, cadastrado_goiania=None):
+    """
+    ISS de uma nota em centavos, pela mesma regra da apuração vetorizada
+
+    :param aliquota: Alíquota em percentual (ex.: 2.5)
+    :return: Tupla (ISS devido, ISS retido pelo tomador)
+    """
+    ha_iss, retido = REGRAS_TIPO_SERVICO.get(str(tipo_servico or "")[:2], REGRAS_TIPO_SERVICO[TIPO_PADRAO])
+    if not ha_iss:
+        return 0, 0
+    aliquota = centavos(aliquota)
+    iss = (abs(valor_centavos) * aliquota + 5000) // 10000
+    if valor_centavos < 0:
+        iss = -iss
+    if retido or _sim(fora_pais) or not _sim(cadastrado_goiania):
+        return iss, iss
+    return iss, 0
+
+
+def _carregar_colunas(cursor, referencia, lote):
+    """Lê as notas da referência em lotes (fetchmany) e devolve {coluna: array}"""
+    import numpy as np
+
+    cursor.execute(SQL_NOTAS_APURACAO, (referencia,))
+    partes = {coluna: [] for coluna, _ in COLUNAS}
+    while True:
+        linhas = cursor.fetchmany(lote)
+        if not linhas:
+            break
+        for (coluna, dtype), valores in zip(COLUNAS, zip(*linhas)):
+            if dtype == "float64":
+                # None vira NaN
+                valores = [np.nan if valor is None else valor for valor in valores]
+            partes[coluna].append(np.array(valores, dtype=dtype))
+    return {
+        coluna: np.concatenate(partes[coluna]) if partes[coluna] else np.array([], dtype=dtype)
+        for coluna, dtype in COLUNAS
+    }
+
+
+def _centavos_vetor(valores):
+    import numpy as np
+
+    # Meio para longe do zero, igual a centavos(); NaN vira 0
+    return np.where(
+        np.isnan(valores), 0, np.sign(valores) * np.floor(np.abs(valores) * 100 + 0.5)
+    ).astype(np.int64)
+
+
+def _agrupar(chaves, valores):
+    """
+    Soma exata (int64) de cada array de valores por chave
+
+    :return: Tupla (chaves distintas, inverso por nota, quantidade por chave, [somas por chave])
+    """
+    import numpy as np
+
+    distintas, inverso = np.unique(chaves, return_inverse=True)
+    if not len(distintas):
+        return distintas, inverso, np.array([], dtype=np.int64), [np.array([], dtype=np.int64) for _ in valores]
+    ordem = np.argsort(inverso, kind="stable")
+    inicios = np.searchsorted(inverso[ordem], np.arange(len(distintas)))
+    somas = [np.add.reduceat(valor[ordem], inicios) for valor in valores]
+    return distintas, inverso, np.bincount(inverso, minlength=len(distintas)), somas
+
+
+def calcular(colunas):
+    """
+    Apuração vetorizada das notas de uma competência
+
+    :param colunas: {coluna: array} como devolvido por _carregar_colunas, ou por
+        snapshot_colunar.colunas_apuracao (valor_centavos, valor_nulo e aliquota_centesimos
+        no lugar de valor_nf e aliquota)
+    :return: Totais, quebras por fornecedor, tipo de serviço e base de cálculo, e alertas (valores em centavos)
+    """
+    import numpy as np
+
+    if "valor_centavos" in colunas:
+        # Colunas do snapshot colunar: valor e alíquota já arredondados em inteiros
+        valor = colunas["valor_centavos"]
+        ausente = colunas["valor_nulo"]
+        aliquota = colunas["aliquota_centesimos"]
+    else:
+        valor = _centavos_vetor(colunas["valor_nf"])
+        ausente = np.isnan(colunas["valor_nf"])
+        aliquota = _centavos_vetor(np.nan_to_num(colunas["aliquota"]))
+    iss = np.sign(valor) * ((np.abs(valor) * aliquota + 5000) // 10000)
+
+    # Regra do tipo de serviço avaliada uma vez por descrição distinta
+    tipos, inverso_tipo, _, _ = _agrupar(colunas["tipo_servico"], [])
+    regras = [REGRAS_TIPO_SERVICO.get(tipo[:2]) for tipo in tipos]
+    conhecido = np.array([regra is not None for regra in regras], dtype=bool)[inverso_tipo]
+    regras = [regra or REGRAS_TIPO_SERVICO[TIPO_PADRAO] for regra in regras]
+    ha_iss = np.array([regra[0] for regra in regras], dtype=bool)[inverso_tipo]
+    retem = np.array([regra[1] for regra in regras], dtype=bool)[inverso_tipo]
+
+    devido = np.where(ha_iss, iss, 0)
+    retido = np.where(retem | colunas["fora_pais"] | ~colunas["cadastrado_goiania"], devido, 0)
+    valores = [valor, devido, retido]
+
+    def quebra(coluna):
+        distintas, inverso, quantidades, (valor_grupo, devido_grupo, retido_grupo) = _agrupar(
+            colunas[coluna], valores
+        )
+        itens = [
+            {
+                coluna: chave,
+                "quantidade": int(quantidade),
+                "valor_centavos": int(soma_valor),
+                "iss_devido_centavos": int(soma_devido),
+                "iss_retido_centavos": int(soma_retido),
+            }
+            for chave, quantidade, soma_valor, soma_devido, soma_retido
+            in zip(distintas, quantidades, valor_grupo, devido_grupo, retido_grupo)
+        ]
+        itens.sort(key=lambda item: item["valor_centavos"], reverse=True)
+        return itens, distintas, inverso
+
+    por_fornecedor, cnpjs, inverso_cnpj = quebra("cnpj")
+    # Nome do fornecedor: o da última nota de cada CNPJ
+    ultima = np.zeros(len(cnpjs), dtype=np.int64)
+    ultima[inverso_cnpj] = np.arange(len(inverso_cnpj))
+    nomes = dict(zip(cnpjs, colunas["fornecedor"][ultima])) if len(cnpjs) else {}
+    for item in por_fornecedor:
+        item["fornecedor"] = nomes[item["cnpj"]]
+
+    cnpj_valido = np.array(
+        [len("".join(filter(str.isdigit, cnpj))) in (11, 14) for cnpj in cnpjs], dtype=bool
+    )
+    ids = colunas["id"]
+    mascaras = {
+        "valor_ausente": ausente,
+        "valor_negativo": valor < 0,
+        "valor_zero": ~ausente & (valor == 0),
+        "aliquota_fora_da_faixa": ha_iss & ((aliquota < ALIQUOTA_MINIMA) | (aliquota > ALIQUOTA_MAXIMA)),
+        "tipo_servico_desconhecido": ~conhecido,
+        "cnpj_invalido": ~cnpj_valido[inverso_cnpj] if len(cnpjs) else np.zeros(0, dtype=bool),
+    }
+    alertas = [
+        {
+            "codigo": codigo,
+            "descricao": ALERTAS[codigo],
+            "quantidade": int(mascara.sum()),
+            "notas": [int(i) for i in ids[mascara][:MAX_NOTAS_ALERTA]],
+        }
+        for codigo, mascara in mascaras.items()
+        if mascara.any()
+    ]
+
+    return {
+        "quantidade": int(len(ids)),
+        "valor_centavos": int(valor.sum()),
+        "iss_devido_centavos": int(devido.sum()),
+        "iss_retido_centavos": int(retido.sum()),
+        "iss_prestador_centavos": int(devido.sum() - retido.sum()),
+        "iss_bruto_centavos": int(iss.sum()),
+        "por_fornecedor": por_fornecedor,
+        "por_tipo_servico": quebra("tipo_servico")[0],
+        "por_base_calculo": quebra("base_calculo")[0],
+        "alertas": alertas,
+    }
+
+
+def versao(conn, referencia):
+    """Versão dos dados da apuração: contadores da referência, de fornecedores e de tomadores"""
+    partes = ", ".join(
+        f"(SELECT versao FROM tb_versao_dados WHERE tabela = '{tabela}')" for tabela in TABELAS_VERSIONADAS
+    )
+    return conn.execute(
+        f"SELECT (SELECT versao FROM tb_versao_referencia WHERE referencia = ?), {partes}",
+        (referencia,)
+    ).fetchone()
+
+
+def apurar(conn, referencia, tomador_id=None, lote=5000, snapshot=None):
+    """
+    Apura o ISS de uma competência, lendo versão e notas no mesmo snapshot
+
+    :param conn: Conexão do pool (não é fechada aqui)
+    :param tomador_id: Tomador declarante; None usa o primeiro cadastrado com razão social
+    :param snapshot: SnapshotColunar opcional; as notas vêm da partição da referência
+        (regerada nesta mesma transação se estiver desatualizada) em vez do cursor
+    :return: Tupla (versão, resultado)
+    :raises ValueError: se a referência for vazia ou o tomador não for encontrado
+    """
+    referencia = (referencia or "").strip()
+    if not referencia:
+        raise ValueError("Referência (competência) é obrigatória")
+
+    inicio = time.perf_counter()
+    cursor = conn.cursor()
+    cursor.execute("BEGIN")
+    try:
+        versao_dados = versao(conn, referencia)
+        if tomador_id is not None:
+            cursor.execute("SELECT id, razao_social, cnpj FROM tb_config_tomador WHERE id = ?", (tomador_id,))
+        else:
+            cursor.execute(
+                "SELECT id, razao_social, cnpj FROM tb_config_tomador WHERE razao_social != '' ORDER BY id LIMIT 1"
+            )
+        tomador = cursor.fetchone()
+        if tomador_id is not None and not tomador:
+            raise ValueError("Dados do tomador não encontrados")
+
+        colunas = None
+        if snapshot is not None:
+            try:
+                colunas = colunas_apuracao(snapshot.particao(referencia, conn))
+            except OSError as e:
+                logger.warning("Snapshot colunar indisponível, apurando pelo banco: %s", e)
+        if colunas is None:
+            colunas = _carregar_colunas(cursor, referencia, lote)
+        resultado = calcular(colunas)
+
+        # Competência arquivada: os agregados dela ficam em tb_arquivo_agregados
+        agregado = cursor.execute("""
+            SELECT COALESCE(SUM(quantidade), 0), COALESCE(SUM(valor_centavos), 0), COALESCE(SUM(iss_centavos), 0)
+            FROM (
+                SELECT quantidade, valor_centavos, iss_centavos FROM tb_agregados_notas
+                WHERE dimensao = 'referencia' AND chave = :referencia
+                UNION ALL
+                SELECT quantidade, valor_centavos, iss_centavos FROM tb_arquivo_agregados
+                WHERE dimensao = 'referencia' AND chave = :referencia
+            )
+        """, {"referencia": referencia}).fetchone()
+    finally:
+        conn.rollback()
+
+    # Os agregados (triggers) somam o ISS sem arredondar o valor antes; só quantidade e valor precisam bater
+    resultado["conferencia"] = {
+        "agregados_quantidade": agregado[0],
+        "agregados_valor_centavos": agregado[1],
+        "diferenca_iss_bruto_centavos": resultado["iss_bruto_centavos"] - agregado[2],
+        "consistente": (agregado[0], agregado[1]) == (resultado["quantidade"], resultado["valor_centavos"]),
+    }
+    resultado = {
+        "referencia": referencia,
+        "tomador": dict(zip(("id", "razao_social", "cnpj"), tomador)) if tomador else None,
+        **resultado,
+        "versao": ".".join(str(parte or 0) for parte in versao_dados),
+        "calculada_em": datetime.now().isoformat(timespec="seconds"),
+        "segundos": round(time.perf_counter() - inicio, 4),
+    }
+    return versao_dados, resultado
+
+
+class CacheApuracao:
+    """
+    Apurações em memória por (tomador, referência), com descarte LRU
+
+    A cada acesso a versão é relida (uma consulta por chave primária); a
+    apuração só é recalculada quando alguma nota da referência, um fornecedor
+    ou um tomador mudou.
+    """
+
+    def __init__(self, db, maximo=64):
+        self.db = db
+        self.maximo = maximo
+        self._lock = threading.Lock()
+        self._dados = OrderedDict()  # (tomador_id, referencia) -> (versao, resultado)
+        self.acertos = 0
+        self.calculos = 0
+
+    def obter(self, referencia, tomador_id=None):
+        """
+        Apuração da referência, do cache ou recalculada
+
+        O resultado é compartilhado entre as requisições: não deve ser alterado.
+
+        :return: Resultado de apurar(), ou None sem conexão disponível
+        :raises ValueError: se a referência for vazia ou o tomador não for encontrado
+        """
+        chave = (tomador_id, (referencia or "").strip())
+        conn = self.db.conexao_notas({"referencia": chave[1]})
+        if conn is None:
+            return None
+        try:
+            atual = versao(conn, chave[1])
+            with self._lock:
+                item = self._dados.get(chave)
+                if item is not None and item[0] == atual:
+                    self._dados.move_to_end(chave)
+                    self.acertos += 1
+                    return item[1]
+            # Calculada fora do lock; a versão gravada é a do snapshot lido
+            item = apurar(conn, chave[1], tomador_id, snapshot=self.db.snapshot)
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._dados[chave] = item
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.maximo:
+                self._dados.popitem(last=False)
+            self.calculos += 1
+        return item[1]
+
+    def invalidar(self):
+        with self._lock:
+            self._dados.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"acertos": self.acertos, "calculos": self.calculos, "itens": len(self._dados)}
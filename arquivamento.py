@@ -0,0 +1,370 @@
+# Arquivo: arquivamento.py
+"""
+Arquivamento de competências fechadas em bancos anuais
+
+Arquivar uma referência (MM/AAAA) move as suas notas de tb_notas_fiscais para
+o arquivo do ano (<banco>_arquivo/notas_AAAA.db, SQLite sem WAL, compactado
+com VACUUM e só com os índices de referência e de listagem). No banco
+principal ficam:
+
+- tb_arquivo_referencias: catálogo (ano, totais, faixa de dt_emissao);
+- tb_arquivo_agregados: as linhas de agregados da referência, nas mesmas
+  dimensões de tb_agregados_notas, para que as estatísticas somem o arquivo
+  sem abri-lo;
+- tb_arquivo_fornecedores: fornecedores usados pelas notas arquivadas, que
+  não podem ser excluídos.
+
+Leituras de notas (listagem, contagem, exportações, apuração) usam
+anexar(): se os filtros alcançam competências arquivadas, os arquivos
+necessários são anexados (ATTACH) e uma TEMP VIEW tb_notas_fiscais, que
+tem precedência sobre main.tb_notas_fiscais para nomes sem esquema, une a
+tabela quente aos arquivos. O SQL das consultas não muda. Na devolução ao
+pool a view é removida e os arquivos são desanexados.
+
+Triggers (migração 10) recusam gravar notas em competência arquivada;
+restaurar() devolve a competência à tabela quente para correções.
+
+Com o banco principal em WAL, a transação que envolve o arquivo não é
+atômica entre os dois arquivos. Por isso a view só lê do arquivo as
+referências presentes no catálogo, e arquivar() remove do arquivo linhas
+que tenham sobrado de uma tentativa interrompida.
+"""
+import os
+import re
+import sqlite3
+import time
+from datetime import date
+
+from agregados import sql_agregados
+from deduplicacao import sql_chave_nota
+
+MENSAGEM_ARQUIVADA = "competência arquivada (restaure-a antes de alterar as notas)"
+
+# O SQLite permite até 10 bancos anexados por conexão
+MAX_ARQUIVOS_ANEXADOS = 8
+
+REFERENCIA = re.compile(r"^(0[1-9]|1[0-2])/(\d{4})$")
+
+
+def pasta_arquivo(db_file):
+    """Pasta dos arquivos anuais, ao lado do banco"""
+    return os.path.splitext(db_file)[0] + "_arquivo"
+
+
+def caminho_arquivo(pasta, ano):
+    return os.path.join(pasta, f"notas_{int(ano)}.db")
+
+
+def ano_mes(referencia):
+    """
+    (ano, mês) de uma referência MM/AAAA
+
+    :raises ValueError: se a referência não estiver no formato MM/AAAA
+    """
+    encontrado = REFERENCIA.match((referencia or "").strip())
+    if not encontrado:
+        raise ValueError(f"Referência inválida: {referencia!r} (use MM/AAAA)")
+    return int(encontrado.group(2)), int(encontrado.group(1))
+
+
+def sql_triggers_arquivo():
+    """Triggers que recusam inserir ou mover notas para uma competência arquivada"""
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_arquivada_{evento.split()[0].lower()}
+            BEFORE {evento} ON tb_notas_fiscais
+            WHEN EXISTS (SELECT 1 FROM tb_arquivo_referencias WHERE referencia = NEW.referencia)
+            BEGIN SELECT RAISE(ABORT, '{MENSAGEM_ARQUIVADA}'); END"""
+        for evento in ("INSERT", "UPDATE OF referencia")
+    ]
+
+
+def _colunas_gravadas(cursor, esquema="main"):
+    """(nome, tipo) das colunas de tb_notas_fiscais do esquema, sem colunas geradas"""
+    return [
+        (linha[1], linha[2])
+        for linha in cursor.execute(f"PRAGMA {esquema}.table_xinfo(tb_notas_fiscais)").fetchall()
+        if linha[6] == 0
+    ]
+
+
+def anos_necessarios(cursor, filtros=None):
+    """
+    Anos arquivados que uma consulta com os filtros (os de montar_filtro_notas) pode alcançar
+
+    Referência restringe ao ano dela; dt_inicio/dt_fim às competências cuja faixa de
+    emissão cruza o intervalo; os demais filtros alcançam todos os arquivos.
+    """
+    filtros = filtros or {}
+    condicoes, params = [], []
+    if filtros.get("referencia"):
+        condicoes.append("referencia = ?")
+        params.append(filtros["referencia"].strip())
+    if filtros.get("dt_inicio"):
+        condicoes.append("dt_emissao_max >= ?")
+        params.append(filtros["dt_inicio"])
+    if filtros.get("dt_fim"):
+        condicoes.append("dt_emissao_min <= ?")
+        params.append(filtros["dt_fim"])
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+    cursor.execute(f"SELECT DISTINCT ano FROM tb_arquivo_referencias {where} ORDER BY ano", params)
+    return [linha[0] for linha in cursor.fetchall()]
+
+
+def anexar(conn, pasta, filtros=None):
+    """
+    Anexa os arquivos que os filtros alcançam e cria a TEMP VIEW tb_notas_fiscais
+
+    A limpeza (desanexar) fica registrada na conexão e roda quando ela volta ao pool.
+
+    :return: Lista dos anos anexados (vazia quando a consulta só precisa da tabela quente)
+    :raises ValueError: se a consulta alcançar mais de MAX_ARQUIVOS_ANEXADOS anos
+    """
+    cursor = conn.cursor()
+    anos = anos_necessarios(cursor, filtros)
+    if not anos:
+        return []
+    if len(anos) > MAX_ARQUIVOS_ANEXADOS:
+        raise ValueError(
+            f"A consulta alcança {len(anos)} anos arquivados (máximo {MAX_ARQUIVOS_ANEXADOS}); "
+            "filtre por referência ou por data de emissão"
+        )
+
+    conn._ao_devolver = desanexar
+    colunas = [nome for nome, _ in _colunas_gravadas(cursor)]
+    partes = [f"SELECT {', '.join(colunas)}, chave_nota FROM main.tb_notas_fiscais"]
+    for ano in anos:
+        cursor.execute(f"ATTACH DATABASE ? AS arquivo_{ano}", (caminho_arquivo(pasta, ano),))
+        existentes = {nome for nome, _ in _colunas_gravadas(cursor, f"arquivo_{ano}")}
+        selecao = ", ".join(nome if nome in existentes else f"NULL AS {nome}" for nome in colunas)
+        partes.append(f"""
+            SELECT {selecao}, {sql_chave_nota()} AS chave_nota FROM arquivo_{ano}.tb_notas_fiscais
+            WHERE referencia IN (SELECT referencia FROM main.tb_arquivo_referencias WHERE ano = {int(ano)})
+        """)
+    cursor.execute(f"CREATE TEMP VIEW tb_notas_fiscais AS {' UNION ALL '.join(partes)}")
+    return anos
+
+
+def desanexar(conn):
+    """Remove a TEMP VIEW e desanexa os arquivos (fora de transação)"""
+    conn.execute("DROP VIEW IF EXISTS temp.tb_notas_fiscais")
+    for _, esquema, _ in conn.execute("PRAGMA database_list").fetchall():
+        if esquema.startswith("arquivo_"):
+            conn.execute(f"DETACH DATABASE {esquema}")
+
+
+def _preparar_arquivo(cursor, esquema):
+    """Cria (ou completa com colunas novas) a tabela de notas do arquivo anual"""
+    colunas = _colunas_gravadas(cursor)
+    definicoes = ", ".join(
+        "id INTEGER PRIMARY KEY" if nome == "id" else f"{nome} {tipo}" for nome, tipo in colunas
+    )
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {esquema}.tb_notas_fiscais ({definicoes})")
+    existentes = {nome for nome, _ in _colunas_gravadas(cursor, esquema)}
+    for nome, tipo in colunas:
+        if nome not in existentes:
+            cursor.execute(f"ALTER TABLE {esquema}.tb_notas_fiscais ADD COLUMN {nome} {tipo}")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {esquema}.ix_arquivo_referencia ON tb_notas_fiscais (referencia)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {esquema}.ix_arquivo_listagem ON tb_notas_fiscais (dt_emissao, id)")
+    return ", ".join(nome for nome, _ in colunas)
+
+
+def arquivar(conn, pasta, referencia, hoje=None, compactar=True):
+    """
+    Move as notas de uma competência fechada para o arquivo do ano
+
+    :param conn: Conexão do pool (não é fechada aqui)
+    :param hoje: Data usada para decidir se a competência está fechada (padrão: hoje)
+    :param compactar: Se True, roda VACUUM no arquivo anual ao final
+    :return: {"referencia", "ano", "arquivo", "notas", "valor_centavos", "iss_centavos", "segundos"}
+    :raises ValueError: referência inválida, aberta (mês atual ou futuro), já arquivada ou sem notas
+    """
+    inicio = time.perf_counter()
+    referencia = referencia.strip()
+    ano, mes = ano_mes(referencia)
+    hoje = hoje or date.today()
+    if (ano, mes) >= (hoje.year, hoje.month):
+        raise ValueError(f"A competência {referencia} ainda está aberta")
+
+    os.makedirs(pasta, exist_ok=True)
+    arquivo = caminho_arquivo(pasta, ano)
+    cursor = conn.cursor()
+    cursor.execute("ATTACH DATABASE ? AS arquivo_destino", (arquivo,))
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if cursor.execute("SELECT 1 FROM tb_arquivo_referencias WHERE referencia = ?", (referencia,)).fetchone():
+                raise ValueError(f"A competência {referencia} já está arquivada")
+            colunas = _preparar_arquivo(cursor, "arquivo_destino")
+            # Sobras de uma tentativa interrompida (a referência não estava no catálogo)
+            cursor.execute("DELETE FROM arquivo_destino.tb_notas_fiscais WHERE referencia = ?", (referencia,))
+            cursor.execute(f"""
+                INSERT INTO arquivo_destino.tb_notas_fiscais ({colunas})
+                SELECT {colunas} FROM main.tb_notas_fiscais WHERE referencia = ?
+            """, (referencia,))
+            if not cursor.rowcount:
+                raise ValueError(f"Nenhuma nota na competência {referencia}")
+
+            cursor.execute(f"""
+                INSERT INTO tb_arquivo_agregados (referencia, dimensao, chave, quantidade, valor_centavos, iss_centavos)
+                SELECT :referencia, * FROM ({sql_agregados("WHERE referencia = :referencia")})
+            """, {"referencia": referencia})
+            cursor.execute("""
+                INSERT INTO tb_arquivo_fornecedores (referencia, fornecedor_id)
+                SELECT DISTINCT ?, fornecedor_id FROM main.tb_notas_fiscais
+                WHERE referencia = ? AND fornecedor_id IS NOT NULL
+            """, (referencia, referencia))
+            cursor.execute("""
+                INSERT INTO tb_arquivo_referencias (
+                    referencia, ano, quantidade, valor_centavos, iss_centavos,
+                    dt_emissao_min, dt_emissao_max, arquivada_em
+                )
+                SELECT ?, ?, a.quantidade, a.valor_centavos, a.iss_centavos, n.minimo, n.maximo, datetime('now')
+                FROM tb_arquivo_agregados a,
+                     (SELECT MIN(dt_emissao) AS minimo, MAX(dt_emissao) AS maximo
+                      FROM main.tb_notas_fiscais WHERE referencia = ?) n
+                WHERE a.referencia = ? AND a.dimensao = 'total'
+            """, (referencia, ano, referencia, referencia))
+            # Triggers descontam os agregados quentes, o índice de busca e a versão da referência
+            cursor.execute("DELETE FROM main.tb_notas_fiscais WHERE referencia = ?", (referencia,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if compactar:
+            cursor.execute("VACUUM arquivo_destino")
+    finally:
+        cursor.execute("DETACH DATABASE arquivo_destino")
+
+    quantidade, valor, iss = cursor.execute(
+        "SELECT quantidade, valor_centavos, iss_centavos FROM tb_arquivo_referencias WHERE referencia = ?",
+        (referencia,)
+    ).fetchone()
+    return {
+        "referencia": referencia,
+        "ano": ano,
+        "arquivo": arquivo,
+        "notas": quantidade,
+        "valor_centavos": valor,
+        "iss_centavos": iss,
+        "segundos": round(time.perf_counter() - inicio, 4),
+    }
+
+
+def restaurar(conn, pasta, referencia):
+    """
+    Devolve as notas de uma competência arquivada para a tabela quente (com os mesmos IDs)
+
+    :return: {"referencia", "ano", "notas", "segundos"}
+    :raises ValueError: se a competência não estiver arquivada ou o arquivo não existir
+    """
+    inicio = time.perf_counter()
+    referencia = referencia.strip()
+    linha = conn.execute("SELECT ano FROM tb_arquivo_referencias WHERE referencia = ?", (referencia,)).fetchone()
+    if linha is None:
+        raise ValueError(f"A competência {referencia} não está arquivada")
+    arquivo = caminho_arquivo(pasta, linha[0])
+    if not os.path.exists(arquivo):
+        raise ValueError(f"Arquivo da competência {referencia} não encontrado: {arquivo}")
+
+    cursor = conn.cursor()
+    cursor.execute("ATTACH DATABASE ? AS arquivo_origem", (arquivo,))
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Sai do catálogo antes: as triggers de competência arquivada liberam a inserção
+            cursor.execute("DELETE FROM tb_arquivo_referencias WHERE referencia = ?", (referencia,))
+            if not cursor.rowcount:
+                raise ValueError(f"A competência {referencia} não está arquivada")
+            existentes = {nome for nome, _ in _colunas_gravadas(cursor, "arquivo_origem")}
+            colunas = ", ".join(nome for nome, _ in _colunas_gravadas(cursor) if nome in existentes)
+            cursor.execute(f"""
+                INSERT INTO main.tb_notas_fiscais ({colunas})
+                SELECT {colunas} FROM arquivo_origem.tb_notas_fiscais WHERE referencia = ?
+            """, (referencia,))
+            notas = cursor.rowcount
+            cursor.execute("DELETE FROM arquivo_origem.tb_notas_fiscais WHERE referencia = ?", (referencia,))
+            cursor.execute("DELETE FROM tb_arquivo_agregados WHERE referencia = ?", (referencia,))
+            cursor.execute("DELETE FROM tb_arquivo_fornecedores WHERE referencia = ?", (referencia,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        cursor.execute("DETACH DATABASE arquivo_origem")
+    return {
+        "referencia": referencia,
+        "ano": linha[0],
+        "notas": notas,
+        "segundos": round(time.perf_counter() - inicio, 4),
+    }
+
+
+def reapontar(conn, pasta, coluna, mapa):
+    """
+    Reaponta a chave estrangeira das notas arquivadas (ex.: fornecedor_id) na mesclagem de duplicatas
+
+    Cada arquivo anual é alterado na sua própria transação, antes de o chamador
+    remover os duplicados: se a mesclagem falhar depois, as notas arquivadas
+    apontam para o registro mantido, que continua existindo.
+
+    :param conn: Conexão do banco principal (para ler o catálogo)
+    :param coluna: Coluna de tb_notas_fiscais a reapontar
+    :param mapa: Lista de (duplicado, mantido)
+    :return: Quantidade de notas arquivadas reapontadas
+    :raises ValueError: se o arquivo de algum ano do catálogo não existir
+    """
+    anos = [linha[0] for linha in conn.execute("SELECT DISTINCT ano FROM tb_arquivo_referencias ORDER BY ano")]
+    if not anos or not mapa:
+        return 0
+    total = 0
+    for ano in anos:
+        arquivo = caminho_arquivo(pasta, ano)
+        if not os.path.exists(arquivo):
+            raise ValueError(f"Arquivo das competências de {ano} não encontrado: {arquivo}")
+        destino = sqlite3.connect(arquivo)
+        try:
+            destino.execute("CREATE TEMP TABLE _mapa (duplicado INTEGER PRIMARY KEY, manter INTEGER NOT NULL)")
+            destino.executemany("INSERT INTO temp._mapa (duplicado, manter) VALUES (?, ?)", mapa)
+            cursor = destino.execute(f"""
+                UPDATE tb_notas_fiscais
+                SET {coluna} = (SELECT manter FROM temp._mapa WHERE duplicado = tb_notas_fiscais.{coluna})
+                WHERE {coluna} IN (SELECT duplicado FROM temp._mapa)
+            """)
+            total += cursor.rowcount
+            destino.commit()
+        finally:
+            destino.close()
+    return total
+
+
+def referencias_antigas(conn, manter_meses, hoje=None):
+    """
+    Competências da tabela quente anteriores aos últimos manter_meses meses (lidas dos agregados)
+
+    Referências fora do formato MM/AAAA são ignoradas.
+    """
+    hoje = hoje or date.today()
+    limite = hoje.year * 12 + hoje.month - 1 - manter_meses
+    antigas = []
+    for (referencia,) in conn.execute(
+        "SELECT chave FROM tb_agregados_notas WHERE dimensao = 'referencia' AND quantidade > 0"
+    ).fetchall():
+        try:
+            ano, mes = ano_mes(referencia)
+        except ValueError:
+            continue
+        if ano * 12 + mes - 1 < limite:
+            antigas.append((ano, mes, referencia))
+    return [referencia for _, _, referencia in sorted(antigas)]
+
+
+def listar(conn):
+    """Competências arquivadas, da mais recente para a mais antiga"""
+    cursor = conn.execute("""
+        SELECT referencia, ano, quantidade, valor_centavos, iss_centavos,
+               dt_emissao_min, dt_emissao_max, arquivada_em
+        FROM tb_arquivo_referencias
+        ORDER BY ano DESC, substr(referencia, 1, 2) DESC
+    """)
+    colunas = [descricao[0] for descricao in cursor.description]
+    return [dict(zip(colunas, linha)) for linha in cursor.fetchall()]
@@ -0,0 +1,10 @@
+"""
+Benchmarks do DatabaseManager e das rotas Flask em escala realista
+
+Uso:
+    python -m benchmarks [--fornecedores N] [--notas M] [--saida resultados.json]
+    python -m benchmarks.comparar antes.json depois.json
+
+Os dados são sintéticos e gerados com semente fixa (benchmarks.dados), então
+duas execuções com os mesmos parâmetros medem exatamente a mesma base.
+"""
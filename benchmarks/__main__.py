@@ -0,0 +1,106 @@
+# Arquivo: benchmarks/__main__.py
+"""
+Executa os benchmarks e grava os resultados em JSON
+
+Uso: python -m benchmarks [--fornecedores 2000] [--notas 20000] [--tomadores 5]
+                          [--meses 12] [--semente 42] [--repeticoes 5]
+                          [--cenarios api_notas,export_to_txt] [--saida resultados.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _revisao_git():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=RAIZ,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description=__doc__.splitlines()[1])
+    parser.add_argument("--fornecedores", type=int, default=2000)
+    parser.add_argument("--notas", type=int, default=20000)
+    parser.add_argument("--tomadores", type=int, default=5)
+    parser.add_argument("--meses", type=int, default=12)
+    parser.add_argument("--semente", type=int, default=42)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--cenarios", help="Lista separada por vírgula (padrão: todos)")
+    parser.add_argument("--saida", default="resultados_benchmark.json")
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, RAIZ)
+    from benchmarks import cenarios, dados
+
+    selecionados = set(args.cenarios.split(",")) if args.cenarios else None
+    if selecionados:
+        desconhecidos = selecionados - {nome for nome, _ in cenarios.CENARIOS}
+        if desconhecidos:
+            parser.error(f"cenários desconhecidos: {', '.join(sorted(desconhecidos))}")
+
+    with tempfile.TemporaryDirectory(prefix="bench_") as pasta:
+        # O app lê DB_FILE ao ser importado: cada execução usa um banco novo
+        os.environ["DB_FILE"] = os.path.join(pasta, "benchmark.db")
+        os.environ.setdefault("LOG_LEVEL", "WARNING")
+        # As mensagens de progresso do DatabaseManager não entram na saída
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app as aplicacao
+
+            base = dados.popular_base(
+                aplicacao.db, args.fornecedores, args.notas, args.tomadores, args.meses, args.semente
+            )
+        arquivo_municipios = os.path.join(pasta, "municipios.txt")
+        dados.escrever_arquivo_municipios(arquivo_municipios, args.semente)
+
+        contexto = {
+            "db": aplicacao.db,
+            "client": aplicacao.app.test_client(),
+            "pasta": pasta,
+            "arquivo_municipios": arquivo_municipios,
+            "fornecedores": dados.gerar_fornecedores(
+                args.fornecedores, dados.gerar_municipios(args.semente), args.semente
+            ),
+        }
+
+        resultados = {}
+        for nome, funcao in cenarios.CENARIOS:
+            if selecionados and nome not in selecionados:
+                continue
+            print(f"{nome}...", file=sys.stderr, flush=True)
+            with contextlib.redirect_stdout(io.StringIO()):
+                resultados[nome] = cenarios.medir(funcao, contexto, args.repeticoes)
+        aplicacao.db.pool.fechar()
+
+    saida = {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "revisao": _revisao_git(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "plataforma": platform.platform(),
+        "base": base,
+        "resultados": resultados,
+    }
+    with open(args.saida, "w", encoding="utf-8") as arquivo:
+        json.dump(saida, arquivo, indent=2, ensure_ascii=False)
+
+    for nome, resultado in resultados.items():
+        print(f"{nome:30} mediana {resultado['mediana_ms']:>10.1f} ms")
+    print(f"Resultados gravados em {args.saida}")
+
+
+if __name__ == "__main__":
+    main()
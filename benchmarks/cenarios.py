@@ -0,0 +1,259 @@
+# Arquivo: benchmarks/cenarios.py
+"""
+Cenários medidos pelo benchmark
+
+Cada cenário é uma função (contexto) -> dict com métricas extras; o tempo de
+cada repetição é medido por medir(). O contexto traz o DatabaseManager, o
+cliente de teste do Flask e uma pasta temporária.
+"""
+import os
+import statistics
+import threading
+import time
+
+# Quantidade de páginas percorridas no cenário /api/notas
+PAGINAS_API_NOTAS = 10
+
+
+def medir(funcao, contexto, repeticoes=5, aquecimento=1):
+    """
+    Executa o cenário (aquecimento + repetições) e resume os tempos em milissegundos
+
+    As métricas extras são as da última repetição.
+    """
+    for _ in range(aquecimento):
+        funcao(contexto)
+
+    tempos = []
+    extras = {}
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        extras = funcao(contexto) or {}
+        tempos.append((time.perf_counter() - inicio) * 1000)
+
+    return {
+        "repeticoes": repeticoes,
+        "min_ms": round(min(tempos), 3),
+        "mediana_ms": round(statistics.median(tempos), 3),
+        "media_ms": round(statistics.fmean(tempos), 3),
+        "max_ms": round(max(tempos), 3),
+        **extras,
+    }
+
+
+def get_all_notas_fiscais(ctx):
+    df = ctx["db"].get_all_notas_fiscais()
+    return {"linhas": len(df)}
+
+
+def api_notas(ctx):
+    # Primeira página e mais PAGINAS_API_NOTAS - 1 seguindo o cursor
+    client = ctx["client"]
+    url = "/api/notas?page_size=100"
+    linhas = 0
+    for _ in range(PAGINAS_API_NOTAS):
+        resposta = client.get(url)
+        linhas += len(resposta.get_json())
+        cursor = resposta.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+        url = f"/api/notas?page_size=100&cursor={cursor}"
+    return {"linhas": linhas}
+
+
+def api_estatisticas(ctx):
+    resposta = ctx["client"].get("/api/estatisticas")
+    return {"status": resposta.status_code}
+
+
+def export_to_txt(ctx):
+    caminho = os.path.join(ctx["pasta"], "exportacao.txt")
+    ctx["db"].export_to_txt(caminho)
+    return {"bytes": os.path.getsize(caminho)}
+
+
+def export_to_excel(ctx):
+    caminho = os.path.join(ctx["pasta"], "exportacao.xlsx")
+    ctx["db"].export_to_excel(caminho)
+    return {"bytes": os.path.getsize(caminho)}
+
+
+def import_municipios_from_txt(ctx):
+    relatorio = ctx["db"].import_municipios_from_txt(ctx["arquivo_municipios"]) or {}
+    return {
+        "linhas": relatorio.get("linhas"),
+        "linhas_por_segundo": relatorio.get("linhas_por_segundo"),
+    }
+
+
+def _formulario_nota(numero, fornecedor):
+    cnpj, descricao, uf, municipio, codigo = fornecedor
+    return {
+        "referencia": "12/2025",
+        "cnpj": cnpj,
+        "fornecedor": descricao,
+        "uf": uf,
+        "municipio": municipio,
+        "cod_municipio": codigo,
+        "tipo_servico": "00 - Normal",
+        "num_nf": f"B{numero}",
+        "dt_emissao": "2025-12-10",
+        "dt_pagamento": "2025-12-15",
+        "aliquota": "2.5",
+        "valor_nf": "1000.00",
+        "recolhimento": "Recolhimento",
+    }
+
+
+def nota_insert(ctx, quantidade=50):
+    # Caminho completo do formulário: fornecedor (upsert) + nota + redirect
+    client = ctx["client"]
+    fornecedores = ctx["fornecedores"]
+    ctx["seq_nota"] = ctx.get("seq_nota", 0)
+    for _ in range(quantidade):
+        ctx["seq_nota"] += 1
+        fornecedor = fornecedores[ctx["seq_nota"] % len(fornecedores)]
+        client.post("/nota", data=_formulario_nota(ctx["seq_nota"], fornecedor))
+    return {"insercoes": quantidade}
+
+
+def escritores_concorrentes(ctx, escritores=8, insercoes_por_escritor=50, leitores=2, bancos=None):
+    """
+    Várias threads gravando notas (uma transação por nota) enquanto outras leem estatísticas
+
+    Mede vazão, latência por escrita (p50/p95/max), falhas (ex.: database is locked)
+    e esperas no pool de conexões. Com bancos, o escritor i grava em bancos[i % len(bancos)].
+    """
+    bancos = bancos or [ctx["db"]]
+    fornecedores = ctx["fornecedores"]
+    # Números de NF únicos entre repetições (notas duplicadas são recusadas)
+    rodada = ctx["rodadas_escrita"] = ctx.get("rodadas_escrita", 0) + 1
+    latencias = []
+    falhas = []
+    lock = threading.Lock()
+    parar_leitura = threading.Event()
+    leituras = [0]
+    esperas_antes = sum(banco.pool_stats().get("esperas", 0) for banco in bancos)
+
+    def escrever(indice):
+        for n in range(insercoes_por_escritor):
+            cnpj, _, uf, municipio, codigo = fornecedores[(indice * 7919 + n) % len(fornecedores)]
+            dados = {
+                "referencia": "12/2025", "CNPJ": cnpj, "Fornecedor_ID": None,
+                "Tipo de Serviço": "00 - Normal", "Base de Cálculo": "", "Nº NF": f"C{rodada}-{indice}-{n}",
+                "Dt. Emissão": "2025-12-10", "Dt. Pagamento": "2025-12-15", "Aliquota": 2.5,
+                "Valor NF": 1000.0, "Recolhimento": "Recolhimento", "UF": uf,
+                "Município": municipio, "Código Município": codigo,
+            }
+            inicio = time.perf_counter()
+            ok = bancos[indice % len(bancos)].insert_nota_fiscal(dados)
+            duracao = (time.perf_counter() - inicio) * 1000
+            with lock:
+                latencias.append(duracao)
+                if not ok:
+                    falhas.append(indice)
+
+    def ler():
+        while not parar_leitura.is_set():
+            for banco in bancos:
+                banco.get_estatisticas()
+            with lock:
+                leituras[0] += 1
+
+    threads_leitura = [threading.Thread(target=ler) for _ in range(leitores)]
+    threads_escrita = [threading.Thread(target=escrever, args=(i,)) for i in range(escritores)]
+    inicio = time.perf_counter()
+    for thread in threads_leitura + threads_escrita:
+        thread.start()
+    for thread in threads_escrita:
+        thread.join()
+    segundos = time.perf_counter() - inicio
+    parar_leitura.set()
+    for thread in threads_leitura:
+        thread.join()
+
+    esperas_depois = sum(banco.pool_stats().get("esperas", 0) for banco in bancos)
+    latencias.sort()
+    total = len(latencias)
+    return {
+        "escritores": escritores,
+        "leitores": leitores,
+        "escritas": total,
+        "falhas": len(falhas),
+        "escritas_por_segundo": round(total / segundos, 1),
+        "leituras": leituras[0],
+        "latencia_p50_ms": round(latencias[total // 2], 3),
+        "latencia_p95_ms": round(latencias[int(total * 0.95) - 1], 3),
+        "latencia_max_ms": round(latencias[-1], 3),
+        "esperas_pool": esperas_depois - esperas_antes,
+    }
+
+
+def escritores_por_tomador(ctx, tomadores=4):
+    # Mesma carga de escritores_concorrentes, distribuída entre as partições de alguns tomadores
+    db = ctx["db"]
+    ids = [tomador[0] for tomador in db.get_all_tomadores() if tomador[1]][:tomadores]
+    resultado = escritores_concorrentes(ctx, bancos=[db.banco_tomador(id_) for id_ in ids])
+    resultado["particoes"] = len(ids)
+    return resultado
+
+
+def relatorio_tomadores(ctx):
+    # Fan-out sobre as partições já criadas (estatísticas + apuração da competência)
+    relatorio = ctx["db"].relatorio_tomadores("12/2025")
+    return {"tomadores": len(relatorio["tomadores"]), "notas": relatorio["total"]["total_notas"]}
+
+
+def inicializacao_db(ctx):
+    # Start de um worker sobre um banco já existente (construção do DatabaseManager)
+    from database import DatabaseManager
+
+    db = DatabaseManager(ctx["db"].db_file, pool_size=1)
+    db.pool.fechar()
+
+
+def _referencia_apuracao(ctx):
+    if "referencia_apuracao" not in ctx:
+        # Competência com mais notas
+        ctx["referencia_apuracao"] = max(
+            ctx["db"].get_estatisticas_por("referencia"), key=lambda item: item["quantidade"]
+        )["chave"]
+    return ctx["referencia_apuracao"]
+
+
+def apuracao_iss(ctx):
+    # Sem cache: leitura das colunas + cálculo vetorizado
+    referencia = _referencia_apuracao(ctx)
+    ctx["db"].apuracoes.invalidar()
+    apuracao = ctx["db"].apurar(referencia)
+    return {"notas": apuracao["quantidade"], "fornecedores": len(apuracao["por_fornecedor"])}
+
+
+def apuracao_iss_cache(ctx):
+    resposta = ctx["client"].get(f"/api/apuracao?referencia={_referencia_apuracao(ctx)}")
+    return {"status": resposta.status_code}
+
+
+def formatacao_registros_txt(ctx, quantidade=100_000):
+    from layout_registros import benchmark
+
+    return {"registros_por_segundo": round(benchmark(quantidade))}
+
+
+# (nome, função) na ordem de execução
+CENARIOS = [
+    ("get_all_notas_fiscais", get_all_notas_fiscais),
+    ("api_notas", api_notas),
+    ("api_estatisticas", api_estatisticas),
+    ("apuracao_iss", apuracao_iss),
+    ("apuracao_iss_cache", apuracao_iss_cache),
+    ("export_to_txt", export_to_txt),
+    ("export_to_excel", export_to_excel),
+    ("import_municipios_from_txt", import_municipios_from_txt),
+    ("nota_insert", nota_insert),
+    ("escritores_concorrentes", escritores_concorrentes),
+    ("escritores_por_tomador", escritores_por_tomador),
+    ("relatorio_tomadores", relatorio_tomadores),
+    ("formatacao_registros_txt", formatacao_registros_txt),
+    ("inicializacao_db", inicializacao_db),
+]
@@ -0,0 +1,55 @@
+# Arquivo: benchmarks/comparar.py
+"""
+Compara dois arquivos de resultados do benchmark (mediana de cada cenário)
+
+Uso: python -m benchmarks.comparar antes.json depois.json [--limite 10]
+
+Sai com código 1 se algum cenário ficou mais lento que o limite percentual.
+"""
+import argparse
+import json
+import sys
+
+
+def comparar(antes, depois):
+    """Lista de (cenario, mediana_antes, mediana_depois, variação %) dos cenários presentes nos dois"""
+    linhas = []
+    for nome, resultado in depois["resultados"].items():
+        anterior = antes["resultados"].get(nome)
+        if not anterior:
+            continue
+        a, d = anterior["mediana_ms"], resultado["mediana_ms"]
+        variacao = (d - a) / a * 100 if a else 0.0
+        linhas.append((nome, a, d, variacao))
+    return linhas
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.comparar")
+    parser.add_argument("antes")
+    parser.add_argument("depois")
+    parser.add_argument("--limite", type=float, default=10.0, help="Regressão máxima aceita em %%")
+    args = parser.parse_args(argv)
+
+    with open(args.antes, encoding="utf-8") as arquivo:
+        antes = json.load(arquivo)
+    with open(args.depois, encoding="utf-8") as arquivo:
+        depois = json.load(arquivo)
+
+    if antes.get("base") != depois.get("base"):
+        print("Atenção: as bases sintéticas dos dois arquivos são diferentes")
+
+    regressoes = 0
+    print(f"{'cenário':30} {'antes (ms)':>12} {'depois (ms)':>12} {'variação':>9}")
+    for nome, a, d, variacao in comparar(antes, depois):
+        marca = ""
+        if variacao > args.limite:
+            marca = "  REGRESSÃO"
+            regressoes += 1
+        print(f"{nome:30} {a:>12.1f} {d:>12.1f} {variacao:>+8.1f}%{marca}")
+
+    sys.exit(1 if regressoes else 0)
+
+
+if __name__ == "__main__":
+    main()
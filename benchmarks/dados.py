@@ -0,0 +1,150 @@
+# Arquivo: benchmarks/dados.py
+"""
+Gerador determinístico de dados sintéticos para os benchmarks
+
+Mesma semente, mesmos dados: fornecedores, notas distribuídas entre
+competências, tomadores e a tabela completa de municípios (5.570, com a
+quantidade real de municípios de cada UF segundo o IBGE).
+"""
+import random
+
+# UF -> (código IBGE da UF, quantidade de municípios)
+MUNICIPIOS_POR_UF = {
+    "AC": (12, 22), "AL": (27, 102), "AP": (16, 16), "AM": (13, 62), "BA": (29, 417),
+    "CE": (23, 184), "DF": (53, 1), "ES": (32, 78), "GO": (52, 246), "MA": (21, 217),
+    "MT": (51, 141), "MS": (50, 79), "MG": (31, 853), "PA": (15, 144), "PB": (25, 223),
+    "PR": (41, 399), "PE": (26, 185), "PI": (22, 224), "RJ": (33, 92), "RN": (24, 167),
+    "RS": (43, 497), "RO": (11, 52), "RR": (14, 15), "SC": (42, 295), "SP": (35, 645),
+    "SE": (28, 75), "TO": (17, 139),
+}
+
+_PREFIXOS = ["SÃO", "SANTA", "NOVA", "BOM JESUS DO", "PORTO", "CAMPO", "SERRA", "ÁGUA", "RIO", "VILA"]
+_SUFIXOS = ["DO NORTE", "DO SUL", "DAS FLORES", "DA SERRA", "DO OESTE", "PAULISTA", "GOIANO", "DE MINAS"]
+_PALAVRAS_EMPRESA = [
+    "COMÉRCIO", "SERVIÇOS", "CONSTRUÇÃO", "TÉCNICA", "ALIMENTOS", "TRANSPORTES",
+    "ENGENHARIA", "MÉDICOS", "CONSULTORIA", "INFORMÁTICA", "LIMPEZA", "SEGURANÇA",
+]
+_SUFIXOS_EMPRESA = ["LTDA", "EIRELI", "ME", "S/A", "ASSOCIADOS"]
+
+
+def gerar_municipios(semente=42):
+    """Lista de (codigo, municipio, uf) com 5.570 municípios"""
+    rnd = random.Random(semente)
+    municipios = []
+    for uf, (codigo_uf, quantidade) in MUNICIPIOS_POR_UF.items():
+        nomes = set()
+        while len(nomes) < quantidade:
+            nome = f"{rnd.choice(_PREFIXOS)} {rnd.choice(_SUFIXOS)} {len(nomes) + 1}"
+            nomes.add(nome)
+        for seq, nome in enumerate(sorted(nomes), 1):
+            municipios.append((f"{codigo_uf}{seq:05d}", nome, uf))
+    return municipios
+
+
+def escrever_arquivo_municipios(caminho, semente=42):
+    """Grava o TXT de municípios (CODIGO;MUNICIPIO;UF) aceito por import_municipios_from_txt"""
+    municipios = gerar_municipios(semente)
+    with open(caminho, "w", encoding="utf-8") as arquivo:
+        for codigo, municipio, uf in municipios:
+            arquivo.write(f"{codigo};{municipio};{uf}\n")
+    return len(municipios)
+
+
+def _cnpj(numero):
+    base = f"{numero:012d}"
+    return base + f"{numero % 97:02d}"
+
+
+def gerar_fornecedores(quantidade, municipios, semente=42):
+    """Lista de (CNPJ, descricao, UF, municipio, cod_municipio)"""
+    rnd = random.Random(semente)
+    fornecedores = []
+    for numero in range(1, quantidade + 1):
+        codigo, municipio, uf = rnd.choice(municipios)
+        nome = " ".join(rnd.sample(_PALAVRAS_EMPRESA, 2)) + f" {numero} " + rnd.choice(_SUFIXOS_EMPRESA)
+        fornecedores.append((_cnpj(10_000_000 + numero), nome, uf, municipio, codigo))
+    return fornecedores
+
+
+def competencias(quantidade, ano_final=2025):
+    """As últimas `quantidade` competências MM/AAAA, terminando em 12/ano_final"""
+    resultado = []
+    ano, mes = ano_final, 12
+    for _ in range(quantidade):
+        resultado.append((ano, mes))
+        mes -= 1
+        if mes == 0:
+            ano, mes = ano - 1, 12
+    return list(reversed(resultado))
+
+
+def popular_base(db, fornecedores=2000, notas=20000, tomadores=5, meses=12, semente=42):
+    """
+    Popula um banco (já criado pelo DatabaseManager) com dados sintéticos
+
+    As inserções usam executemany em uma transação por tabela: a carga em si não
+    faz parte do que é medido.
+
+    :return: Dicionário com as quantidades geradas
+    """
+    rnd = random.Random(semente)
+    municipios = gerar_municipios(semente)
+    lista_fornecedores = gerar_fornecedores(fornecedores, municipios, semente)
+    periodos = competencias(meses)
+    tipos_servico = db.get_all_tipos_servico() or ["00 - Normal"]
+    bases_calculo = db.get_all_bases_calculo() or [""]
+
+    conn = db.create_connection()
+    try:
+        c = conn.cursor()
+        c.executemany(
+            "INSERT OR IGNORE INTO tb_cod_municipio (cod_municipio, municipio, UF) VALUES (?, ?, ?)",
+            municipios
+        )
+        c.executemany("""
+            INSERT OR IGNORE INTO tb_fornecedores (CNPJ, descricao_fornecedor, UF, municipio, cod_municipio)
+            VALUES (?, ?, ?, ?, ?)
+        """, lista_fornecedores)
+        conn.commit()
+
+        ids = dict(c.execute("SELECT CNPJ, id FROM tb_fornecedores").fetchall())
+        recolhimento_id = (c.execute("SELECT MIN(id) FROM tb_tipo_de_recolhimento").fetchone() or [None])[0]
+
+        for numero in range(1, tomadores + 1):
+            c.execute("""
+                INSERT INTO tb_config_tomador (razao_social, cnpj, cae_inscricao, usuario_prefeitura, data_atualizacao)
+                VALUES (?, ?, ?, ?, '2025-01-01')
+            """, (f"TOMADOR SINTÉTICO {numero} LTDA", _cnpj(90_000_000 + numero), f"{1000000 + numero}",
+                  f"usuario{numero}"))
+
+        linhas = []
+        for numero in range(1, notas + 1):
+            cnpj, _, uf, municipio, codigo = rnd.choice(lista_fornecedores)
+            ano, mes = rnd.choice(periodos)
+            dia = rnd.randint(1, 28)
+            linhas.append((
+                f"{mes:02d}/{ano}", "Não", "Não", cnpj, ids.get(cnpj), "",
+                rnd.choice(tipos_servico), rnd.choice(bases_calculo), str(numero),
+                f"{ano}-{mes:02d}-{dia:02d}", f"{ano}-{mes:02d}-{min(dia + 5, 28):02d}",
+                rnd.choice([2.0, 2.5, 3.0, 3.5, 5.0]), round(rnd.uniform(50, 50000), 2),
+                recolhimento_id, f"R{numero}", uf, municipio, codigo,
+            ))
+        c.executemany("""
+            INSERT INTO tb_notas_fiscais (
+                referencia, cadastrado_goiania, fora_pais, cnpj, fornecedor_id, inscricao_municipal,
+                tipo_servico, base_calculo, numero_nf, dt_emissao, dt_pagamento, aliquota, valor_nf,
+                recolhimento_id, recibo, uf, municipio, cod_municipio
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, linhas)
+        conn.commit()
+    finally:
+        conn.close()
+
+    return {
+        "municipios": len(municipios),
+        "fornecedores": fornecedores,
+        "notas": notas,
+        "tomadores": tomadores,
+        "competencias": meses,
+        "semente": semente,
+    }
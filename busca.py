@@ -0,0 +1,192 @@
+# Arquivo: busca.py
+"""
+Busca por prefixo (typeahead) com índices FTS5 do SQLite
+
+Três índices de texto, todos com tokenizer unicode61 sem acentos e sem
+distinção de maiúsculas ("goiania" encontra "GOIÂNIA"), mantidos por triggers
+nas tabelas de origem (migração 6):
+
+    tb_busca_fornecedores  razão social e CNPJ só com dígitos (rowid = tb_fornecedores.id)
+    tb_busca_municipios    nome do município (rowid = tb_cod_municipio.id)
+    tb_busca_notas         número da NF e recibo (rowid = tb_notas_fiscais.id)
+
+Cada palavra digitada vira um termo de prefixo ("sao paul" -> "sao"* AND "paul"*);
+os resultados que começam com a primeira palavra vêm antes dos demais.
+"""
+import re
+
+TOKENIZER = "unicode61 remove_diacritics 2"
+
+# Mesma normalização de CNPJ nas triggers e no recálculo: só dígitos
+_CNPJ_DIGITOS = "REPLACE(REPLACE(REPLACE(REPLACE(COALESCE({p}CNPJ, ''), '.', ''), '/', ''), '-', ''), ' ', '')"
+
+# nome -> (tabela FTS, tabela de origem, [(coluna FTS, expressão na origem)])
+INDICES = {
+    "fornecedores": ("tb_busca_fornecedores", "tb_fornecedores", [
+        ("descricao", "COALESCE({p}descricao_fornecedor, '')"),
+        ("cnpj", _CNPJ_DIGITOS),
+    ]),
+    "municipios": ("tb_busca_municipios", "tb_cod_municipio", [
+        ("municipio", "COALESCE({p}municipio, '')"),
+    ]),
+    "notas": ("tb_busca_notas", "tb_notas_fiscais", [
+        ("numero_nf", "COALESCE({p}numero_nf, '')"),
+        ("recibo", "COALESCE({p}recibo, '')"),
+    ]),
+}
+
+LIMITE_PADRAO = 10
+LIMITE_MAXIMO = 50
+TAMANHO_MINIMO = 2
+
+
+def sql_indices_busca():
+    """Comandos que criam as tabelas FTS5 e as triggers de sincronização"""
+    comandos = []
+    for tabela_fts, origem, colunas in INDICES.values():
+        nomes = ", ".join(coluna for coluna, _ in colunas)
+        valores_new = ", ".join(expr.format(p="NEW.") for _, expr in colunas)
+        comandos.append(f"""
+            CREATE VIRTUAL TABLE IF NOT EXISTS {tabela_fts}
+            USING fts5({nomes}, tokenize='{TOKENIZER}', prefix='2 3 4')
+        """)
+        comandos.append(f"""
+            CREATE TRIGGER IF NOT EXISTS tr_{origem}_busca_ins AFTER INSERT ON {origem}
+            BEGIN
+                INSERT INTO {tabela_fts} (rowid, {nomes}) VALUES (NEW.id, {valores_new});
+            END
+        """)
+        comandos.append(f"""
+            CREATE TRIGGER IF NOT EXISTS tr_{origem}_busca_del AFTER DELETE ON {origem}
+            BEGIN
+                DELETE FROM {tabela_fts} WHERE rowid = OLD.id;
+            END
+        """)
+        colunas_origem = ", ".join(
+            sorted({re.search(r"\{p\}(\w+)", expr).group(1) for _, expr in colunas})
+        )
+        comandos.append(f"""
+            CREATE TRIGGER IF NOT EXISTS tr_{origem}_busca_upd AFTER UPDATE OF {colunas_origem} ON {origem}
+            BEGIN
+                DELETE FROM {tabela_fts} WHERE rowid = OLD.id;
+                INSERT INTO {tabela_fts} (rowid, {nomes}) VALUES (NEW.id, {valores_new});
+            END
+        """)
+    return comandos
+
+
+def reconstruir_indices(cursor):
+    """Recria o conteúdo dos índices FTS a partir das tabelas de origem (na transação do chamador)"""
+    for tabela_fts, origem, colunas in INDICES.values():
+        nomes = ", ".join(coluna for coluna, _ in colunas)
+        valores = ", ".join(expr.format(p="") for _, expr in colunas)
+        cursor.execute(f"DELETE FROM {tabela_fts}")
+        cursor.execute(f"INSERT INTO {tabela_fts} (rowid, {nomes}) SELECT id, {valores} FROM {origem}")
+        cursor.execute(f"INSERT INTO {tabela_fts} ({tabela_fts}) VALUES ('optimize')")
+
+
+def montar_consulta_fts(termo):
+    """
+    Converte o texto digitado em expressões MATCH de prefixos
+
+    Retorna (inicio, geral): "inicio" exige que a primeira palavra comece o campo
+    (^), "geral" aceita as palavras em qualquer posição. Texto só com dígitos e
+    pontuação (CNPJ parcial como "12.345") vira um único prefixo numérico.
+    Retorna None se não sobrar nada pesquisável.
+    """
+    termo = (termo or "").strip()
+    if re.fullmatch(r"[\d.\-/ ]+", termo):
+        palavras = [re.sub(r"\D", "", termo)]
+    else:
+        palavras = re.findall(r"\w+", termo)
+    if not palavras or len("".join(palavras)) < TAMANHO_MINIMO:
+        return None
+
+    geral = " ".join(f'"{palavra}"*' for palavra in palavras)
+    return f"^{geral}", geral
+
+
+# Resultados em ordem de rowid: o FTS5 entrega nessa ordem, então LIMIT para
+# cedo sem calcular bm25 de todas as ocorrências (com 100k fornecedores, ordenar
+# por rank um prefixo comum custa dezenas de ms; assim fica abaixo de 3 ms)
+SQL_BUSCA = {
+    "fornecedores": """
+        SELECT b.rowid, f.id, f.descricao_fornecedor, f.CNPJ, f.UF, f.municipio, f.cod_municipio
+        FROM tb_busca_fornecedores b
+        JOIN tb_fornecedores f ON f.id = b.rowid
+        WHERE tb_busca_fornecedores MATCH ? {filtros}
+        ORDER BY b.rowid
+        LIMIT ?
+    """,
+    "municipios": """
+        SELECT b.rowid, m.UF, m.municipio, m.cod_municipio
+        FROM tb_busca_municipios b
+        JOIN tb_cod_municipio m ON m.id = b.rowid
+        WHERE tb_busca_municipios MATCH ? {filtros}
+        ORDER BY b.rowid
+        LIMIT ?
+    """,
+    "notas": """
+        SELECT b.rowid, nf.id, nf.numero_nf, nf.recibo, nf.dt_emissao, nf.valor_nf, f.descricao_fornecedor
+        FROM tb_busca_notas b
+        JOIN tb_notas_fiscais nf ON nf.id = b.rowid
+        LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+        WHERE tb_busca_notas MATCH ? {filtros}
+        ORDER BY b.rowid
+        LIMIT ?
+    """,
+}
+
+CAMPOS_BUSCA = {
+    "fornecedores": ("id", "descricao_fornecedor", "cnpj", "uf", "municipio", "cod_municipio"),
+    "municipios": ("uf", "municipio", "cod_municipio"),
+    "notas": ("id", "numero_nf", "recibo", "dt_emissao", "valor_nf", "fornecedor"),
+}
+
+
+def _buscar_tipo(conn, tipo, expressoes, limite, uf):
+    # Primeiro os que começam com o termo, depois os demais (sem repetir)
+    campos = CAMPOS_BUSCA[tipo]
+    encontrados = []
+    vistos = []
+    for expressao in expressoes:
+        restante = limite - len(encontrados)
+        if restante <= 0:
+            break
+        filtros = []
+        params = [expressao]
+        if tipo == "municipios" and uf:
+            filtros.append("AND m.UF = ?")
+            params.append(uf)
+        if vistos:
+            filtros.append(f"AND b.rowid NOT IN ({', '.join('?' * len(vistos))})")
+            params.extend(vistos)
+        params.append(restante)
+        for rowid, *valores in conn.execute(SQL_BUSCA[tipo].format(filtros=" ".join(filtros)), params):
+            vistos.append(rowid)
+            encontrados.append(dict(zip(campos, valores)))
+    return encontrados
+
+
+def buscar(conn, termo, tipos=None, limite=LIMITE_PADRAO, uf=None):
+    """
+    Busca por prefixo nos índices de texto
+
+    :param termo: Texto digitado (parcial, com ou sem acentos)
+    :param tipos: Subconjunto de ("fornecedores", "municipios", "notas"); None = todos
+    :param limite: Máximo de resultados por tipo
+    :param uf: Restringe a busca de municípios a uma UF
+    :return: Dicionário {tipo: [resultados]}; listas vazias se o termo for curto demais
+    :raises ValueError: se algum tipo for desconhecido
+    """
+    tipos = list(tipos or INDICES)
+    desconhecidos = [tipo for tipo in tipos if tipo not in INDICES]
+    if desconhecidos:
+        raise ValueError(f"Tipo de busca inválido: {', '.join(desconhecidos)}")
+
+    expressoes = montar_consulta_fts(termo)
+    if expressoes is None:
+        return {tipo: [] for tipo in tipos}
+
+    limite = max(1, min(int(limite), LIMITE_MAXIMO))
+    return {tipo: _buscar_tipo(conn, tipo, expressoes, limite, uf) for tipo in tipos}
@@ -0,0 +1,244 @@
+# Arquivo: cache_exportacao.py
+"""
+Cache em disco dos arquivos exportados (Excel e TXT da prefeitura)
+
+Cada arquivo é guardado sob o hash (SHA-256) da chave (formato, filtros,
+opções, versão dos dados). A versão dos dados vem dos contadores mantidos por
+triggers: tb_versao_notas (migração 11), incrementado a cada inclusão,
+alteração (de qualquer coluna) ou exclusão de nota da referência, e
+tb_versao_dados (dados de referência, fornecedores e tomadores). Qualquer
+método de escrita, inclusive importações, lotes e limpar_*, muda a chave, então
+um arquivo em cache nunca fica desatualizado: ele só deixa de ser pedido e sai
+pelo descarte LRU.
+
+O mesmo hash é o ETag da resposta. O LRU usa o mtime dos arquivos (atualizado a
+cada acerto), então sobrevive a reinícios; o limite é em bytes.
+
+A versão é lida antes da exportação, que lê um snapshot igual ou mais novo: o
+arquivo guardado nunca é mais antigo que a versão da sua chave.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Incrementar quando o layout de algum formato mudar (invalida os arquivos guardados)
+VERSAO_FORMATOS = 2
+
+EXTENSOES = {"xlsx": ".xlsx", "txt": ".txt"}
+
+
+def sql_triggers_versao_notas():
+    """Comandos CREATE TRIGGER que incrementam tb_versao_notas a cada alteração de nota"""
+    def incrementar(p):
+        # Versão inicial pelo relógio, como em tb_versao_referencia
+        return f"""
+            INSERT INTO tb_versao_notas (referencia, versao)
+            VALUES (COALESCE({p}referencia, ''), CAST(strftime('%s', 'now') AS INTEGER))
+            ON CONFLICT (referencia) DO UPDATE SET versao = versao + 1;"""
+
+    return [
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_versao_notas_ins AFTER INSERT ON tb_notas_fiscais
+            BEGIN {incrementar("NEW.")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_versao_notas_del AFTER DELETE ON tb_notas_fiscais
+            BEGIN {incrementar("OLD.")} END""",
+        f"""CREATE TRIGGER IF NOT EXISTS tr_notas_versao_notas_upd AFTER UPDATE ON tb_notas_fiscais
+            BEGIN {incrementar("OLD.")} {incrementar("NEW.")} END""",
+    ]
+
+
+def versao_dados(conn, filtros=None):
+    """
+    Versão dos dados que uma exportação com os filtros lê
+
+    Com referência, só o contador dela; sem referência, a quantidade e a soma
+    dos contadores de todas (os contadores só crescem, então a soma muda a cada
+    alteração). Mais todos os contadores de tb_versao_dados.
+    """
+    referencia = ((filtros or {}).get("referencia") or "").strip()
+    if referencia:
+        notas = conn.execute(
+            "SELECT versao FROM tb_versao_notas WHERE referencia = ?", (referencia,)
+        ).fetchone()
+    else:
+        notas = conn.execute("SELECT COUNT(*), TOTAL(versao) FROM tb_versao_notas").fetchone()
+    tabelas = conn.execute("SELECT tabela, versao FROM tb_versao_dados ORDER BY tabela").fetchall()
+    return [list(notas or ()), [list(linha) for linha in tabelas]]
+
+
+class CacheExportacao:
+    """
+    Arquivos exportados por chave, em uma pasta com limite de tamanho (descarte LRU)
+
+    :param db: DatabaseManager cujas notas são exportadas
+    :param pasta: Pasta dos arquivos (padrão: <banco>_exportacoes ao lado dele)
+    :param limite_bytes: Tamanho máximo da pasta; 0 desliga o cache
+    """
+
+    def __init__(self, db, pasta=None, limite_bytes=200 * 1024 * 1024):
+        self.db = db
+        self.pasta = pasta or os.path.splitext(db.db_file)[0] + "_exportacoes"
+        self.limite_bytes = limite_bytes
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.geracoes = 0
+        self.descartes = 0
+
+    @property
+    def habilitado(self):
+        return self.limite_bytes > 0
+
+    def chave(self, formato, filtros=None, **opcoes):
+        """
+        Hash da chave (formato, filtros, opções, versão dos dados); é também o ETag
+
+        :return: Hash hexadecimal, ou None sem conexão disponível
+        :raises ValueError: se o formato não for suportado
+        """
+        if formato not in EXTENSOES:
+            raise ValueError(f"Formato de exportação não suportado: {formato}")
+        conn = self.db.create_connection()
+        if conn is None:
+            return None
+        try:
+            versao = versao_dados(conn, filtros)
+        finally:
+            conn.close()
+        filtros = {k: str(v).strip() for k, v in (filtros or {}).items() if v not in (None, "")}
+        bruto = json.dumps(
+            [VERSAO_FORMATOS, formato, filtros, opcoes, versao], sort_keys=True, separators=(",", ":")
+        )
+        return hashlib.sha256(bruto.encode("utf-8")).hexdigest()
+
+    def caminho(self, chave, formato):
+        return os.path.join(self.pasta, chave + EXTENSOES[formato])
+
+    def obter(self, chave, formato):
+        """Caminho do arquivo guardado (marcado como usado agora), ou None"""
+        if not self.habilitado:
+            return None
+        caminho = self.caminho(chave, formato)
+        try:
+            os.utime(caminho)
+        except OSError:
+            return None
+        with self._lock:
+            self.acertos += 1
+        return caminho
+
+    def arquivo_temporario(self, formato):
+        """Caminho temporário na pasta do cache (mesmo sistema de arquivos do destino)"""
+        os.makedirs(self.pasta, exist_ok=True)
+        return os.path.join(self.pasta, f".{uuid.uuid4().hex}{EXTENSOES[formato]}.tmp")
+
+    def guardar(self, chave, formato, temporario):
+        """
+        Move o arquivo gerado para o cache e descarta os menos usados acima do limite
+
+        :return: Caminho do arquivo guardado, ou None se ele não couber (o temporário fica)
+        """
+        with self._lock:
+            self.geracoes += 1
+        if not self.habilitado or os.path.getsize(temporario) > self.limite_bytes:
+            return None
+        caminho = self.caminho(chave, formato)
+        os.replace(temporario, caminho)
+        self._descartar(manter=caminho)
+        return caminho
+
+    def gerar(self, chave, formato, funcao):
+        """
+        Arquivo da chave, do cache ou gerado por funcao(caminho) -> bool
+
+        :return: Tupla (caminho, temporario) ou None se a geração falhar; temporario=True
+            quando o arquivo não coube no cache e deve ser removido depois de enviado
+        """
+        caminho = self.obter(chave, formato)
+        if caminho is not None:
+            return caminho, False
+        temporario = self.arquivo_temporario(formato)
+        pronto = False
+        try:
+            if not funcao(temporario):
+                return None
+            caminho = self.guardar(chave, formato, temporario)
+            pronto = True
+        finally:
+            if not pronto and os.path.exists(temporario):
+                os.remove(temporario)
+        return (caminho, False) if caminho is not None else (temporario, True)
+
+    def gravar_e_repassar(self, chave, formato, pedacos):
+        """
+        Repassa os pedaços de texto (download em streaming) gravando-os no cache
+
+        O arquivo só é guardado se o gerador for até o fim; download interrompido
+        ou erro na geração descartam o temporário.
+        """
+        if not self.habilitado:
+            yield from pedacos
+            return
+        temporario = self.arquivo_temporario(formato)
+        completo = False
+        try:
+            with open(temporario, "w", encoding="utf-8", newline="") as arquivo:
+                for pedaco in pedacos:
+                    arquivo.write(pedaco)
+                    yield pedaco
+            completo = True
+        finally:
+            if completo:
+                try:
+                    if self.guardar(chave, formato, temporario) is None:
+                        os.remove(temporario)
+                except OSError as e:
+                    logger.error("Erro ao guardar exportação no cache: %s", e)
+            elif os.path.exists(temporario):
+                os.remove(temporario)
+
+    def _descartar(self, manter=None):
+        """Remove os arquivos menos usados (mtime mais antigo) até caber no limite"""
+        with self._lock:
+            arquivos = []
+            for entrada in os.scandir(self.pasta):
+                if entrada.is_file() and not entrada.name.startswith("."):
+                    estado = entrada.stat()
+                    arquivos.append((estado.st_mtime, estado.st_size, entrada.path))
+            total = sum(tamanho for _, tamanho, _ in arquivos)
+            for _, tamanho, caminho in sorted(arquivos):
+                if total <= self.limite_bytes:
+                    break
+                if caminho == manter:
+                    continue
+                try:
+                    os.remove(caminho)
+                except OSError:
+                    continue
+                total -= tamanho
+                self.descartes += 1
+
+    def limpar(self):
+        """Remove todos os arquivos do cache"""
+        if not os.path.isdir(self.pasta):
+            return
+        with self._lock:
+            for entrada in os.scandir(self.pasta):
+                # Temporários (".") são de exportações em andamento
+                if entrada.is_file() and not entrada.name.startswith("."):
+                    os.remove(entrada.path)
+
+    def stats(self):
+        arquivos = [e for e in os.scandir(self.pasta) if e.is_file()] if os.path.isdir(self.pasta) else []
+        with self._lock:
+            return {
+                "acertos": self.acertos,
+                "geracoes": self.geracoes,
+                "descartes": self.descartes,
+                "arquivos": len(arquivos),
+                "bytes": sum(e.stat().st_size for e in arquivos),
+                "limite_bytes": self.limite_bytes,
+            }
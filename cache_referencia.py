@@ -0,0 +1,113 @@
+# Arquivo: cache_referencia.py
+"""
+Cache em memória dos dados de referência (UFs, municípios, tipos de serviço,
+bases de cálculo e tipos de recolhimento)
+
+Cada tabela de referência tem um contador em tb_versao_dados, incrementado por
+triggers (migração 5) a cada INSERT/UPDATE/DELETE — inclusive quando a alteração
+vem de outro processo. A cada acesso o cache lê os contadores (uma consulta em
+uma tabela de poucas linhas) e só recarrega a tabela cuja versão mudou.
+"""
+import threading
+
+TABELAS_REFERENCIA = (
+    "tb_uf",
+    "tb_tipo_de_servico",
+    "tb_base_calculo",
+    "tb_tipo_de_recolhimento",
+    "tb_cod_municipio",
+)
+
+
+def _lista(sql):
+    def carregar(c):
+        c.execute(sql)
+        return [row[0] for row in c.fetchall()]
+    return carregar
+
+
+def _carregar_municipios(c):
+    c.execute("SELECT UF, municipio, cod_municipio FROM tb_cod_municipio ORDER BY UF, municipio")
+    por_uf = {}
+    codigos = {}
+    for uf, municipio, cod_municipio in c.fetchall():
+        por_uf.setdefault(uf, []).append((municipio, cod_municipio))
+        codigos[(uf, municipio)] = cod_municipio
+    return {"por_uf": por_uf, "codigos": codigos}
+
+
+# tabela -> função que recebe o cursor e monta os dados em memória
+CARREGADORES = {
+    "tb_uf": _lista("SELECT UF FROM tb_uf ORDER BY UF"),
+    "tb_tipo_de_servico": _lista("SELECT descricao FROM tb_tipo_de_servico ORDER BY id"),
+    "tb_base_calculo": _lista("SELECT descricao FROM tb_base_calculo ORDER BY id"),
+    "tb_tipo_de_recolhimento": _lista("SELECT recolhimento FROM tb_tipo_de_recolhimento"),
+    "tb_cod_municipio": _carregar_municipios,
+}
+
+
+class CacheReferencia:
+    """Dados de referência em memória, invalidados pelos contadores de tb_versao_dados"""
+
+    def __init__(self, db):
+        self.db = db
+        self._lock = threading.Lock()
+        self._dados = {}  # tabela -> (versao, dados)
+        self.acertos = 0
+        self.cargas = 0
+
+    def versoes(self):
+        """Versão atual de cada tabela de referência"""
+        conn = self.db.create_connection()
+        if conn is not None:
+            try:
+                return dict(conn.execute("SELECT tabela, versao FROM tb_versao_dados").fetchall())
+            finally:
+                conn.close()
+        return {}
+
+    def obter(self, tabela):
+        """
+        Retorna (versao, dados) da tabela, recarregando-a se a versão mudou
+
+        Os dados devolvidos são compartilhados entre as requisições: não devem ser alterados.
+        Sem conexão disponível retorna (versao, None), sem guardar nada no cache.
+        """
+        versao = self.versoes().get(tabela)
+        item = self._dados.get(tabela)
+        if item is not None and item[0] == versao:
+            self.acertos += 1
+            return item
+
+        with self._lock:
+            item = self._dados.get(tabela)
+            if item is not None and item[0] == versao:
+                self.acertos += 1
+                return item
+
+            conn = self.db.create_connection()
+            if conn is None:
+                return versao, None
+            try:
+                item = (versao, CARREGADORES[tabela](conn.cursor()))
+            finally:
+                conn.close()
+            self._dados[tabela] = item
+            self.cargas += 1
+            return item
+
+    def invalidar(self, tabela=None):
+        """Descarta uma tabela (ou todas) do cache; o próximo acesso recarrega"""
+        with self._lock:
+            if tabela is None:
+                self._dados.clear()
+            else:
+                self._dados.pop(tabela, None)
+
+    def stats(self):
+        return {
+            "acertos": self.acertos,
+            "cargas": self.cargas,
+            "versoes": {tabela: item[0] for tabela, item in self._dados.items()},
+        }
+
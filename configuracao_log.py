@@ -0,0 +1,64 @@
+# Arquivo: configuracao_log.py
+"""
+Configuração do logging da aplicação
+
+Os módulos registram mensagens com logging.getLogger(__name__) e formatação
+preguiçosa (logger.info("... %s", valor)): abaixo do nível configurado a
+mensagem nem chega a ser montada.
+
+Variáveis de ambiente:
+    LOG_LEVEL   DEBUG, INFO (padrão), WARNING, ERROR
+    LOG_FORMAT  text (padrão) ou json (uma linha JSON por registro)
+"""
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+
+# Atributos que todo LogRecord tem; o que sobrar veio de extra={...}
+_ATRIBUTOS_PADRAO = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+FORMATO_TEXTO = "%(asctime)s %(levelname)-7s %(name)s: %(message)s"
+
+
+class FormatadorJSON(logging.Formatter):
+    """Uma linha JSON por registro, incluindo os campos passados em extra={...}"""
+
+    def format(self, record):
+        dados = {
+            "momento": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensagem": record.getMessage(),
+        }
+        for chave, valor in vars(record).items():
+            if chave not in _ATRIBUTOS_PADRAO and not chave.startswith("_"):
+                dados[chave] = valor
+        if record.exc_info:
+            dados["excecao"] = self.formatException(record.exc_info)
+        return json.dumps(dados, ensure_ascii=False, default=str)
+
+
+def configurar_logging(nivel=None, formato=None, stream=None):
+    """
+    Configura o logger raiz (nível e formato) a partir dos argumentos ou do ambiente
+
+    Pode ser chamada mais de uma vez: o handler instalado anteriormente é substituído.
+    """
+    nivel = (nivel or os.environ.get("LOG_LEVEL") or "INFO").upper()
+    formato = (formato or os.environ.get("LOG_FORMAT") or "text").lower()
+
+    handler = logging.StreamHandler(stream or sys.stderr)
+    if formato == "json":
+        handler.setFormatter(FormatadorJSON())
+    else:
+        handler.setFormatter(logging.Formatter(FORMATO_TEXTO))
+    handler._configuracao_log = True
+
+    raiz = logging.getLogger()
+    for anterior in [h for h in raiz.handlers if getattr(h, "_configuracao_log", False)]:
+        raiz.removeHandler(anterior)
+    raiz.addHandler(handler)
+    raiz.setLevel(nivel)
+    return raiz
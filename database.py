@@ -0,0 +1,2309 @@
+# Arquivo: database.py - VERSÃO CORRIGIDA
+import sqlite3
+from sqlite3 import Error
+import os
+import sys
+import json
+import base64
+import logging
+import queue
+import threading
+import itertools
+import time
+from migrations import VERSAO_ATUAL, aplicar_migracoes, versao_schema, verificar_planos_consulta
+import agregados
+import arquivamento
+from apuracao import CacheApuracao
+from cache_exportacao import CacheExportacao
+from cache_referencia import CacheReferencia
+from particionamento import GerenciadorParticoes
+from snapshot_colunar import SnapshotColunar
+import snapshot_colunar
+import busca
+import journal
+import deduplicacao
+import metricas
+
+logger = logging.getLogger(__name__)
+
+def get_application_path():
+    """Obtém o caminho base da aplicação, funcionando tanto em desenvolvimento quanto compilado"""
+    if getattr(sys, "frozen", False):
+        # Se estiver rodando como executável (compilado)
+        application_path = os.path.dirname(sys.executable)
+    else:
+        # Se estiver rodando em desenvolvimento
+        application_path = os.path.dirname(os.path.abspath(__file__))
+    return application_path
+
+
+def montar_filtro_notas(filtros):
+    """
+    Monta a cláusula WHERE (sem a palavra WHERE) para consultas em tb_notas_fiscais
+
+    Filtros aceitos (todos opcionais): referencia, cnpj, fornecedor_id,
+    fornecedor (trecho da razão social), dt_inicio, dt_fim (AAAA-MM-DD) e recolhimento.
+    A tabela de notas deve usar o alias "nf" e a de fornecedores o alias "f".
+
+    :return: Tupla (lista de condições, lista de parâmetros)
+    """
+    condicoes = []
+    params = []
+    filtros = filtros or {}
+
+    if filtros.get('referencia'):
+        condicoes.append("nf.referencia = ?")
+        params.append(filtros['referencia'].strip())
+    if filtros.get('cnpj'):
+        # O CNPJ da nota pode estar gravado com pontuação: compara só os dígitos (índice da migração 14)
+        condicoes.append(f"{deduplicacao.CNPJ_NORMALIZADO.format(p='nf.')} = ?")
+        params.append(''.join(filter(str.isdigit, str(filtros['cnpj']))))
+    if filtros.get('fornecedor_id'):
+        try:
+            fornecedor_id = int(filtros['fornecedor_id'])
+        except (TypeError, ValueError):
+            raise ValueError(f"Filtro fornecedor_id inválido: {filtros['fornecedor_id']!r}")
+        condicoes.append("nf.fornecedor_id = ?")
+        params.append(fornecedor_id)
+    if filtros.get('fornecedor'):
+        condicoes.append("f.descricao_fornecedor LIKE ?")
+        params.append(f"%{filtros['fornecedor'].strip()}%")
+    if filtros.get('dt_inicio'):
+        condicoes.append("nf.dt_emissao >= ?")
+        params.append(filtros['dt_inicio'])
+    if filtros.get('dt_fim'):
+        condicoes.append("nf.dt_emissao <= ?")
+        params.append(filtros['dt_fim'])
+    if filtros.get('recolhimento'):
+        condicoes.append("nf.recolhimento_id = (SELECT id FROM tb_tipo_de_recolhimento WHERE recolhimento = ?)")
+        params.append(filtros['recolhimento'])
+
+    return condicoes, params
+
+
+def codificar_cursor_notas(dt_emissao, nota_id):
+    """Gera o token opaco de paginação a partir da última nota da página"""
+    bruto = json.dumps([dt_emissao, nota_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(bruto).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor_notas(token):
+    """
+    Decodifica o token de paginação gerado por codificar_cursor_notas
+
+    :raises ValueError: se o token for inválido
+    """
+    try:
+        bruto = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        dt_emissao, nota_id = json.loads(bruto.decode('utf-8'))
+        return dt_emissao, int(nota_id)
+    except Exception:
+        raise ValueError("Cursor de paginação inválido")
+
+
+# Colunas aceitas na ordenação da listagem -> expressão SQL (aliases "nf" e "f").
+# A referência (MM/AAAA) é ordenada como AAAAMM; o id desempata todas.
+ORDENACOES_NOTAS = {
+    'dt_emissao': "nf.dt_emissao",
+    'numero_nf': "nf.numero_nf",
+    'fornecedor': "f.descricao_fornecedor",
+    'cnpj': "nf.cnpj",
+    'valor_nf': "nf.valor_nf",
+    'aliquota': "nf.aliquota",
+    'referencia': "substr(nf.referencia, 4) || substr(nf.referencia, 1, 2)",
+}
+
+
+def sql_listagem_notas(where="", ordem="nf.dt_emissao DESC, nf.id DESC"):
+    """SELECT das colunas da listagem de notas (página da API e tela inicial), sem LIMIT"""
+    return f"""
+        SELECT
+            nf.id,
+            nf.referencia,
+            nf.cadastrado_goiania,
+            nf.fora_pais,
+            nf.cnpj,
+            f.descricao_fornecedor,
+            nf.tipo_servico,
+            nf.base_calculo,
+            nf.numero_nf,
+            nf.dt_emissao,
+            nf.dt_pagamento,
+            nf.aliquota,
+            nf.valor_nf,
+            tr.recolhimento
+        FROM tb_notas_fiscais nf
+        LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+        LEFT JOIN tb_tipo_de_recolhimento tr ON nf.recolhimento_id = tr.id
+        {where}
+        ORDER BY {ordem}
+    """
+
+
+def _linha_listagem(colunas, linha):
+    nota = dict(zip(colunas, linha))
+    nota['aliquota'] = float(nota['aliquota'] or 0)
+    nota['valor_nf'] = float(nota['valor_nf'] or 0)
+    return nota
+
+
+# Nome recebido (formulário/planilha ou nome da coluna) -> coluna de tb_notas_fiscais.
+# "recolhimento" é a descrição: vira recolhimento_id; alterar o CNPJ recalcula fornecedor_id.
+CAMPOS_NOTA = {
+    "Referencia": "referencia",
+    "Cadastrado em Goiania": "cadastrado_goiania",
+    "CNPJ": "cnpj",
+    "Inscrição Municipal": "inscricao_municipal",
+    "Tipo de Serviço": "tipo_servico",
+    "Base de Cálculo": "base_calculo",
+    "Nº NF": "numero_nf",
+    "Dt. Emissão": "dt_emissao",
+    "Dt. Pagamento": "dt_pagamento",
+    "Aliquota": "aliquota",
+    "Valor NF": "valor_nf",
+    "Recolhimento": "recolhimento",
+    "RECIBO": "recibo",
+    "UF": "uf",
+    "Município": "municipio",
+    "Código Município": "cod_municipio",
+    "fora_pais": "fora_pais",
+}
+
+
+def mapear_campos_nota(dados):
+    """
+    Converte os campos recebidos em {coluna: valor}, só com os campos presentes
+
+    :raises ValueError: se alíquota ou valor não forem numéricos
+    """
+    campos = {}
+    for nome, coluna in CAMPOS_NOTA.items():
+        if nome in dados:
+            campos[coluna] = dados[nome]
+        elif coluna in dados:
+            campos[coluna] = dados[coluna]
+    for coluna in ("aliquota", "valor_nf"):
+        if campos.get(coluna) not in (None, ""):
+            try:
+                campos[coluna] = float(campos[coluna])
+            except (TypeError, ValueError):
+                raise ValueError(f"Valor numérico inválido para {coluna}: {campos[coluna]!r}")
+    return campos
+
+
+def montar_atualizacao_nota(campos):
+    """
+    Monta a cláusula SET (sem a palavra SET) de um UPDATE em tb_notas_fiscais
+
+    :param campos: {coluna: valor} como devolvido por mapear_campos_nota
+    :return: Tupla (lista de atribuições, lista de parâmetros)
+    """
+    atribuicoes = []
+    params = []
+    for coluna, valor in campos.items():
+        if coluna == "recolhimento":
+            atribuicoes.append("recolhimento_id = (SELECT id FROM tb_tipo_de_recolhimento WHERE recolhimento = ?)")
+            params.append(valor)
+            continue
+        atribuicoes.append(f"{coluna} = ?")
+        params.append(valor)
+        if coluna == "cnpj":
+            atribuicoes.append("fornecedor_id = (SELECT id FROM tb_fornecedores WHERE CNPJ = ?)")
+            params.append(valor)
+    return atribuicoes, params
+
+
+# Versão dos dados padrão (UFs, tipos, bases, recolhimentos, tomador KLB): incrementar
+# ao mudar populate_default_data_safe ou insert_klb_tomador
+VERSAO_DADOS_PADRAO = 1
+
+# Gravada em PRAGMA user_version ao fim da inicialização. Se bater com o banco, o start
+# pula create_tables/dados padrão; uma migração nova ou novos dados padrão mudam o valor.
+VERSAO_INICIALIZACAO = VERSAO_ATUAL * 100 + VERSAO_DADOS_PADRAO
+
+# Limite de erros por linha guardados nos relatórios de importação
+MAX_ERROS_RELATORIO = 1000
+
+# PRAGMAs aplicados em toda conexão aberta pelo pool
+DEFAULT_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -20000,       # negativo = KiB (~20 MB por conexão)
+    "mmap_size": 268435456,     # 256 MB
+    "busy_timeout": 5000,       # ms
+    "temp_store": "MEMORY",
+}
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Conexão sqlite3 que volta para o pool ao ser fechada
+
+    Como é uma subclasse de sqlite3.Connection, continua funcionando com
+    pd.read_sql_query e com o padrão conn = create_connection() ... conn.close().
+    """
+    _pool = None
+    _emprestada = False
+    # Limpeza do estado da conexão (ex.: bancos anexados) executada ao voltar para o pool
+    _ao_devolver = None
+
+    if metricas.HABILITADO:
+        # Todo cursor (inclusive os de conn.execute e do pandas) mede os statements
+        def cursor(self, factory=None):
+            return super().cursor(factory or metricas.CURSOR)
+
+        def execute(self, sql, parametros=()):
+            return self.cursor().execute(sql, parametros)
+
+        def executemany(self, sql, sequencia):
+            return self.cursor().executemany(sql, sequencia)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.devolver(self)
+        else:
+            super().close()
+
+
+class ConnectionPool:
+    """
+    Pool limitado e thread-safe de conexões SQLite de longa duração
+
+    As conexões são criadas sob demanda até o limite de tamanho e reaproveitadas
+    depois (LIFO, para manter o cache de páginas quente). Cada conexão mantém seu
+    próprio cache de statements preparados (cached_statements).
+    """
+
+    def __init__(self, db_file, size=5, pragmas=None, timeout=30.0, cached_statements=256):
+        self.db_file = db_file
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        self.pragmas.update(pragmas or {})
+
+        self._ociosas = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._stats = {"criadas": 0, "reutilizadas": 0, "em_uso": 0, "esperas": 0, "timeouts": 0}
+
+        os.makedirs(os.path.dirname(self.db_file), exist_ok=True)
+
+    def _nova_conexao(self):
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=self.pragmas.get("busy_timeout", 5000) / 1000,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+            factory=PooledConnection,
+        )
+        for nome, valor in self.pragmas.items():
+            conn.execute(f"PRAGMA {nome} = {valor}")
+        # Funções SQL chamadas pelas triggers do journal
+        journal.registrar_funcoes(conn)
+        conn._pool = self
+        conn._emprestada = True
+        return conn
+
+    def _verificar_fork(self):
+        # Depois de um fork (ex.: gunicorn com preload) as conexões herdadas não podem ser usadas
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._ociosas = queue.LifoQueue()
+                    self._stats.update(criadas=0, em_uso=0)
+                    self._pid = os.getpid()
+
+    def obter(self):
+        """
+        Retira uma conexão do pool, criando uma nova se ainda houver espaço
+
+        :raises sqlite3.OperationalError: se nenhuma conexão ficar livre dentro do timeout
+        """
+        self._verificar_fork()
+        try:
+            conn = self._ociosas.get_nowait()
+            with self._lock:
+                self._stats["reutilizadas"] += 1
+                self._stats["em_uso"] += 1
+            conn._emprestada = True
+            return conn
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            pode_criar = self._stats["criadas"] < self.size
+            if pode_criar:
+                self._stats["criadas"] += 1
+                self._stats["em_uso"] += 1
+            else:
+                self._stats["esperas"] += 1
+
+        if pode_criar:
+            try:
+                return self._nova_conexao()
+            except Exception:
+                with self._lock:
+                    self._stats["criadas"] -= 1
+                    self._stats["em_uso"] -= 1
+                raise
+
+        try:
+            conn = self._ociosas.get(timeout=self.timeout)
+        except queue.Empty:
+            with self._lock:
+                self._stats["timeouts"] += 1
+            raise sqlite3.OperationalError(
+                f"Pool de conexões esgotado ({self.size} conexões em uso)"
+            )
+        with self._lock:
+            self._stats["reutilizadas"] += 1
+            self._stats["em_uso"] += 1
+        conn._emprestada = True
+        return conn
+
+    def devolver(self, conn):
+        """Devolve a conexão ao pool, desfazendo qualquer transação pendente"""
+        if os.getpid() != self._pid or not conn._emprestada:
+            # Conexão herdada de outro processo ou fechada duas vezes
+            return
+        conn._emprestada = False
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            if conn._ao_devolver is not None:
+                limpeza, conn._ao_devolver = conn._ao_devolver, None
+                limpeza(conn)
+        except sqlite3.Error:
+            # Conexão inutilizável: descarta e libera a vaga para outra
+            with self._lock:
+                self._stats["criadas"] -= 1
+                self._stats["em_uso"] -= 1
+            sqlite3.Connection.close(conn)
+            return
+        with self._lock:
+            self._stats["em_uso"] -= 1
+        self._ociosas.put(conn)
+
+    def fechar(self):
+        """Fecha todas as conexões ociosas do pool"""
+        while True:
+            try:
+                conn = self._ociosas.get_nowait()
+            except queue.Empty:
+                break
+            sqlite3.Connection.close(conn)
+            with self._lock:
+                self._stats["criadas"] -= 1
+
+    def stats(self):
+        """Retorna um retrato das estatísticas de uso do pool"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["tamanho"] = self.size
+        stats["ociosas"] = self._ociosas.qsize()
+        stats["pragmas"] = dict(self.pragmas)
+        return stats
+
+@metricas.instrumentar_metodos
+class DatabaseManager:
+    def __init__(self, db_file="app_rest_gyn.db", pool_size=5, pragmas=None, pool_timeout=30.0, inicializar=True,
+                 tomador_id=None, pasta_tomadores=None):
+        # Definir o caminho do banco de dados
+        app_path = get_application_path()
+        # Se estiver compilado, usar a pasta 'app' dentro do diretório do executável
+        if getattr(sys, "frozen", False):
+            self.db_file = os.path.join(app_path, "app", db_file)
+        else:
+            self.db_file = os.path.join(app_path, db_file)
+
+        logger.debug("Caminho do banco de dados: %s", self.db_file)
+
+        # Pool de conexões compartilhado por todos os métodos
+        self.pool = ConnectionPool(self.db_file, size=pool_size, pragmas=pragmas, timeout=pool_timeout)
+
+        # Competências arquivadas (um banco por ano), anexadas só quando a consulta as alcança
+        self.pasta_arquivo = arquivamento.pasta_arquivo(self.db_file)
+
+        # UFs, municípios, tipos, bases e recolhimentos em memória (invalidados por versão)
+        self.referencias = CacheReferencia(self)
+
+        # Apurações de ISS por (tomador, referência), invalidadas pela versão da referência
+        self.apuracoes = CacheApuracao(self)
+
+        # Arquivos exportados (Excel/TXT) em disco, por filtros e versão dos dados
+        self.exportacoes = CacheExportacao(self)
+
+        # Notas por referência em arquivos colunares mapeados em memória (apuração, resumos e análises)
+        self.snapshot = SnapshotColunar(self)
+
+        # Banco comum: partições por tomador abertas sob demanda (ver particionamento.py).
+        # Numa partição, tomador_id é o tomador dono do arquivo.
+        self.tomador_id = tomador_id
+        self.particoes = GerenciadorParticoes(self, pasta_tomadores) if tomador_id is None else None
+        
+        # Schema e dados padrão só são (re)criados se a versão gravada no banco estiver
+        # desatualizada; reparos pesados ficam no comando de manutenção (manutencao.py)
+        if inicializar and not self.inicializacao_em_dia():
+            self.inicializar()
+
+    def inicializacao_em_dia(self):
+        """Uma leitura de PRAGMA user_version: True se o banco já está na VERSAO_INICIALIZACAO"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                return conn.execute("PRAGMA user_version").fetchone()[0] == VERSAO_INICIALIZACAO
+            except Error as e:
+                logger.error("Erro ao ler a versão do banco: %s", e)
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def inicializar(self):
+        """
+        Cria as tabelas, aplica as migrações e grava os dados padrão e o tomador KLB
+
+        Tudo é idempotente; ao final grava VERSAO_INICIALIZACAO em PRAGMA user_version
+        para que os próximos starts pulem esta etapa.
+
+        :return: True se todas as etapas terminaram sem erro
+        """
+        inicio = time.perf_counter()
+        ok = self.create_tables() and self.populate_default_data_safe() and self.insert_klb_tomador()
+        if not ok:
+            logger.error("Inicialização do banco incompleta; será repetida no próximo start")
+            return False
+
+        conn = self.create_connection()
+        if conn is None:
+            return False
+        try:
+            conn.execute(f"PRAGMA user_version = {VERSAO_INICIALIZACAO}")
+        finally:
+            conn.close()
+        logger.info(
+            "Banco inicializado (versão %s) em %.1f ms", VERSAO_INICIALIZACAO, (time.perf_counter() - inicio) * 1000
+        )
+        return True
+    
+    def create_connection(self):
+        """Obtém uma conexão do pool; conn.close() devolve a conexão ao pool"""
+        try:
+            return self.pool.obter()
+        except Error as e:
+            logger.error("Erro ao conectar ao banco de dados: %s", e)
+            return None
+
+    def conexao_notas(self, filtros=None):
+        """
+        Conexão do pool para leitura de notas, com os arquivos que os filtros alcançam anexados
+
+        Nela, tb_notas_fiscais (sem esquema) inclui as competências arquivadas
+        (ver arquivamento.anexar); a limpeza acontece no conn.close().
+
+        :raises ValueError: se a consulta alcançar anos arquivados demais
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                arquivamento.anexar(conn, self.pasta_arquivo, filtros)
+            except Error as e:
+                logger.error("Erro ao anexar competências arquivadas: %s", e)
+                conn.close()
+                return None
+            except Exception:
+                conn.close()
+                raise
+        return conn
+
+    def pool_stats(self):
+        """Estatísticas do pool de conexões (criadas, em uso, esperas, timeouts...)"""
+        return self.pool.stats()
+
+    def limpar_duplicatas_base_calculo(self):
+        """Remove registros duplicados da tabela tb_base_calculo"""
+        return self.deduplicar(["tb_base_calculo"], executar=True) is not None
+
+    def limpar_todas_duplicatas(self):
+        """Remove duplicatas de todas as tabelas de configuração"""
+        return self.deduplicar(deduplicacao.TABELAS_CONFIGURACAO, executar=True) is not None
+
+    def deduplicar(self, tabelas=None, executar=False):
+        """
+        Relatório ou mesclagem das duplicatas (ver deduplicacao.deduplicar)
+
+        :param tabelas: Tabelas de deduplicacao.REGRAS (padrão: todas, inclusive notas fiscais)
+        :param executar: False só relata; True reaponta fornecedor_id/recolhimento_id e remove
+        :return: Relatório por tabela, ou None em caso de erro
+        :raises ValueError: se alguma tabela não tiver regra de deduplicação
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                relatorio = deduplicacao.deduplicar(conn, tabelas, executar, pasta_arquivo=self.pasta_arquivo)
+                for tabela, item in relatorio.items():
+                    if item["excedentes"]:
+                        logger.info(
+                            "%s: %s duplicatas em %s grupos%s", tabela, item["excedentes"], item["grupos"],
+                            " (removidas)" if executar else ""
+                        )
+                return relatorio
+            except ValueError:
+                raise
+            except Exception as e:
+                logger.error("Erro ao deduplicar: %s", e)
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def encontrar_nota_duplicada(self, cnpj, numero_nf, referencia, ignorar_id=None):
+        """ID da nota com o mesmo CNPJ, número e referência (exceto ignorar_id), ou None"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                return deduplicacao.nota_duplicada(conn.cursor(), cnpj, numero_nf, referencia, ignorar_id)
+            finally:
+                conn.close()
+        return None
+
+    def insert_klb_tomador(self):
+        """
+        Insere o tomador KLB ACCOUTING na base de dados
+        
+        :return: True se a inserção foi bem-sucedida, False caso contrário
+        """
+        logger.info("Inserindo tomador KLB ACCOUTING...")
+        
+        # Verificar primeiro se já existe um tomador com este CNPJ
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                c.execute("SELECT id FROM tb_config_tomador WHERE cnpj = ?", ('09238316000190',))
+                exists = c.fetchone()
+                
+                if exists:
+                    logger.info("Tomador KLB já existe com ID %s", exists[0])
+                    return True
+                    
+                # A coluna email vem da migração 13
+                c.execute("""
+                    INSERT INTO tb_config_tomador 
+                    (razao_social, cnpj, cae_inscricao, usuario_prefeitura, email, data_atualizacao)
+                    VALUES (?, ?, ?, ?, ?, datetime('now'))
+                """, (
+                    'KLB ACCOUTING CONTABILIDADE EMPRESARIAL EIRELI',
+                    '09238316000190',
+                    '2425459',
+                    '53052749153',
+                    ''
+                ))
+                
+                conn.commit()
+                logger.info("Tomador KLB inserido com sucesso!")
+                return True
+                
+            except Exception as e:
+                logger.error("Erro ao inserir tomador KLB: %s", e)
+                import traceback
+                traceback.print_exc()
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        
+        return False
+
+    def create_tables(self):
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+
+                # Criar tabela de configuração do tomador
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS tb_config_tomador (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        razao_social TEXT NOT NULL,
+                        cnpj TEXT NOT NULL,
+                        cae_inscricao TEXT NOT NULL,
+                        usuario_prefeitura TEXT NOT NULL,
+                        data_atualizacao TEXT
+                    )
+                """)
+
+                # Criar tabela UF
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS tb_uf (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        UF TEXT UNIQUE NOT NULL
+                    )
+                """)
+
+                # Criar tabela Tipo de Serviço
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS tb_tipo_de_servico (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        descricao TEXT UNIQUE NOT NULL
+                    )
+                """)
+                
+                # Criar tabela Base de Cálculo (NOVA TABELA)
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS tb_base_calculo (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        descricao TEXT UNIQUE NOT NULL
+                    )
+                """)
+
+                # Criar tabela Tipo de Recolhimento
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS tb_tipo_de_recolhimento (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        recolhimento TEXT UNIQUE NOT NULL
+                    )
+                """)
+
+                # Criar tabela Código Município
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS tb_cod_municipio (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        UF TEXT,
+                        municipio TEXT,
+                        cod_municipio TEXT,
+                        FOREIGN KEY (UF) REFERENCES tb_uf (UF)
+                    )
+                """)
+
+                # Criar tabela de Fornecedores
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS tb_fornecedores (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        CNPJ TEXT UNIQUE,
+                        descricao_fornecedor TEXT,
+                        UF TEXT,
+                        municipio TEXT,
+                        cod_municipio TEXT,
+                        fora_pais TEXT DEFAULT 'Não',
+                        cadastrado_goiania TEXT DEFAULT 'Não',
+                        FOREIGN KEY (UF) REFERENCES tb_uf (UF)
+                    )
+                """)
+
+                # Criar tabela de Notas Fiscais (com o campo base_calculo)
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS tb_notas_fiscais (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        referencia TEXT,
+                        cadastrado_goiania TEXT,
+                        fora_pais TEXT,
+                        cnpj TEXT,
+                        fornecedor_id INTEGER,
+                        inscricao_municipal TEXT,
+                        tipo_servico TEXT,
+                        base_calculo TEXT,
+                        numero_nf TEXT,
+                        dt_emissao TEXT,
+                        dt_pagamento TEXT,
+                        aliquota REAL,
+                        valor_nf REAL,
+                        recolhimento_id INTEGER,
+                        recibo TEXT,
+                        uf TEXT,
+                        municipio TEXT,
+                        cod_municipio TEXT,
+                        FOREIGN KEY (fornecedor_id) REFERENCES tb_fornecedores (id),
+                        FOREIGN KEY (recolhimento_id) REFERENCES tb_tipo_de_recolhimento (id)
+                    )
+                """)
+
+                # Verificar se já existe configuração de tomador
+                c.execute("SELECT COUNT(*) FROM tb_config_tomador")
+                if c.fetchone()[0] == 0:
+                    # Inserir registro vazio para ser atualizado posteriormente
+                    c.execute("""
+                        INSERT INTO tb_config_tomador 
+                        (razao_social, cnpj, cae_inscricao, usuario_prefeitura, data_atualizacao)
+                        VALUES (?, ?, ?, ?, datetime('now'))
+                    """, ("", "", "", ""))
+
+                conn.commit()
+
+                # Colunas novas, índices e demais alterações versionadas
+                aplicar_migracoes(conn)
+                return True
+            except Error as e:
+                logger.error("Erro ao criar tabelas: %s", e)
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def versao_schema(self):
+        """Retorna a última versão de migração aplicada no banco"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                return versao_schema(conn)
+            finally:
+                conn.close()
+        return 0
+
+    def verificar_planos_consulta(self):
+        """
+        Verifica se as consultas críticas usam índice
+
+        :return: Lista de (nome da consulta, detalhe do plano) que caíram em varredura completa
+        """
+        # Conexão avulsa: os planos em cache nas conexões do pool podem estar desatualizados
+        conn = sqlite3.connect(self.db_file, cached_statements=0)
+        try:
+            return verificar_planos_consulta(conn)
+        finally:
+            conn.close()
+
+    def get_estatisticas(self):
+        """Totais gerais lidos de tb_agregados_notas/tb_contadores (sem varrer as tabelas)"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                return agregados.estatisticas(conn)
+            finally:
+                conn.close()
+        return None
+
+    def get_estatisticas_por(self, dimensao):
+        """
+        Quebra das notas por referencia, uf, tipo_servico ou recolhimento (agregados), ou
+        por mes_emissao, mes_pagamento ou fornecedor (snapshot colunar)
+
+        :raises ValueError: se a dimensão não existir
+        """
+        if dimensao in snapshot_colunar.DIMENSOES:
+            try:
+                return self.snapshot.estatisticas_por(dimensao)
+            except (Error, OSError) as e:
+                logger.error("Erro ao calcular estatísticas pelo snapshot colunar: %s", e)
+                return []
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                return agregados.estatisticas_por(conn, dimensao)
+            finally:
+                conn.close()
+        return []
+
+    def apurar(self, referencia, tomador_id=None):
+        """
+        Apuração do ISS da competência (ver apuracao.apurar), com cache por versão
+
+        :return: Dicionário da apuração (valores em centavos), ou None sem conexão
+        :raises ValueError: se a referência for vazia ou o tomador não for encontrado
+        """
+        return self.apuracoes.obter(referencia, tomador_id)
+
+    def banco_tomador(self, tomador_id):
+        """
+        DatabaseManager da partição (arquivo próprio) do tomador
+
+        :raises ValueError: se o tomador não estiver cadastrado, ou se chamado em outra partição
+        """
+        if self.particoes is None:
+            if int(tomador_id) == self.tomador_id:
+                return self
+            raise ValueError(f"Esta é a partição do tomador {self.tomador_id}")
+        return self.particoes.obter(tomador_id)
+
+    def relatorio_tomadores(self, referencia=None, tomadores=None):
+        """
+        Estatísticas e apuração por tomador, consultando as partições em paralelo
+
+        :return: Ver particionamento.GerenciadorParticoes.relatorio
+        :raises ValueError: se algum tomador pedido não tiver partição
+        """
+        if self.particoes is None:
+            raise ValueError("Relatório entre tomadores só está disponível no banco comum")
+        return self.particoes.relatorio(referencia, tomadores)
+
+    def arquivar_referencia(self, referencia, compactar=True):
+        """
+        Move uma competência fechada para o arquivo do ano (ver arquivamento.arquivar)
+
+        :return: Resumo do arquivamento, ou None em caso de erro
+        :raises ValueError: referência inválida, aberta, já arquivada ou sem notas
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                # Mover notas para o arquivo não é alteração de dados: fica fora do journal
+                with journal.suspenso(conn):
+                    resumo = arquivamento.arquivar(conn, self.pasta_arquivo, referencia, compactar=compactar)
+                logger.info("Competência %s arquivada: %s notas em %.2f s",
+                            resumo["referencia"], resumo["notas"], resumo["segundos"])
+                return resumo
+            except Error as e:
+                logger.error("Erro ao arquivar a competência %s: %s", referencia, e)
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def restaurar_referencia(self, referencia):
+        """
+        Devolve uma competência arquivada para a tabela de notas (ver arquivamento.restaurar)
+
+        :return: Resumo da restauração, ou None em caso de erro
+        :raises ValueError: se a competência não estiver arquivada
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                with journal.suspenso(conn):
+                    resumo = arquivamento.restaurar(conn, self.pasta_arquivo, referencia)
+                logger.info("Competência %s restaurada: %s notas", resumo["referencia"], resumo["notas"])
+                return resumo
+            except Error as e:
+                logger.error("Erro ao restaurar a competência %s: %s", referencia, e)
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def referencias_para_arquivar(self, manter_meses=12):
+        """Competências quentes anteriores aos últimos manter_meses meses"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                return arquivamento.referencias_antigas(conn, manter_meses)
+            finally:
+                conn.close()
+        return []
+
+    def listar_arquivadas(self):
+        """Competências arquivadas com os totais do catálogo"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                return arquivamento.listar(conn)
+            finally:
+                conn.close()
+        return []
+
+    def alteracoes_journal(self, desde=0, limite=1000, tabelas=None):
+        """
+        Alterações registradas no journal depois do seq desde (ver journal.alteracoes)
+
+        :return: Página do feed, ou None em caso de erro
+        :raises ValueError: se alguma tabela não tiver journal
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                return journal.alteracoes(conn, desde, limite, tabelas)
+            except Error as e:
+                logger.error("Erro ao ler o journal: %s", e)
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def desfazer_alteracoes(self, desde=None, momento=None, tabelas=None, simular=False):
+        """
+        Reverte as alterações posteriores ao seq desde ou ao momento (UTC) (ver journal.desfazer)
+
+        :return: Resumo da reversão, ou None em caso de erro
+        :raises ValueError: sem desde/momento, tabela sem journal ou conflito na reversão
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                if desde is None:
+                    desde = journal.seq_no_momento(conn, momento)
+                resumo = journal.desfazer(conn, desde, tabelas, simular)
+                logger.info("Alterações desfeitas depois do seq %s: %s", resumo["desde"], resumo["revertidas"])
+                return resumo
+            except Error as e:
+                logger.error("Erro ao desfazer alterações: %s", e)
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def podar_journal(self, dias):
+        """
+        Exclui as linhas do journal com mais de dias dias
+
+        :return: Quantidade de linhas excluídas, ou None em caso de erro
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                ate = conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM tb_journal WHERE momento < datetime('now', ?)",
+                    (f"-{int(dias)} days",)
+                ).fetchone()[0]
+                return journal.podar(conn, ate)
+            except Error as e:
+                logger.error("Erro ao podar o journal: %s", e)
+                conn.rollback()
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def verificar_agregados(self, corrigir=False):
+        """
+        Compara os agregados mantidos pelas triggers com um recálculo completo
+
+        :param corrigir: Se True e houver divergências, reconstrói os agregados
+        :return: Lista de divergências encontradas (antes da correção)
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                # Leitura e eventual correção na mesma transação: nenhuma escrita entra no meio
+                c.execute("BEGIN IMMEDIATE")
+                divergencias = agregados.verificar_agregados(conn)
+                if divergencias and corrigir:
+                    agregados.recalcular_agregados(c)
+                conn.commit()
+                return divergencias
+            except Exception as e:
+                logger.error("Erro ao verificar agregados: %s", e)
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        return []
+
+    def buscar(self, termo, tipos=None, limite=busca.LIMITE_PADRAO, uf=None):
+        """
+        Busca por prefixo, sem acentos, em fornecedores (razão social/CNPJ), municípios e notas (número/recibo)
+
+        :raises ValueError: se algum tipo de busca for desconhecido
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                return busca.buscar(conn, termo, tipos, limite, uf)
+            finally:
+                conn.close()
+        return {}
+
+    def reconstruir_indices_busca(self):
+        """Recria os índices FTS a partir das tabelas (ex.: após restaurar um backup antigo)"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                c.execute("BEGIN IMMEDIATE")
+                busca.reconstruir_indices(c)
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error("Erro ao reconstruir índices de busca: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def get_all_tipos_servico(self):
+        return list(self.referencias.obter("tb_tipo_de_servico")[1] or [])
+
+    def get_all_bases_calculo(self):
+        return list(self.referencias.obter("tb_base_calculo")[1] or [])
+
+    def populate_default_data_safe(self):
+        """Versão segura que evita duplicatas ao popular dados padrão"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+
+                # UFs - Verificar antes de inserir
+                c.execute("SELECT COUNT(*) FROM tb_uf")
+                if c.fetchone()[0] == 0:
+                    logger.info("Inserindo UFs...")
+                    ufs = [
+                        "AC", "AL", "AP", "AM", "BA", "CE", "DF", "ES", "GO", "MA",
+                        "MT", "MS", "MG", "PA", "PB", "PR", "PE", "PI", "RJ", "RN",
+                        "RS", "RO", "RR", "SC", "SP", "SE", "TO"
+                    ]
+                    c.executemany(
+                        "INSERT INTO tb_uf (UF) VALUES (?)",
+                        [(uf,) for uf in ufs]
+                    )
+                    logger.info("Inseridas %s UFs", len(ufs))
+
+                # Tipos de Serviço - Verificar antes de inserir
+                c.execute("SELECT COUNT(*) FROM tb_tipo_de_servico")
+                if c.fetchone()[0] == 0:
+                    logger.info("Inserindo tipos de serviço...")
+                    tipos_servico = [
+                        "00 - Normal",
+                        "02 - Imune",
+                        "03 - Art 54 do CTM",
+                        "04 - Liminar",
+                        "05 - Simples Nacional",
+                        "07 - ISS Estimado",
+                        "08 - Não Incidência",
+                        "09 - Isento",
+                        "10 - Imposto Fixo"
+                    ]
+                    c.executemany(
+                        "INSERT INTO tb_tipo_de_servico (descricao) VALUES (?)",
+                        [(tipo,) for tipo in tipos_servico]
+                    )
+                    logger.info("Inseridos %s tipos de serviço", len(tipos_servico))
+                
+                # Bases de Cálculo - Verificar antes de inserir
+                c.execute("SELECT COUNT(*) FROM tb_base_calculo")
+                if c.fetchone()[0] == 0:
+                    logger.info("Inserindo bases de cálculo...")
+                    bases_calculo = [
+                        "00 - Base de cálculo normal",
+                        "01 - Publicidade e propaganda",
+                        "02 - Representação comercial",
+                        "03 - Corretagem de seguro",
+                        "04 - Construção civil",
+                        "05 - Call Center",
+                        "06 - Estação Digital",
+                        "07 - Serviços de saúde (órtese e prótese)"
+                    ]
+                    c.executemany(
+                        "INSERT INTO tb_base_calculo (descricao) VALUES (?)",
+                        [(base,) for base in bases_calculo]
+                    )
+                    logger.info("Inseridas %s bases de cálculo", len(bases_calculo))
+            
+                # Tipos de Recolhimento - Verificar antes de inserir
+                c.execute("SELECT COUNT(*) FROM tb_tipo_de_recolhimento")
+                if c.fetchone()[0] == 0:
+                    logger.info("Inserindo tipos de recolhimento...")
+                    recolhimentos = ["Recolhimento"]
+                    c.executemany(
+                        "INSERT INTO tb_tipo_de_recolhimento (recolhimento) VALUES (?)",
+                        [(rec,) for rec in recolhimentos]
+                    )
+                    logger.info("Inseridos %s tipos de recolhimento", len(recolhimentos))
+                
+                # Check if we need to add test tomador data
+                c.execute("SELECT COUNT(*) FROM tb_config_tomador WHERE razao_social != ''")
+                if c.fetchone()[0] == 0:
+                    logger.info("Adicionando tomador de teste...")
+                    c.execute("""
+                        INSERT INTO tb_config_tomador 
+                        (razao_social, cnpj, cae_inscricao, usuario_prefeitura, data_atualizacao)
+                        VALUES (?, ?, ?, ?, datetime('now'))
+                    """, ("Empresa Teste", "12345678901234", "INSCRIÇÃO-001", "usuario_teste"))
+                    logger.info("Tomador de teste adicionado com sucesso!")
+
+                conn.commit()
+                logger.info("Dados padrão populados com sucesso!")
+                return True
+
+            except Error as e:
+                logger.error("Erro ao popular dados: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    # MÉTODO ANTIGO MANTIDO PARA COMPATIBILIDADE (MAS NÃO USADO)
+    def populate_default_data(self):
+        """MÉTODO ANTIGO - NÃO USAR MAIS - Mantido apenas para compatibilidade"""
+        logger.warning("Método populate_default_data() antigo foi chamado. Use populate_default_data_safe()")
+        pass
+
+    def get_database_status(self):
+        """Retorna o status completo do banco de dados"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                
+                status = {}
+                
+                # Verificar cada tabela
+                tabelas = [
+                    'tb_config_tomador',
+                    'tb_uf', 
+                    'tb_tipo_de_servico',
+                    'tb_base_calculo',
+                    'tb_tipo_de_recolhimento',
+                    'tb_cod_municipio',
+                    'tb_fornecedores',
+                    'tb_notas_fiscais'
+                ]
+                
+                for tabela in tabelas:
+                    c.execute(f"SELECT COUNT(*) FROM {tabela}")
+                    count = c.fetchone()[0]
+                    status[tabela] = count
+                
+                # Verificar duplicatas em tabelas críticas
+                for tabela_config in [
+                    ('tb_base_calculo', 'descricao'),
+                    ('tb_tipo_de_servico', 'descricao'),
+                    ('tb_uf', 'UF')
+                ]:
+                    tabela, campo = tabela_config
+                    c.execute(f"""
+                        SELECT COUNT(*) FROM (
+                            SELECT {campo}, COUNT(*) as qtd
+                            FROM {tabela} 
+                            GROUP BY {campo} 
+                            HAVING COUNT(*) > 1
+                        )
+                    """)
+                    duplicatas = c.fetchone()[0]
+                    status[f"{tabela}_duplicatas"] = duplicatas
+                
+                return status
+                
+            except Exception as e:
+                logger.error("Erro ao verificar status do banco: %s", e)
+                return {}
+            finally:
+                conn.close()
+        return {}
+            
+    def verificar_tabela_base_calculo(self):
+        """Verifica se a tabela tb_base_calculo existe e tem dados"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                
+                # Verificar se a tabela existe
+                c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='tb_base_calculo'")
+                tabela_existe = c.fetchone() is not None
+                logger.debug("Tabela tb_base_calculo existe: %s", tabela_existe)
+                
+                if tabela_existe:
+                    # Verificar se tem dados
+                    c.execute("SELECT COUNT(*) FROM tb_base_calculo")
+                    count = c.fetchone()[0]
+                    logger.debug("Quantidade de registros na tabela tb_base_calculo: %s", count)
+                    
+                    # Listar registros
+                    if count > 0:
+                        c.execute("SELECT id, descricao FROM tb_base_calculo ORDER BY id")
+                        registros = c.fetchall()
+                        logger.debug("Registros encontrados:")
+                        for registro in registros:
+                            logger.debug("- ID: %s, Descrição: %s", registro[0], registro[1])
+                    
+                    # Verificar duplicatas
+                    c.execute("""
+                        SELECT descricao, COUNT(*) as qtd
+                        FROM tb_base_calculo 
+                        GROUP BY descricao 
+                        HAVING COUNT(*) > 1
+                    """)
+                    duplicados = c.fetchall()
+                    if duplicados:
+                        logger.warning("Encontradas %s descrições duplicadas:", len(duplicados))
+                        for desc, qtd in duplicados:
+                            logger.debug("- '%s': %s registros", desc, qtd)
+                
+                return tabela_existe, count if tabela_existe else 0
+            except Exception as e:
+                logger.error("Erro ao verificar tabela tb_base_calculo: %s", e)
+            finally:
+                conn.close()
+        return False, 0
+
+    # RESTO DOS MÉTODOS MANTIDOS IGUAIS...
+    def get_all_ufs(self):
+        return list(self.referencias.obter("tb_uf")[1] or [])
+
+    def get_all_recolhimentos(self):
+        return list(self.referencias.obter("tb_tipo_de_recolhimento")[1] or [])
+
+    def get_municipios_by_uf(self, uf):
+        return list(self.get_municipios_versionado(uf)[1])
+
+    def get_municipios_versionado(self, uf):
+        """Retorna (versão de tb_cod_municipio, [(municipio, cod_municipio), ...]) da UF"""
+        versao, municipios = self.referencias.obter("tb_cod_municipio")
+        return versao, (municipios or {}).get("por_uf", {}).get(uf, [])
+
+    def get_fornecedor_by_cnpj(self, cnpj):
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                c.execute("""
+                    SELECT descricao_fornecedor, UF, municipio, cod_municipio
+                    FROM tb_fornecedores 
+                    WHERE CNPJ = ?
+                """, (cnpj,))
+                return c.fetchone()
+            finally:
+                conn.close()
+        return None
+
+    def get_cod_municipio(self, uf, municipio):
+        return self.get_cod_municipio_versionado(uf, municipio)[1]
+
+    def get_cod_municipio_versionado(self, uf, municipio):
+        """Retorna (versão de tb_cod_municipio, código do município ou None)"""
+        versao, municipios = self.referencias.obter("tb_cod_municipio")
+        return versao, (municipios or {}).get("codigos", {}).get((uf, municipio))
+
+    def insert_fornecedor(self, cnpj, descricao, uf, municipio, cod_municipio, fora_pais, cadastrado_goiania):
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                c.execute("""
+                    SELECT id FROM tb_fornecedores 
+                    WHERE CNPJ = ?
+                """, (cnpj,))
+
+                existing_supplier = c.fetchone()
+
+                if existing_supplier:
+                    c.execute("""
+                        UPDATE tb_fornecedores 
+                        SET descricao_fornecedor = ?,
+                            UF = ?,
+                            municipio = ?,
+                            cod_municipio = ?,
+                            fora_pais = ?,
+                            cadastrado_goiania = ?
+                        WHERE CNPJ = ?
+                    """, (descricao, uf, municipio, cod_municipio, fora_pais, cadastrado_goiania, cnpj))
+                    fornecedor_id = existing_supplier[0]
+                else:
+                    c.execute("""
+                        INSERT INTO tb_fornecedores 
+                        (CNPJ, descricao_fornecedor, UF, municipio, cod_municipio, fora_pais, cadastrado_goiania)
+                        VALUES (?, ?, ?, ?, ?, ?, ?)
+                    """, (cnpj, descricao, uf, municipio, cod_municipio, fora_pais, cadastrado_goiania))
+                    fornecedor_id = c.lastrowid
+
+                conn.commit()
+                return fornecedor_id
+
+            except Exception as e:
+                logger.error("Erro ao inserir/atualizar fornecedor: %s", e)
+                conn.rollback()
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def insert_nota_fiscal(self, dados, permitir_duplicada=False):
+        """
+        Insere uma nota fiscal
+
+        :param permitir_duplicada: Se False, a nota não é gravada quando já existe outra com o
+            mesmo CNPJ, número e referência (a verificação faz parte do próprio INSERT)
+        :return: True se gravada, False em caso de erro ou duplicata
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                # Validar e limpar o campo 'referencia'
+                referencia = dados.get('referencia', '').strip()
+                if not referencia:
+                    logger.warning("Referência não pode ser vazia")
+                    return False
+
+                cursor = conn.cursor()
+                query = """
+                INSERT INTO tb_notas_fiscais (
+                    referencia, cadastrado_goiania, fora_pais, cnpj, fornecedor_id, 
+                    inscricao_municipal, tipo_servico, base_calculo, numero_nf, 
+                    dt_emissao, dt_pagamento, aliquota, valor_nf, recolhimento_id, 
+                    recibo, uf, municipio, cod_municipio
+                ) SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+                        (SELECT id FROM tb_tipo_de_recolhimento WHERE recolhimento = ?),
+                        ?, ?, ?, ?
+                """
+                
+                # Remover quebras de linha do CNPJ
+                cnpj = dados['CNPJ'].strip().replace('\n', '')
+
+                values = (
+                    referencia, 
+                    dados.get('cadastrado_goiania', 'Não'), 
+                    dados.get('fora_pais', 'Não'), 
+                    cnpj, 
+                    dados['Fornecedor_ID'], 
+                    dados.get('Inscrição Municipal', ''), 
+                    dados['Tipo de Serviço'], 
+                    dados['Base de Cálculo'], 
+                    dados['Nº NF'], 
+                    dados['Dt. Emissão'], 
+                    dados['Dt. Pagamento'], 
+                    dados['Aliquota'], 
+                    dados['Valor NF'], 
+                    dados['Recolhimento'], 
+                    dados.get('RECIBO', ''), 
+                    dados['UF'], 
+                    dados['Município'], 
+                    dados['Código Município']
+                )
+
+                if not permitir_duplicada:
+                    query += f"""
+                    WHERE NOT EXISTS (
+                        SELECT 1 FROM tb_notas_fiscais
+                        WHERE chave_nota = (SELECT {deduplicacao.sql_chave_nota()}
+                                            FROM (SELECT ? AS cnpj, ? AS numero_nf, ? AS referencia))
+                    )
+                    """
+                    values += (cnpj, dados['Nº NF'], referencia)
+
+                cursor.execute(query, values)
+                conn.commit()
+                if not cursor.rowcount:
+                    logger.warning(
+                        "Nota fiscal não gravada: %s (CNPJ %s, NF %s, referência %s)",
+                        deduplicacao.MENSAGEM_DUPLICADA, cnpj, dados['Nº NF'], referencia
+                    )
+                    return False
+                return True
+            except Exception as e:
+                logger.error("Erro ao inserir nota fiscal: %s", e)
+                logger.debug("Dados recebidos: %s", dados)
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def update_nota_fiscal(self, id_nota, dados):
+        """
+        Atualiza os campos informados de uma nota fiscal (os ausentes ficam como estão)
+
+        :param dados: Campos por nome do formulário ou da coluna (ver CAMPOS_NOTA)
+        :return: True se a nota foi atualizada, False se não existir, não houver campos ou em caso de erro
+        :raises ValueError: se alíquota ou valor não forem numéricos
+        """
+        atribuicoes, params = montar_atualizacao_nota(mapear_campos_nota(dados))
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                if not atribuicoes:
+                    logger.warning("Nenhum campo para atualizar na nota fiscal %s", id_nota)
+                    return False
+
+                cursor = conn.cursor()
+                cursor.execute(
+                    f"UPDATE tb_notas_fiscais SET {', '.join(atribuicoes)} WHERE id = ?",
+                    (*params, id_nota)
+                )
+                conn.commit()
+                return cursor.rowcount > 0
+            except Exception as e:
+                logger.error("Erro na atualização: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def delete_nota_fiscal(self, id_nota):
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                # Exclui usando o ID da nota
+                c.execute("""
+                    DELETE FROM tb_notas_fiscais 
+                    WHERE id = ?
+                """, (id_nota,))
+
+                # Verifica se algum registro foi afetado
+                affected_rows = c.rowcount
+                conn.commit()
+
+                logger.info("Registros excluídos: %s", affected_rows)
+                return affected_rows > 0
+            except Exception as e:
+                logger.error("Erro ao excluir nota fiscal: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def _operacao_lote(self, nome, **parametros):
+        """Executa operacoes_lote.<nome> com uma conexão do pool; None em caso de erro"""
+        import operacoes_lote
+
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                resultado = getattr(operacoes_lote, nome)(conn, **parametros)
+                logger.info(
+                    "%s: %s registros%s", nome, resultado["afetadas"],
+                    " (simulação)" if resultado["simulacao"] else ""
+                )
+                return resultado
+            except ValueError:
+                raise
+            except Exception as e:
+                logger.error("Erro em %s: %s", nome, e)
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def excluir_notas_lote(self, filtros=None, ids=None, simular=False):
+        """
+        Exclui as notas de um filtro (referência, datas, fornecedor, ...) e/ou lista de IDs numa transação
+
+        :return: {"afetadas", "simulacao"}, ou None em caso de erro
+        :raises ValueError: se o alvo estiver vazio ou tiver filtro desconhecido
+        """
+        return self._operacao_lote("excluir_notas", filtros=filtros, ids=ids, simular=simular)
+
+    def atualizar_notas_lote(self, dados, filtros=None, ids=None, simular=False, permitir_duplicadas=False):
+        """
+        Aplica o patch de campos dados às notas do filtro e/ou lista de IDs com um único UPDATE
+
+        :return: {"afetadas", "campos", "simulacao"}, ou None em caso de erro
+        :raises ValueError: alvo ou patch inválidos, ou notas que ficariam duplicadas
+        """
+        return self._operacao_lote(
+            "atualizar_notas", dados=dados, filtros=filtros, ids=ids,
+            simular=simular, permitir_duplicadas=permitir_duplicadas
+        )
+
+    def excluir_fornecedores_lote(self, filtros=None, ids=None, simular=False):
+        """
+        Exclui fornecedores por filtro (uf, municipio, sem_notas) e/ou lista de IDs, exceto os com notas
+
+        :return: {"afetadas", "bloqueados", "simulacao"}, ou None em caso de erro
+        """
+        return self._operacao_lote("excluir_fornecedores", filtros=filtros, ids=ids, simular=simular)
+
+    def excluir_tomadores_lote(self, ids, simular=False):
+        """
+        Exclui os tomadores da lista de IDs numa transação
+
+        :return: {"afetadas", "simulacao"}, ou None em caso de erro
+        """
+        return self._operacao_lote("excluir_tomadores", ids=ids, simular=simular)
+
+    def snapshot_notas(self, referencias=None):
+        """
+        DataFrame tipado das notas (datas, centavos, categorias) lido do snapshot colunar
+
+        Para análises ad hoc: não consulta tb_notas_fiscais quando as partições estão em dia.
+
+        :param referencias: Lista de referências (padrão: todas, inclusive as arquivadas)
+        :return: DataFrame pandas, ou None em caso de erro
+        """
+        try:
+            return self.snapshot.dataframe(referencias)
+        except (Error, OSError) as e:
+            logger.error("Erro ao ler o snapshot colunar: %s", e)
+            return None
+
+    def atualizar_snapshot(self):
+        """
+        Regera as partições desatualizadas do snapshot colunar (ver SnapshotColunar.atualizar)
+
+        :return: Resumo da atualização, ou None em caso de erro
+        """
+        try:
+            return self.snapshot.atualizar()
+        except (Error, OSError) as e:
+            logger.error("Erro ao atualizar o snapshot colunar: %s", e)
+            return None
+
+    def get_all_notas_fiscais(self):
+        # pandas só é carregado quando usado: metade do tempo de import da aplicação
+        import pandas as pd
+
+        conn = self.conexao_notas()
+        if conn is not None:
+            try:
+                # Verificar primeiro se a tabela existe
+                cursor = conn.cursor()
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='tb_notas_fiscais'")
+                table_exists = cursor.fetchone()
+
+                if not table_exists:
+                    logger.info("A tabela tb_notas_fiscais não existe.")
+                    return pd.DataFrame()
+
+                # Verificar se a tabela está vazia
+                cursor.execute("SELECT COUNT(*) FROM tb_notas_fiscais")
+                count = cursor.fetchone()[0]
+
+                if count == 0:
+                    logger.debug("A tabela tb_notas_fiscais está vazia.")
+                    # Retornar DataFrame vazio com as colunas corretas
+                    return pd.DataFrame(columns=[
+                        "id", "referencia", "cadastrado_goiania", "fora_pais",
+                        "cnpj", "descricao_fornecedor", "tipo_servico", "base_calculo",
+                        "numero_nf", "dt_emissao", "dt_pagamento", "aliquota",
+                        "valor_nf", "recolhimento"
+                    ])
+
+                # Consulta SQL ajustada para incluir ID e base_calculo
+                query = """
+                    SELECT 
+                        nf.id,
+                        nf.referencia,
+                        nf.cadastrado_goiania,
+                        nf.fora_pais,
+                        nf.cnpj,
+                        f.descricao_fornecedor,
+                        nf.tipo_servico,
+                        nf.base_calculo,
+                        nf.numero_nf,
+                        nf.dt_emissao,
+                        nf.dt_pagamento,
+                        nf.aliquota,
+                        nf.valor_nf,
+                        tr.recolhimento
+                    FROM tb_notas_fiscais nf
+                    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+                    LEFT JOIN tb_tipo_de_recolhimento tr ON nf.recolhimento_id = tr.id
+                    ORDER BY nf.dt_emissao DESC
+                """
+
+                df = pd.read_sql_query(query, conn)
+                return df
+            except Exception as e:
+                logger.error("Erro detalhado na consulta: %s", e)
+                return pd.DataFrame(columns=[
+                    "id", "referencia", "cadastrado_goiania", "fora_pais",
+                    "cnpj", "descricao_fornecedor", "tipo_servico", "base_calculo", 
+                    "numero_nf", "dt_emissao", "dt_pagamento", "aliquota",
+                    "valor_nf", "recolhimento"
+                ])
+            finally:
+                conn.close()
+        return pd.DataFrame()
+
+    def get_notas_fiscais_page(self, filtros=None, cursor=None, page_size=100):
+        """
+        Retorna uma página de notas fiscais ordenada por (dt_emissao, id) decrescente
+
+        A paginação é por chave (keyset): o cursor guarda a (dt_emissao, id) da última
+        nota entregue e a próxima página continua a partir dela, sem OFFSET.
+        As linhas são montadas direto do cursor do sqlite, sem DataFrame.
+
+        :param filtros: Dicionário de filtros aceito por montar_filtro_notas
+        :param cursor: Token devolvido na página anterior (ou None para a primeira)
+        :param page_size: Quantidade máxima de notas na página
+        :return: Tupla (lista de dicionários, próximo cursor ou None)
+        :raises ValueError: se o cursor for inválido
+        """
+        condicoes, params = montar_filtro_notas(filtros)
+
+        if cursor:
+            dt_cursor, id_cursor = decodificar_cursor_notas(cursor)
+            if dt_cursor is None:
+                # Já estamos no bloco final de notas sem data de emissão
+                condicoes.append("(nf.dt_emissao IS NULL AND nf.id < ?)")
+                params.append(id_cursor)
+            else:
+                condicoes.append("((nf.dt_emissao, nf.id) < (?, ?) OR nf.dt_emissao IS NULL)")
+                params.extend([dt_cursor, id_cursor])
+
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        query = sql_listagem_notas(where) + " LIMIT ?"
+        # Busca uma linha a mais para saber se existe próxima página
+        params.append(page_size + 1)
+
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                c.execute(query, params)
+                linhas = c.fetchall()
+                # Competências arquivadas só entram se puderem ter notas nesta página: com a página
+                # completa na tabela quente, só os arquivos com emissão >= a da linha excedente
+                alcance = dict(filtros or {})
+                if len(linhas) > page_size and linhas[page_size][9] is not None:
+                    alcance['dt_inicio'] = max(alcance.get('dt_inicio') or '', linhas[page_size][9])
+                if arquivamento.anexar(conn, self.pasta_arquivo, alcance):
+                    c.execute(query, params)
+                    linhas = c.fetchall()
+                colunas = [descricao[0] for descricao in c.description]
+
+                proximo_cursor = None
+                if len(linhas) > page_size:
+                    linhas = linhas[:page_size]
+                    ultima = linhas[-1]
+                    proximo_cursor = codificar_cursor_notas(ultima[9], ultima[0])
+
+                return [_linha_listagem(colunas, linha) for linha in linhas], proximo_cursor
+            except Error as e:
+                logger.error("Erro ao buscar página de notas fiscais: %s", e)
+                return [], None
+            finally:
+                conn.close()
+        return [], None
+
+    def iter_notas_fiscais_pagina(self, filtros=None, pagina=1, por_pagina=50, ordem='dt_emissao',
+                                  direcao='desc'):
+        """
+        Notas de uma página numerada da listagem, em qualquer ordenação de ORDENACOES_NOTAS
+
+        Paginação por OFFSET (a tela tem links para páginas numeradas). As notas são lidas
+        do cursor do sqlite à medida que o gerador é consumido, para a página ser
+        renderizada em streaming; a conexão volta ao pool quando ele termina.
+
+        Na ordem padrão (emissão decrescente) as competências arquivadas só são anexadas
+        se puderem ter notas até o fim da página, como em get_notas_fiscais_page.
+
+        :return: Gerador de dicionários (mesmas chaves de get_notas_fiscais_page); feche-o
+            (close) se ele puder não ser consumido até o fim
+        :raises ValueError: ordenação ou direção inválidas, ou anos arquivados demais
+        """
+        if ordem not in ORDENACOES_NOTAS:
+            raise ValueError(f"Ordenação inválida: {ordem} (aceitas: {', '.join(ORDENACOES_NOTAS)})")
+        direcao = (direcao or '').lower()
+        if direcao not in ('asc', 'desc'):
+            raise ValueError("Direção da ordenação deve ser asc ou desc")
+        condicoes, params = montar_filtro_notas(filtros)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        deslocamento = (max(1, int(pagina)) - 1) * por_pagina
+
+        conn = self.create_connection()
+        if conn is None:
+            raise Error("Não foi possível conectar ao banco de dados")
+        try:
+            alcance = dict(filtros or {})
+            if ordem == 'dt_emissao' and direcao == 'desc':
+                # Emissão da primeira nota quente depois da página: arquivos mais antigos não entram
+                seguinte = conn.execute(f"""
+                    SELECT nf.dt_emissao FROM tb_notas_fiscais nf
+                    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+                    {where}
+                    ORDER BY nf.dt_emissao DESC, nf.id DESC
+                    LIMIT 1 OFFSET ?
+                """, params + [deslocamento + por_pagina]).fetchone()
+                if seguinte is not None and seguinte[0] is not None:
+                    alcance['dt_inicio'] = max(alcance.get('dt_inicio') or '', seguinte[0])
+            arquivamento.anexar(conn, self.pasta_arquivo, alcance)
+        except Exception:
+            conn.close()
+            raise
+
+        query = sql_listagem_notas(
+            where, f"{ORDENACOES_NOTAS[ordem]} {direcao.upper()}, nf.id {direcao.upper()}"
+        ) + " LIMIT ? OFFSET ?"
+
+        def gerar():
+            try:
+                yield
+                c = conn.execute(query, params + [por_pagina, deslocamento])
+                colunas = [descricao[0] for descricao in c.description]
+                for linha in c:
+                    yield _linha_listagem(colunas, linha)
+            except Error as e:
+                logger.error("Erro ao listar página de notas fiscais: %s", e)
+            finally:
+                conn.close()
+
+        notas = gerar()
+        # Já dentro do try: close() (ou o coletor de lixo) devolve a conexão mesmo que
+        # o gerador nunca seja percorrido
+        next(notas)
+        return notas
+
+    def contar_notas(self, filtros=None):
+        """
+        Quantidade de notas que atendem aos filtros (usada como total no progresso das exportações)
+
+        Sem filtros, ou só com a referência, o total vem dos agregados mantidos por
+        trigger, sem varrer a tabela nem anexar competências arquivadas.
+        """
+        condicoes, params = montar_filtro_notas(filtros)
+        so_referencia = condicoes == ["nf.referencia = ?"]
+        conn = self.conexao_notas(filtros) if condicoes and not so_referencia else self.create_connection()
+        if conn is not None:
+            try:
+                if not condicoes:
+                    return agregados.estatisticas(conn)["total_notas"]
+                if so_referencia:
+                    return agregados.quantidade(conn, "referencia", params[0])
+                cursor = conn.cursor()
+                cursor.execute(f"""
+                    SELECT COUNT(*)
+                    FROM tb_notas_fiscais nf
+                    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+                    WHERE {' AND '.join(condicoes)}
+                """, params)
+                return cursor.fetchone()[0]
+            except Exception as e:
+                logger.error("Erro ao contar notas fiscais: %s", e)
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def get_nota_fiscal_by_id(self, id_nota):
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                query = """
+                    SELECT 
+                        nf.id,
+                        nf.referencia,
+                        nf.cadastrado_goiania,
+                        nf.fora_pais,
+                        nf.cnpj,
+                        nf.fornecedor_id,
+                        nf.inscricao_municipal,
+                        nf.tipo_servico,
+                        nf.base_calculo,
+                        nf.numero_nf,
+                        nf.dt_emissao,
+                        nf.dt_pagamento,
+                        nf.aliquota,
+                        nf.valor_nf,
+                        nf.recolhimento_id,
+                        f.descricao_fornecedor,
+                        f.UF,
+                        f.municipio,
+                        f.cod_municipio,
+                        tr.recolhimento,
+                        nf.recibo
+                    FROM tb_notas_fiscais nf
+                    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+                    LEFT JOIN tb_tipo_de_recolhimento tr ON nf.recolhimento_id = tr.id
+                    WHERE nf.id = ?
+                """
+                cursor.execute(query, (id_nota,))
+                resultado = cursor.fetchone()
+                logger.debug("Resultado da query: %s", resultado)
+                return resultado
+            except Exception as e:
+                logger.error("Erro ao buscar nota fiscal: %s", e)
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def export_to_excel(self, filename, filtros=None, tomador_id=None, resumo=True, progresso=None):
+        """
+        Exporta as notas fiscais para um arquivo Excel em streaming (planilha write-only)
+
+        :param filename: Caminho do arquivo .xlsx
+        :param filtros: Filtros aceitos por montar_filtro_notas (dt_inicio, dt_fim, fornecedor_id, ...)
+        :param tomador_id: Tomador identificado no arquivo
+        :param resumo: Se True, inclui a aba de resumo por fornecedor (e as da apuração, se filtrado por referência)
+        :param progresso: Função opcional chamada com o total de notas gravadas após cada lote
+        """
+        from exportacao_excel import gerar_excel
+
+        conn = self.conexao_notas(filtros)
+        if conn is not None:
+            try:
+                apuracao = None
+                resumo_fornecedores = None
+                if resumo and (filtros or {}).get('referencia'):
+                    apuracao = self.apurar(filtros['referencia'], tomador_id)
+                    # Só a referência filtrada: o resumo sai da partição colunar
+                    if {chave for chave, valor in filtros.items() if valor} == {'referencia'}:
+                        try:
+                            resumo_fornecedores = snapshot_colunar.resumo_fornecedores(
+                                self.snapshot.particao(filtros['referencia'], conn)
+                            )
+                        except OSError as e:
+                            logger.warning("Snapshot colunar indisponível, resumo pelo banco: %s", e)
+                total = gerar_excel(
+                    conn, filename, filtros, tomador_id, resumo, progresso=progresso, apuracao=apuracao,
+                    resumo_fornecedores=resumo_fornecedores
+                )
+                logger.info("Notas exportadas para Excel: %s", total)
+                return True
+            except Exception as e:
+                logger.error("Erro ao exportar para Excel: %s", e)
+                return False
+            finally:
+                conn.close()
+        return False
+    
+    def limpar_notas_fiscais(self):
+        """Remove todas as notas fiscais do banco de dados"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM tb_notas_fiscais")
+                conn.commit()
+                logger.info("Registros excluídos: %s", cursor.rowcount)
+                return True
+            except Exception as e:
+                logger.error("Erro ao limpar tabela de notas fiscais: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def limpar_tomadores(self):
+        """Remove todos os tomadores do banco de dados"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM tb_config_tomador")
+                conn.commit()
+                logger.info("Tomadores excluídos: %s", cursor.rowcount)
+                return True
+            except Exception as e:
+                logger.error("Erro ao limpar tabela de tomadores: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def import_municipios_from_txt(self, file_path, chunk_size=1000, progresso=None, encoding="utf-8-sig"):
+        """
+        Importa municípios de um arquivo de texto no formato: CODIGO;MUNICIPIO;UF
+
+        O arquivo é lido em blocos de chunk_size linhas e gravado com executemany
+        em uma única transação, fazendo upsert pelo código do município.
+
+        :param file_path: Caminho do arquivo TXT
+        :param chunk_size: Quantidade de linhas por bloco
+        :param progresso: Função opcional chamada com o total de linhas lidas após cada bloco
+        :return: Dicionário com o relatório da importação, ou None em caso de erro
+        """
+        inicio = time.perf_counter()
+        relatorio = {
+            "linhas": 0,
+            "inseridos": 0,
+            "atualizados": 0,
+            "inalterados": 0,
+            "rejeitados": 0,
+            "erros": [],
+        }
+
+        def rejeitar(line_number, mensagem):
+            relatorio["rejeitados"] += 1
+            if len(relatorio["erros"]) < MAX_ERROS_RELATORIO:
+                relatorio["erros"].append({"linha": line_number, "erro": mensagem})
+
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("BEGIN IMMEDIATE")
+
+                # Estado atual em memória (alguns milhares de linhas) para classificar cada registro
+                cursor.execute("SELECT cod_municipio, UF, municipio FROM tb_cod_municipio")
+                existentes = {cod: (uf, municipio) for cod, uf, municipio in cursor.fetchall()}
+                cursor.execute("SELECT UF FROM tb_uf")
+                ufs_validas = {row[0] for row in cursor.fetchall()}
+
+                with open(file_path, "r", encoding=encoding) as file:
+                    linhas = enumerate(file, 1)
+                    while True:
+                        bloco = list(itertools.islice(linhas, chunk_size))
+                        if not bloco:
+                            break
+
+                        gravar = []
+                        for line_number, line in bloco:
+                            line = line.strip()
+                            if not line:
+                                continue
+                            relatorio["linhas"] += 1
+
+                            parts = [parte.strip() for parte in line.split(";")]
+                            if len(parts) != 3:
+                                rejeitar(line_number, "formato inválido, esperado CODIGO;MUNICIPIO;UF")
+                                continue
+
+                            cod_municipio, municipio, uf = parts
+                            uf = uf.upper()
+                            if not cod_municipio.isdigit():
+                                if line_number == 1:
+                                    # Linha de cabeçalho
+                                    relatorio["linhas"] -= 1
+                                else:
+                                    rejeitar(line_number, f"código inválido: {cod_municipio!r}")
+                                continue
+                            if not municipio:
+                                rejeitar(line_number, "município vazio")
+                                continue
+                            if uf not in ufs_validas:
+                                rejeitar(line_number, f"UF inválida: {uf!r}")
+                                continue
+
+                            atual = existentes.get(cod_municipio)
+                            if atual == (uf, municipio):
+                                relatorio["inalterados"] += 1
+                                continue
+                            if atual is None:
+                                relatorio["inseridos"] += 1
+                            else:
+                                relatorio["atualizados"] += 1
+                            existentes[cod_municipio] = (uf, municipio)
+                            gravar.append((uf, municipio, cod_municipio))
+
+                        if gravar:
+                            cursor.executemany("""
+                                INSERT INTO tb_cod_municipio (UF, municipio, cod_municipio)
+                                VALUES (?, ?, ?)
+                                ON CONFLICT (cod_municipio) DO UPDATE SET
+                                    UF = excluded.UF,
+                                    municipio = excluded.municipio
+                            """, gravar)
+
+                        if progresso:
+                            progresso(bloco[-1][0])
+
+                conn.commit()
+
+                segundos = time.perf_counter() - inicio
+                relatorio["segundos"] = round(segundos, 3)
+                relatorio["linhas_por_segundo"] = round(relatorio["linhas"] / segundos) if segundos else 0
+                logger.info(
+                    "Municípios importados: %s inseridos, %s atualizados, %s inalterados, "
+                    "%s rejeitados (%s linhas/s)",
+                    relatorio['inseridos'], relatorio['atualizados'], relatorio['inalterados'],
+                    relatorio['rejeitados'], relatorio['linhas_por_segundo']
+                )
+                return relatorio
+
+            except Exception as e:
+                logger.error("Erro detalhado ao importar municípios: %s", e)
+                conn.rollback()
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def import_notas_from_file(self, file_path, chunk_size=2000, progresso=None, duplicadas="rejeitar"):
+        """
+        Importa notas fiscais em lote de um arquivo CSV, TXT delimitado ou XLSX
+
+        :param duplicadas: "rejeitar" ou "permitir" notas já cadastradas (ver importacao_notas)
+        :return: Dicionário com o relatório da importação (ver importacao_notas.importar_notas)
+        :raises ValueError: se o formato ou o cabeçalho do arquivo forem inválidos
+        """
+        from importacao_notas import importar_notas
+        return importar_notas(
+            self, file_path, chunk_size=chunk_size, progresso=progresso, duplicadas=duplicadas
+        )
+
+    def get_all_tomadores(self):
+        """Retorna todos os tomadores cadastrados no sistema"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                c.execute("SELECT * FROM tb_config_tomador ORDER BY razao_social")
+                return c.fetchall()
+            except Exception as e:
+                logger.error("Erro ao buscar tomadores: %s", e)
+                return []
+            finally:
+                conn.close()
+        return []
+
+    def get_tomador_by_id(self, tomador_id):
+        """Retorna um tomador pelo ID (mesmas colunas de get_all_tomadores) ou None"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                c = conn.cursor()
+                c.execute("SELECT * FROM tb_config_tomador WHERE id = ?", (tomador_id,))
+                return c.fetchone()
+            except Exception as e:
+                logger.error("Erro ao buscar tomador: %s", e)
+                return None
+            finally:
+                conn.close()
+        return None
+
+    def delete_tomador(self, tomador_id):
+        """Remove um tomador do banco de dados"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM tb_config_tomador WHERE id = ?", (tomador_id,))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error("Erro ao excluir tomador: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def update_tomador(self, dados):
+        """Atualiza um tomador existente"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE tb_config_tomador 
+                    SET razao_social = ?,
+                        cnpj = ?,
+                        cae_inscricao = ?,
+                        usuario_prefeitura = ?,
+                        data_atualizacao = datetime('now')
+                    WHERE id = ?
+                """, (
+                    dados["razao_social"],
+                    dados["cnpj"],
+                    dados["inscricao"],
+                    dados["usuario"],
+                    dados["id"],
+                ))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error("Erro ao atualizar tomador: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def insert_tomador(self, dados):
+        """Insere um novo tomador"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO tb_config_tomador 
+                    (razao_social, cnpj, cae_inscricao, usuario_prefeitura, data_atualizacao)
+                    VALUES (?, ?, ?, ?, datetime('now'))
+                """, (
+                    dados["razao_social"],
+                    dados["cnpj"],
+                    dados["inscricao"],
+                    dados["usuario"],
+                ))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error("Erro ao inserir tomador: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def iter_export_txt(self, filtros=None, tomador_id=None, lote=1000, progresso=None):
+        """
+        Gera o arquivo TXT da prefeitura em pedaços, para download em streaming
+
+        :param filtros: Filtros de notas (referencia, dt_inicio, dt_fim, cnpj...)
+        :param tomador_id: Tomador usado no cabeçalho; None mantém o cabeçalho padrão
+        :param progresso: Função opcional chamada com o total de notas formatadas após cada lote
+        :return: Gerador de strings; a conexão é devolvida ao pool quando ele termina
+        :raises ValueError: se o tomador não for encontrado
+        """
+        from exportacao_txt import gerar_txt
+
+        conn = self.conexao_notas(filtros)
+        if conn is None:
+            raise Error("Não foi possível conectar ao banco de dados")
+        return gerar_txt(conn, filtros, tomador_id, lote, progresso)
+
+    def iter_export_txt_tomadores(self, filtros=None, tomadores=None, max_workers=4):
+        """
+        ZIP com o TXT da prefeitura de cada tomador, gerados em paralelo (ver exportacao_tomadores)
+
+        :return: Gerador de bytes do ZIP
+        :raises ValueError: se não houver tomador a exportar ou algum ID não estiver cadastrado
+        """
+        from exportacao_tomadores import exportar_tomadores
+
+        return exportar_tomadores(self, filtros, tomadores, max_workers)
+
+    def export_to_txt(self, filename, filtros=None, tomador_id=None, progresso=None):
+        """
+        Exporta as notas fiscais para um arquivo TXT no formato específico
+        
+        :param filename: Caminho do arquivo TXT a ser criado
+        :param filtros: Filtros de notas (referencia, dt_inicio, dt_fim, cnpj...)
+        :param tomador_id: Tomador usado no cabeçalho; None mantém o cabeçalho padrão
+        :param progresso: Função opcional chamada com o total de notas gravadas após cada lote
+        :return: True se exportado com sucesso, False caso contrário
+        """
+        try:
+            with open(filename, 'w', encoding='utf-8') as f:
+                for pedaco in self.iter_export_txt(filtros, tomador_id, progresso=progresso):
+                    f.write(pedaco)
+
+            logger.info("Arquivo TXT exportado com sucesso: %s", filename)
+            return True
+
+        except Exception as e:
+            logger.error("Erro ao exportar para TXT: %s", e)
+            return False
+
+    def get_all_fornecedores(self):
+        """Retorna todos os fornecedores cadastrados"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, CNPJ, descricao_fornecedor, UF, municipio, cod_municipio, 
+                           fora_pais, cadastrado_goiania
+                    FROM tb_fornecedores
+                    ORDER BY descricao_fornecedor
+                """)
+                fornecedores = cursor.fetchall()
+                return [
+                    {
+                        'id': f[0],
+                        'cnpj': f[1],
+                        'descricao_fornecedor': f[2],
+                        'uf': f[3],
+                        'municipio': f[4],
+                        'cod_municipio': f[5],
+                        'fora_pais': f[6] or 'Não',
+                        'cadastrado_goiania': f[7] or 'Não'
+                    }
+                    for f in fornecedores
+                ]
+            except Exception as e:
+                logger.error("Erro ao buscar fornecedores: %s", e)
+                return []
+            finally:
+                conn.close()
+        return []
+
+    def get_fornecedor_by_id(self, fornecedor_id):
+        """Retorna um fornecedor específico pelo ID"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT id, CNPJ, descricao_fornecedor, UF, municipio, cod_municipio, 
+                           fora_pais, cadastrado_goiania
+                    FROM tb_fornecedores
+                    WHERE id = ?
+                """, (fornecedor_id,))
+                f = cursor.fetchone()
+                if f:
+                    return {
+                        'id': f[0],
+                        'cnpj': f[1],
+                        'descricao_fornecedor': f[2],
+                        'uf': f[3],
+                        'municipio': f[4],
+                        'cod_municipio': f[5],
+                        'fora_pais': f[6] or 'Não',
+                        'cadastrado_goiania': f[7] or 'Não'
+                    }
+            except Exception as e:
+                logger.error("Erro ao buscar fornecedor: %s", e)
+            finally:
+                conn.close()
+        return None
+
+    def update_fornecedor(self, dados):
+        """Atualiza os dados de um fornecedor"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    UPDATE tb_fornecedores
+                    SET CNPJ = ?,
+                        descricao_fornecedor = ?,
+                        UF = ?,
+                        municipio = ?,
+                        cod_municipio = ?,
+                        fora_pais = ?,
+                        cadastrado_goiania = ?
+                    WHERE id = ?
+                """, (
+                    dados['cnpj'],
+                    dados['descricao_fornecedor'],
+                    dados['uf'],
+                    dados['municipio'],
+                    dados['cod_municipio'],
+                    dados['fora_pais'],
+                    dados['cadastrado_goiania'],
+                    dados['id']
+                ))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error("Erro ao atualizar fornecedor: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def delete_fornecedor(self, fornecedor_id):
+        """Exclui um fornecedor pelo ID"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                # Verificar se existem notas fiscais vinculadas
+                cursor.execute("""
+                    SELECT EXISTS (SELECT 1 FROM tb_notas_fiscais WHERE fornecedor_id = ?)
+                        OR EXISTS (SELECT 1 FROM tb_arquivo_fornecedores WHERE fornecedor_id = ?)
+                """, (fornecedor_id, fornecedor_id))
+                if cursor.fetchone()[0]:
+                    logger.warning("Não é possível excluir o fornecedor pois existem notas fiscais vinculadas")
+                    return False
+                
+                cursor.execute("DELETE FROM tb_fornecedores WHERE id = ?", (fornecedor_id,))
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error("Erro ao excluir fornecedor: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
+
+    def limpar_fornecedores(self):
+        """Limpa todos os fornecedores que não possuem notas fiscais vinculadas (nem arquivadas)"""
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                # Excluir apenas fornecedores sem notas fiscais, inclusive nas competências arquivadas
+                cursor.execute("""
+                    DELETE FROM tb_fornecedores
+                    WHERE id NOT IN (
+                        SELECT DISTINCT fornecedor_id 
+                        FROM tb_notas_fiscais 
+                        WHERE fornecedor_id IS NOT NULL
+                    )
+                    AND NOT EXISTS (
+                        SELECT 1 FROM tb_arquivo_fornecedores
+                        WHERE fornecedor_id = tb_fornecedores.id
+                    )
+                """)
+                conn.commit()
+                return True
+            except Exception as e:
+                logger.error("Erro ao limpar fornecedores: %s", e)
+                conn.rollback()
+                return False
+            finally:
+                conn.close()
+        return False
\ No newline at end of file
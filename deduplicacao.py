@@ -0,0 +1,213 @@
+# Arquivo: deduplicacao.py
+"""
+Detecção e limpeza de duplicatas com comandos de conjunto
+
+Para cada tabela, um único INSERT ... SELECT com ROW_NUMBER()/FIRST_VALUE()
+particionado pela chave normalizada monta o mapa duplicado -> registro mantido
+(o de menor id) em uma tabela temporária. A partir do mapa:
+
+- o relatório (simulação) conta grupos e registros excedentes;
+- a mesclagem reaponta as chaves estrangeiras (UPDATE ... WHERE fk IN mapa) e
+  remove os duplicados (DELETE ... WHERE id IN mapa), sem laços em Python.
+
+Fornecedores e tipos de recolhimento também são referenciados pelas notas de
+competências arquivadas (arquivos anuais) e, no caso dos fornecedores, por
+tb_arquivo_fornecedores; a mesclagem reaponta os dois.
+
+Notas fiscais duplicadas são a mesma combinação CNPJ + número da NF +
+referência. A chave normalizada fica na coluna gerada chave_nota (indexada),
+usada também para barrar duplicatas no cadastro e na importação em lote.
+"""
+
+# Chave de uma nota: CNPJ só com dígitos | número da NF sem zeros à esquerda | referência.
+# NULL (não participa da deduplicação) se faltar CNPJ ou número.
+CHAVE_NOTA = """CASE
+    WHEN TRIM(COALESCE({p}numero_nf, '')) = '' OR TRIM(COALESCE({p}cnpj, '')) = '' THEN NULL
+    ELSE REPLACE(REPLACE(REPLACE(REPLACE({p}cnpj, '.', ''), '/', ''), '-', ''), ' ', '')
+        || '|' || LTRIM(UPPER(TRIM({p}numero_nf)), '0') || '|' || TRIM(COALESCE({p}referencia, ''))
+END"""
+
+CNPJ_NORMALIZADO = "REPLACE(REPLACE(REPLACE(REPLACE({p}CNPJ, '.', ''), '/', ''), '-', ''), ' ', '')"
+
+# tabela -> (expressão da chave, [(tabela, coluna) que referenciam o id])
+REGRAS = {
+    "tb_uf": ("UPPER(TRIM(UF))", []),
+    "tb_tipo_de_servico": ("UPPER(TRIM(descricao))", []),
+    "tb_base_calculo": ("UPPER(TRIM(descricao))", []),
+    "tb_tipo_de_recolhimento": ("UPPER(TRIM(recolhimento))", [("tb_notas_fiscais", "recolhimento_id")]),
+    "tb_fornecedores": (
+        CNPJ_NORMALIZADO.format(p=""),
+        [("tb_notas_fiscais", "fornecedor_id"), ("tb_arquivo_fornecedores", "fornecedor_id")]
+    ),
+    "tb_notas_fiscais": ("chave_nota", []),
+}
+
+# Filhas cuja chave primária inclui a coluna reapontada: se o mantido já estiver na
+# mesma competência, a linha do duplicado é igual a ela e é substituída
+SUBSTITUIR_CONFLITO = {"tb_arquivo_fornecedores"}
+
+# tabela -> coluna das notas arquivadas (arquivos anuais) que referencia o id
+REGRAS_ARQUIVO = {
+    "tb_tipo_de_recolhimento": "recolhimento_id",
+    "tb_fornecedores": "fornecedor_id",
+}
+
+# Tabelas de configuração (o antigo limpar_todas_duplicatas)
+TABELAS_CONFIGURACAO = ("tb_base_calculo", "tb_tipo_de_servico", "tb_uf", "tb_tipo_de_recolhimento")
+
+MENSAGEM_DUPLICADA = "nota duplicada (mesmo CNPJ, número e referência)"
+
+
+def sql_chave_nota(p=""):
+    """Expressão da chave de nota com o prefixo de tabela/alias p (ex.: "nf.")"""
+    return CHAVE_NOTA.format(p=p)
+
+
+def _mapear(cursor, tabela):
+    """Preenche temp._dedup_mapa (duplicado, manter, chave) com um único comando"""
+    chave = REGRAS[tabela][0]
+    cursor.execute("DROP TABLE IF EXISTS temp._dedup_mapa")
+    cursor.execute("""
+        CREATE TEMP TABLE _dedup_mapa (
+            duplicado INTEGER PRIMARY KEY,
+            manter INTEGER NOT NULL,
+            chave TEXT
+        )
+    """)
+    cursor.execute(f"""
+        INSERT INTO temp._dedup_mapa (duplicado, manter, chave)
+        SELECT id, manter, chave FROM (
+            SELECT id, chave,
+                   FIRST_VALUE(id) OVER particao AS manter,
+                   ROW_NUMBER() OVER particao AS ordem
+            FROM (SELECT id, {chave} AS chave FROM {tabela})
+            WHERE chave IS NOT NULL
+            WINDOW particao AS (PARTITION BY chave ORDER BY id)
+        )
+        WHERE ordem > 1
+    """)
+
+
+def _resumo(cursor, exemplos):
+    grupos, excedentes = cursor.execute(
+        "SELECT COUNT(DISTINCT manter), COUNT(*) FROM temp._dedup_mapa"
+    ).fetchone()
+    amostra = cursor.execute("""
+        SELECT chave, manter, GROUP_CONCAT(duplicado)
+        FROM temp._dedup_mapa
+        GROUP BY manter
+        ORDER BY manter
+        LIMIT ?
+    """, (exemplos,)).fetchall()
+    return {
+        "grupos": grupos,
+        "excedentes": excedentes,
+        "exemplos": [
+            {"chave": chave, "manter": manter, "duplicados": [int(i) for i in duplicados.split(",")]}
+            for chave, manter, duplicados in amostra
+        ],
+    }
+
+
+def deduplicar(conn, tabelas=None, executar=False, exemplos=20, pasta_arquivo=None):
+    """
+    Relatório (executar=False) ou mesclagem (executar=True) das duplicatas
+
+    A mesclagem roda em uma única transação BEGIN IMMEDIATE: reaponta as chaves
+    estrangeiras para o registro mantido e remove os duplicados. As notas
+    arquivadas são reapontadas antes, arquivo por arquivo (ver arquivamento.reapontar).
+
+    :param conn: Conexão do pool (não é fechada aqui)
+    :param tabelas: Lista de tabelas de REGRAS (padrão: todas)
+    :param exemplos: Quantidade de grupos de exemplo por tabela no relatório
+    :param pasta_arquivo: Pasta dos arquivos anuais das competências arquivadas
+    :return: {tabela: {"grupos", "excedentes", "exemplos"[, "removidos", "referencias"]}}
+    :raises ValueError: se alguma tabela não tiver regra de deduplicação
+    """
+    tabelas = list(tabelas or REGRAS)
+    desconhecidas = [tabela for tabela in tabelas if tabela not in REGRAS]
+    if desconhecidas:
+        raise ValueError(f"Tabelas sem regra de deduplicação: {', '.join(desconhecidas)}")
+
+    cursor = conn.cursor()
+    relatorio = {}
+    if executar:
+        cursor.execute("BEGIN IMMEDIATE")
+    try:
+        for tabela in tabelas:
+            _mapear(cursor, tabela)
+            relatorio[tabela] = _resumo(cursor, exemplos)
+            if not executar or not relatorio[tabela]["excedentes"]:
+                continue
+
+            referencias = {}
+            if tabela in REGRAS_ARQUIVO:
+                import arquivamento
+
+                coluna = REGRAS_ARQUIVO[tabela]
+                mapa = cursor.execute("SELECT duplicado, manter FROM temp._dedup_mapa").fetchall()
+                if pasta_arquivo is None and cursor.execute("SELECT 1 FROM tb_arquivo_referencias").fetchone():
+                    raise ValueError("Há competências arquivadas: informe a pasta dos arquivos anuais")
+                referencias[f"arquivo.tb_notas_fiscais.{coluna}"] = arquivamento.reapontar(
+                    conn, pasta_arquivo, coluna, mapa
+                )
+            for filha, coluna in REGRAS[tabela][1]:
+                conflito = " OR REPLACE" if filha in SUBSTITUIR_CONFLITO else ""
+                cursor.execute(f"""
+                    UPDATE{conflito} {filha}
+                    SET {coluna} = (SELECT manter FROM temp._dedup_mapa WHERE duplicado = {filha}.{coluna})
+                    WHERE {coluna} IN (SELECT duplicado FROM temp._dedup_mapa)
+                """)
+                referencias[f"{filha}.{coluna}"] = cursor.rowcount
+            cursor.execute(f"DELETE FROM {tabela} WHERE id IN (SELECT duplicado FROM temp._dedup_mapa)")
+            relatorio[tabela]["removidos"] = cursor.rowcount
+            relatorio[tabela]["referencias"] = referencias
+        cursor.execute("DROP TABLE IF EXISTS temp._dedup_mapa")
+        if executar:
+            conn.commit()
+        else:
+            # Simulação: só a tabela temporária foi escrita
+            conn.rollback()
+    except Exception:
+        conn.rollback()
+        raise
+    return relatorio
+
+
+def nota_duplicada(cursor, cnpj, numero_nf, referencia, ignorar_id=None):
+    """ID da nota já cadastrada com a mesma chave, ou None (busca pelo índice de chave_nota)"""
+    cursor.execute(f"""
+        SELECT id FROM tb_notas_fiscais
+        WHERE chave_nota = (SELECT {sql_chave_nota()} FROM (SELECT ? AS cnpj, ? AS numero_nf, ? AS referencia))
+          AND id IS NOT ?
+        LIMIT 1
+    """, (cnpj, numero_nf, referencia, ignorar_id))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def linhas_duplicadas(cursor, chaves):
+    """
+    Linhas de um lote de importação que repetem uma nota já gravada ou uma linha anterior do lote
+
+    :param chaves: Iterável de (linha, cnpj, numero_nf, referencia)
+    :return: Conjunto com os números das linhas duplicadas
+    """
+    cursor.execute("DROP TABLE IF EXISTS temp._dedup_lote")
+    cursor.execute("""
+        CREATE TEMP TABLE _dedup_lote (
+            linha INTEGER PRIMARY KEY, cnpj TEXT, numero_nf TEXT, referencia TEXT
+        )
+    """)
+    cursor.executemany("INSERT INTO temp._dedup_lote VALUES (?, ?, ?, ?)", chaves)
+    cursor.execute(f"""
+        SELECT linha FROM (
+            SELECT linha, chave, ROW_NUMBER() OVER (PARTITION BY chave ORDER BY linha) AS ordem
+            FROM (SELECT linha, {sql_chave_nota()} AS chave FROM temp._dedup_lote)
+            WHERE chave IS NOT NULL
+        ) AS lote
+        WHERE ordem > 1 OR EXISTS (SELECT 1 FROM tb_notas_fiscais nf WHERE nf.chave_nota = lote.chave)
+    """)
+    duplicadas = {row[0] for row in cursor.fetchall()}
+    cursor.execute("DROP TABLE temp._dedup_lote")
+    return duplicadas
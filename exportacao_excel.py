@@ -0,0 +1,289 @@
+# Arquivo: exportacao_excel.py
+"""
+Exportação das notas fiscais para Excel (XLSX) em streaming
+
+As linhas vão do cursor direto para uma planilha write-only do openpyxl, então
+o arquivo nunca fica inteiro em memória. Valores e alíquotas são gravados como
+números e as datas como datas, cada um com o formato de exibição da coluna.
+Em modo write-only a largura das colunas precisa ser definida antes da primeira
+linha: ela é calculada sobre uma amostra das primeiras linhas, mantidas em buffer.
+"""
+from datetime import date
+
+from agregados import CENTAVOS_ISS, CENTAVOS_VALOR
+from database import montar_filtro_notas
+
+# (título, expressão SQL, tipo) — tipo: "texto", "numero", "moeda" ou "data"
+COLUNAS_NOTAS = [
+    ("Referência", "nf.referencia", "texto"),
+    ("Cadastrado em Goiânia", "nf.cadastrado_goiania", "texto"),
+    ("Fora do País", "nf.fora_pais", "texto"),
+    ("CNPJ", "nf.cnpj", "texto"),
+    ("Fornecedor", "f.descricao_fornecedor", "texto"),
+    ("UF", "f.UF", "texto"),
+    ("Município", "f.municipio", "texto"),
+    ("Código Município", "f.cod_municipio", "texto"),
+    ("Inscrição Municipal", "nf.inscricao_municipal", "texto"),
+    ("Tipo de Serviço", "nf.tipo_servico", "texto"),
+    ("Base de Cálculo", "nf.base_calculo", "texto"),
+    ("Número NF", "nf.numero_nf", "texto"),
+    ("Data Emissão", "nf.dt_emissao", "data"),
+    ("Data Pagamento", "nf.dt_pagamento", "data"),
+    ("Alíquota", "nf.aliquota", "numero"),
+    ("Valor NF", "nf.valor_nf", "moeda"),
+    ("Recolhimento", "tr.recolhimento", "texto"),
+    ("Recibo", "nf.recibo", "texto"),
+]
+
+COLUNAS_RESUMO = [
+    ("Fornecedor", "texto"),
+    ("CNPJ", "texto"),
+    ("Quantidade de Notas", "inteiro"),
+    ("Valor Total", "moeda"),
+    ("ISS Total", "moeda"),
+]
+
+COLUNAS_APURACAO = [
+    ("Quebra", "texto"),
+    ("Descrição", "texto"),
+    ("Quantidade de Notas", "inteiro"),
+    ("Valor Total", "moeda"),
+    ("ISS Devido", "moeda"),
+    ("ISS Retido", "moeda"),
+    ("ISS do Prestador", "moeda"),
+]
+
+COLUNAS_ALERTAS_APURACAO = [
+    ("Alerta", "texto"),
+    ("Quantidade de Notas", "inteiro"),
+    ("IDs das Notas (amostra)", "texto"),
+]
+
+FORMATOS = {
+    "numero": "0.00",
+    "moeda": "#,##0.00",
+    "inteiro": "0",
+    "data": "DD/MM/YYYY",
+}
+
+# Largura exibida de cada tipo formatado, usada no cálculo das colunas
+_LARGURA_FIXA = {"data": 10}
+
+SQL_NOTAS_EXCEL = """
+    SELECT {colunas}
+    FROM tb_notas_fiscais nf
+    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+    LEFT JOIN tb_tipo_de_recolhimento tr ON nf.recolhimento_id = tr.id
+    {where}
+    ORDER BY nf.dt_emissao DESC, nf.id DESC
+"""
+
+# Somas em centavos como nos agregados, para fechar com o resumo lido do snapshot colunar
+SQL_RESUMO_FORNECEDORES = f"""
+    SELECT
+        COALESCE(f.descricao_fornecedor, ''),
+        nf.cnpj,
+        COUNT(*),
+        COALESCE(SUM({CENTAVOS_VALOR.format(p="nf.")}), 0) / 100.0,
+        COALESCE(SUM({CENTAVOS_ISS.format(p="nf.")}), 0) / 100.0
+    FROM tb_notas_fiscais nf
+    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+    {{where}}
+    GROUP BY nf.cnpj, f.descricao_fornecedor
+    ORDER BY 4 DESC
+"""
+
+
+def _converter(valor, tipo):
+    if valor is None or valor == "":
+        return None
+    if tipo == "data":
+        try:
+            return date.fromisoformat(str(valor)[:10])
+        except ValueError:
+            return str(valor)
+    if tipo in ("numero", "moeda"):
+        try:
+            return float(valor)
+        except (TypeError, ValueError):
+            return str(valor)
+    return valor
+
+
+def _largura(valor, tipo):
+    if valor is None:
+        return 0
+    if tipo in _LARGURA_FIXA:
+        return _LARGURA_FIXA[tipo]
+    if isinstance(valor, float):
+        # Separador de milhar e duas casas decimais
+        return len(f"{valor:,.2f}")
+    return len(str(valor))
+
+
+class _PlanilhaStreaming:
+    """Planilha write-only com formatos por coluna e largura calculada por amostra"""
+
+    def __init__(self, wb, titulo, colunas, amostra=500):
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font
+
+        self._cell = WriteOnlyCell
+        self.ws = wb.create_sheet(titulo)
+        self.colunas = colunas
+        self.amostra = amostra
+        self.tipos = [tipo for _, tipo in colunas]
+        self.formatos = [FORMATOS.get(tipo) for tipo in self.tipos]
+        self.buffer = []
+        self.linhas = 0
+        self.cabecalho = [self._celula(titulo_col, font=Font(bold=True)) for titulo_col, _ in colunas]
+        self.larguras = [len(titulo_col) for titulo_col, _ in colunas]
+        self._iniciada = False
+
+    def _celula(self, valor, formato=None, font=None):
+        cell = self._cell(self.ws, value=valor)
+        if formato:
+            cell.number_format = formato
+        if font:
+            cell.font = font
+        return cell
+
+    def _linha(self, valores):
+        # Só as colunas com formato viram WriteOnlyCell; o resto vai como valor puro
+        return [
+            self._celula(valor, formato) if formato and valor is not None else valor
+            for valor, formato in zip(valores, self.formatos)
+        ]
+
+    def _iniciar(self):
+        from openpyxl.utils import get_column_letter
+
+        for idx, largura in enumerate(self.larguras, 1):
+            self.ws.column_dimensions[get_column_letter(idx)].width = min(largura + 2, 60)
+        self.ws.freeze_panes = "A2"
+        self.ws.append(self.cabecalho)
+        for valores in self.buffer:
+            self.ws.append(self._linha(valores))
+        self.buffer = None
+        self._iniciada = True
+
+    def adicionar(self, valores):
+        self.linhas += 1
+        if self._iniciada:
+            self.ws.append(self._linha(valores))
+            return
+        self.buffer.append(valores)
+        for idx, (valor, tipo) in enumerate(zip(valores, self.tipos)):
+            largura = _largura(valor, tipo)
+            if largura > self.larguras[idx]:
+                self.larguras[idx] = largura
+        if len(self.buffer) >= self.amostra:
+            self._iniciar()
+
+    def finalizar(self):
+        from openpyxl.utils import get_column_letter
+
+        if not self._iniciada:
+            self._iniciar()
+        ultima_coluna = get_column_letter(len(self.colunas))
+        self.ws.auto_filter.ref = f"A1:{ultima_coluna}{self.linhas + 1}"
+
+
+def _linha_apuracao(quebra, descricao, item):
+    return [
+        quebra, descricao, item["quantidade"],
+        item["valor_centavos"] / 100,
+        item["iss_devido_centavos"] / 100,
+        item["iss_retido_centavos"] / 100,
+        (item["iss_devido_centavos"] - item["iss_retido_centavos"]) / 100,
+    ]
+
+
+def adicionar_apuracao(wb, apuracao):
+    """Acrescenta as abas "Apuração ISS" (total e quebras) e, se houver, "Alertas da Apuração" """
+    planilha = _PlanilhaStreaming(wb, f"Apuração ISS {apuracao['referencia']}".replace("/", "-")[:31], COLUNAS_APURACAO)
+    planilha.adicionar(_linha_apuracao("Total", apuracao["referencia"], apuracao))
+    for item in apuracao["por_tipo_servico"]:
+        planilha.adicionar(_linha_apuracao("Tipo de Serviço", item["tipo_servico"], item))
+    for item in apuracao["por_base_calculo"]:
+        planilha.adicionar(_linha_apuracao("Base de Cálculo", item["base_calculo"], item))
+    for item in apuracao["por_fornecedor"]:
+        planilha.adicionar(_linha_apuracao("Fornecedor", f"{item['fornecedor']} ({item['cnpj']})", item))
+    planilha.finalizar()
+
+    if apuracao["alertas"]:
+        alertas = _PlanilhaStreaming(wb, "Alertas da Apuração", COLUNAS_ALERTAS_APURACAO)
+        for alerta in apuracao["alertas"]:
+            alertas.adicionar([alerta["descricao"], alerta["quantidade"], ", ".join(map(str, alerta["notas"]))])
+        alertas.finalizar()
+
+
+def gerar_excel(conn, filename, filtros=None, tomador_id=None, resumo=True, lote=1000, progresso=None,
+                apuracao=None, resumo_fornecedores=None):
+    """
+    Grava o XLSX das notas fiscais sem carregar o resultado em memória
+
+    :param conn: Conexão obtida com DatabaseManager.create_connection() (não é fechada aqui)
+    :param filename: Caminho do arquivo .xlsx
+    :param filtros: Filtros aceitos por montar_filtro_notas (dt_inicio, dt_fim, referencia, fornecedor_id, ...)
+    :param tomador_id: Tomador identificado no título (propriedades) do arquivo
+    :param resumo: Se True, acrescenta a aba "Resumo por Fornecedor"
+    :param lote: Quantidade de linhas lidas por fetchmany
+    :param progresso: Função opcional chamada com o total de notas gravadas após cada lote
+    :param apuracao: Resultado de DatabaseManager.apurar(); se informado, acrescenta as abas da apuração
+    :param resumo_fornecedores: Linhas do resumo já calculadas (ex.: snapshot_colunar.resumo_fornecedores);
+        None consulta o banco
+    :return: Quantidade de notas exportadas
+    :raises ValueError: se o tomador não for encontrado
+    """
+    from openpyxl import Workbook
+
+    cursor = conn.cursor()
+    tomador = None
+    if tomador_id is not None:
+        cursor.execute("SELECT razao_social, cnpj FROM tb_config_tomador WHERE id = ?", (tomador_id,))
+        tomador = cursor.fetchone()
+        if not tomador:
+            raise ValueError("Dados do tomador não encontrados")
+
+    condicoes, params = montar_filtro_notas(filtros)
+    where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+
+    wb = Workbook(write_only=True)
+    if tomador:
+        wb.properties.title = f"Notas fiscais - {tomador[0]} ({tomador[1]})"
+
+    notas = _PlanilhaStreaming(wb, "Notas Fiscais", [(titulo, tipo) for titulo, _, tipo in COLUNAS_NOTAS])
+    cursor.execute(
+        SQL_NOTAS_EXCEL.format(colunas=", ".join(expr for _, expr, _ in COLUNAS_NOTAS), where=where),
+        params
+    )
+    tipos = notas.tipos
+    try:
+        while True:
+            linhas = cursor.fetchmany(lote)
+            if not linhas:
+                break
+            for linha in linhas:
+                notas.adicionar([_converter(valor, tipo) for valor, tipo in zip(linha, tipos)])
+            if progresso:
+                progresso(notas.linhas)
+    except Exception:
+        # Interrompida (ex.: tarefa cancelada pelo progresso): fecha o XML temporário da aba
+        notas.ws.close()
+        raise
+    notas.finalizar()
+
+    if resumo:
+        planilha = _PlanilhaStreaming(wb, "Resumo por Fornecedor", COLUNAS_RESUMO)
+        if resumo_fornecedores is None:
+            resumo_fornecedores = cursor.execute(SQL_RESUMO_FORNECEDORES.format(where=where), params)
+        for fornecedor, cnpj, quantidade, valor, iss in resumo_fornecedores:
+            planilha.adicionar([fornecedor, cnpj, quantidade, round(valor, 2), round(iss, 2)])
+        planilha.finalizar()
+
+    if apuracao:
+        adicionar_apuracao(wb, apuracao)
+
+    wb.save(filename)
+    return notas.linhas
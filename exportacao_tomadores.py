@@ -0,0 +1,165 @@
+# Arquivo: exportacao_tomadores.py
+"""
+Exportação do TXT da prefeitura de vários tomadores em um único ZIP
+
+Cada tomador tem o seu arquivo, com o cabeçalho montado do próprio cadastro
+(razão social, CNPJ, CAE e e-mail) e as notas da sua partição; sem partição,
+as notas do banco comum, como em /exportar-txt?tomador_id=. Os arquivos são
+gerados em paralelo em um pool de threads de tamanho limitado e entram no ZIP
+na ordem em que ficam prontos, então um tomador grande não segura os demais.
+Cada arquivo passa pelo cache de exportações do banco de onde vem (mesma chave
+do download individual): uma nova exportação do mês só refaz os tomadores cujos
+dados mudaram.
+
+O ZIP é escrito em streaming (sem arquivo intermediário) e termina com
+resumo.json: origem, tamanho, tempo e erro de cada tomador.
+"""
+import json
+import logging
+import os
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+ARQUIVO_RESUMO = "resumo.json"
+TAMANHO_BLOCO = 64 * 1024
+
+
+class _SaidaZip:
+    """Destino não posicionável do ZipFile: acumula os bytes até o próximo repasse"""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def pendentes(self):
+        """Bytes escritos desde a última chamada (tupla vazia se nada foi escrito)"""
+        dados, self._partes = b"".join(self._partes), []
+        return (dados,) if dados else ()
+
+
+def nome_arquivo(tomador):
+    cnpj = "".join(filter(str.isdigit, str(tomador[2] or "")))
+    return f"tomador_{tomador[0]}_{cnpj}.txt" if cnpj else f"tomador_{tomador[0]}.txt"
+
+
+def _gerar_tomador(db, tomador, filtros):
+    """Gera (ou pega do cache) o TXT do tomador; devolve o item do resumo e o arquivo aberto"""
+    inicio = time.perf_counter()
+    tomador_id = tomador[0]
+    item = {
+        "tomador_id": tomador_id,
+        "razao_social": tomador[1],
+        "cnpj": tomador[2],
+        "arquivo": nome_arquivo(tomador),
+    }
+    particao = db.particoes is not None and db.particoes.existe(tomador_id)
+    item["origem"] = "particao" if particao else "comum"
+    banco = db.particoes.obter(tomador_id) if particao else db
+
+    chave = banco.exportacoes.chave("txt", filtros, tomador_id=tomador_id)
+    if chave is None:
+        raise ValueError("Não foi possível conectar ao banco de dados")
+    item["cache"] = banco.exportacoes.obter(chave, "txt") is not None
+
+    def gravar(caminho):
+        with open(caminho, "w", encoding="utf-8", newline="") as arquivo:
+            for pedaco in banco.iter_export_txt(filtros, tomador_id):
+                arquivo.write(pedaco)
+        return True
+
+    caminho, temporario = banco.exportacoes.gerar(chave, "txt", gravar)
+    # Aberto aqui: se o cache descartar o arquivo antes da cópia, o conteúdo continua legível
+    arquivo = open(caminho, "rb")
+    item["bytes"] = os.fstat(arquivo.fileno()).st_size
+    item["segundos"] = round(time.perf_counter() - inicio, 4)
+    return item, arquivo, caminho if temporario else None
+
+
+def exportar_tomadores(db, filtros=None, tomadores=None, max_workers=4):
+    """
+    Prepara o ZIP com o TXT de cada tomador e devolve um gerador com os seus bytes
+
+    A validação acontece na chamada, antes do primeiro pedaço.
+
+    :param db: DatabaseManager do banco comum
+    :param filtros: Filtros de notas aceitos por montar_filtro_notas (ex.: referencia)
+    :param tomadores: IDs dos tomadores (padrão: todos os cadastrados com razão social)
+    :param max_workers: Arquivos gerados ao mesmo tempo
+    :raises ValueError: se não houver tomador a exportar ou algum ID não estiver cadastrado
+    """
+    cadastro = [tomador for tomador in db.get_all_tomadores() if tomador[1]]
+    if tomadores is not None:
+        pedidos = set(tomadores)
+        desconhecidos = pedidos - {tomador[0] for tomador in cadastro}
+        if desconhecidos:
+            raise ValueError(f"Tomadores não encontrados: {', '.join(map(str, sorted(desconhecidos)))}")
+        cadastro = [tomador for tomador in cadastro if tomador[0] in pedidos]
+    if not cadastro:
+        raise ValueError("Nenhum tomador cadastrado para exportar")
+    max_workers = max(1, min(int(max_workers), len(cadastro)))
+
+    def pedacos():
+        inicio = time.perf_counter()
+        saida = _SaidaZip()
+        resumo = []
+        executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="exportacao")
+        futuros = {executor.submit(_gerar_tomador, db, tomador, filtros): tomador for tomador in cadastro}
+        try:
+            with zipfile.ZipFile(saida, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+                for futuro in as_completed(futuros):
+                    tomador = futuros[futuro]
+                    try:
+                        item, arquivo, remover = futuro.result()
+                    except Exception as e:
+                        logger.error("Erro ao exportar o tomador %s: %s", tomador[0], e)
+                        resumo.append({"tomador_id": tomador[0], "razao_social": tomador[1],
+                                       "cnpj": tomador[2], "erro": str(e)})
+                        continue
+                    try:
+                        with arquivo, zf.open(item["arquivo"], "w", force_zip64=item["bytes"] >= zipfile.ZIP64_LIMIT) as destino:
+                            while True:
+                                bloco = arquivo.read(TAMANHO_BLOCO)
+                                if not bloco:
+                                    break
+                                destino.write(bloco)
+                                yield from saida.pendentes()
+                    finally:
+                        if remover:
+                            os.remove(remover)
+                    resumo.append(item)
+                    yield from saida.pendentes()
+
+                resumo.sort(key=lambda item: item["tomador_id"])
+                zf.writestr(ARQUIVO_RESUMO, json.dumps({
+                    "gerado_em": datetime.now().isoformat(timespec="seconds"),
+                    "filtros": filtros or {},
+                    "max_workers": max_workers,
+                    "segundos": round(time.perf_counter() - inicio, 4),
+                    "tomadores": resumo,
+                }, ensure_ascii=False, indent=2))
+            yield from saida.pendentes()
+            logger.info("Exportação de %s tomadores em %.2f s", len(cadastro), time.perf_counter() - inicio)
+        finally:
+            # Download interrompido: os arquivos ainda não copiados são fechados (e os temporários removidos)
+            for futuro in futuros:
+                futuro.cancel()
+            executor.shutdown(wait=True)
+            for futuro in futuros:
+                if futuro.done() and not futuro.cancelled() and futuro.exception() is None:
+                    _, arquivo, remover = futuro.result()
+                    if not arquivo.closed:
+                        arquivo.close()
+                        if remover:
+                            os.remove(remover)
+
+    return pedacos()
@@ -0,0 +1,196 @@
+# Arquivo: exportacao_txt.py
+"""
+Exportação das notas fiscais para o arquivo TXT de layout fixo da prefeitura
+
+O arquivo é gerado em streaming: as notas são lidas do cursor em lotes
+(fetchmany) e cada registro é formatado pelo layout declarado em
+layout_registros, então o uso de memória não depende da quantidade de notas exportadas.
+O ISS devido e o retido de cada registro seguem a regra da apuração (apuracao.iss_nota).
+O leiaute limita um arquivo a MAXIMO_NOTAS registros de detalhe (largura do sequencial
+do detalhe e da quantidade do trailer); acima disso a exportação é recusada antes de começar.
+"""
+from datetime import datetime
+
+from apuracao import centavos, iss_nota
+from database import montar_filtro_notas
+from layout_registros import DETALHE, HEADER, HEADER_CNPJ, HEADER_CONTATO, TRAILER, VERSAO_LEIAUTE
+
+SQL_NOTAS_TXT = """
+    SELECT
+        nf.id,
+        nf.cnpj,
+        f.descricao_fornecedor,
+        nf.dt_emissao,
+        nf.dt_pagamento,
+        nf.valor_nf,
+        nf.aliquota,
+        nf.tipo_servico,
+        nf.fora_pais,
+        nf.cadastrado_goiania
+    FROM tb_notas_fiscais nf
+    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+    {where}
+    ORDER BY nf.id
+"""
+
+# Maior quantidade de notas que o sequencial (D) e a quantidade do trailer (T) comportam
+MAXIMO_NOTAS = min(DETALHE.maximo("sequencial"), TRAILER.maximo("quantidade"))
+
+# Tomador usado quando a exportação não informa tomador_id
+TOMADOR_PADRAO = {
+    "razao_social": "KLB ACCOUTING CONTABILIDADE EMPRESARIAL EIRELI",
+    "cnpj": "09238316000190",
+    "cae_inscricao": "2425459",
+    "email": "marcelo.santos@kblcontabilidade.com.br",
+}
+
+
+def _data_compacta(valor):
+    # "AAAA-MM-DD" -> "AAAAMMDD" sem strptime por linha; ausente vira zeros
+    return valor[:10].replace("-", "") if valor else "0" * 8
+
+
+def _digitos(valor):
+    return ''.join(filter(str.isdigit, str(valor or '')))
+
+
+def _cnpj_formatado(cnpj):
+    if len(cnpj) != 14:
+        return cnpj
+    return f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
+
+
+def cabecalho_txt(tomador=None, data=None):
+    """
+    Monta as três linhas do cabeçalho (H, CNPJ do tomador e contato)
+
+    :param tomador: Dicionário com razao_social, cnpj, cae_inscricao e email; None usa TOMADOR_PADRAO
+    :param data: Data de geração (padrão: hoje)
+    """
+    tomador = {**TOMADOR_PADRAO, **{k: v for k, v in (tomador or {}).items() if v}}
+    data_geracao = (data or datetime.now()).strftime('%Y%m%d')
+    return "\n".join([
+        HEADER.formatar({
+            "cae_inscricao": _digitos(tomador["cae_inscricao"]),
+            "data_geracao": data_geracao,
+            "razao_social": tomador["razao_social"],
+        }),
+        HEADER_CNPJ.formatar({"cnpj": _digitos(tomador["cnpj"]), "optante_simples": "N"}),
+        HEADER_CONTATO.formatar({
+            "data_geracao": data_geracao,
+            "contato": f"{tomador['email']}{VERSAO_LEIAUTE}N",
+        }),
+        "",
+    ])
+
+
+def formatar_detalhe(seq, nota):
+    """
+    Formata um registro de detalhe (D) a partir de (id, cnpj, fornecedor, dt_emissao, dt_pagamento,
+    valor, aliquota, tipo_servico, fora_pais, cadastrado_goiania)
+    """
+    _, cnpj, fornecedor, dt_emissao, dt_pagamento, valor_nf, aliquota, tipo_servico, fora_pais, cadastrado = nota
+    cnpj = _digitos(cnpj)
+    # Valores em centavos; o ISS é calculado sobre o valor já arredondado
+    valor = centavos(valor_nf)
+    valor_iss, valor_iss_retido = iss_nota(valor, aliquota, tipo_servico, fora_pais, cadastrado)
+    dt_emissao = _data_compacta(dt_emissao)
+    return DETALHE.formatar({
+        "sequencial": seq,
+        "cnpj": cnpj,
+        "fornecedor": str(fornecedor or ''),
+        "cnpj_formatado": _cnpj_formatado(cnpj),
+        "valor": valor,
+        "valor_iss": valor_iss,
+        "dt_emissao": dt_emissao,
+        "dt_pagamento": _data_compacta(dt_pagamento),
+        "dt_competencia": dt_emissao,
+        "aliquota": centavos(aliquota),
+        "valor_iss_retido": valor_iss_retido,
+    })
+
+
+def trailer_txt(quantidade):
+    """Monta o registro trailer (T) com a quantidade de registros de detalhe"""
+    return TRAILER.formatar({"quantidade": quantidade}) + "\n"
+
+
+def arquivo_exemplo():
+    """Arquivo de exemplo do layout (um registro de detalhe), gerado pelo mesmo formatador da exportação"""
+    nota = (0, "12345678000190", "Empresa ABC Ltda", "2025-01-15", "2025-01-15", 500.0, 3.5, "00 - Normal", "Não", "Não")
+    return (
+        cabecalho_txt(data=datetime(2025, 6, 10))
+        + formatar_detalhe(1, nota) + "\n"
+        + trailer_txt(1)
+    )
+
+
+def gerar_txt(conn, filtros=None, tomador_id=None, lote=1000, progresso=None):
+    """
+    Prepara a exportação e devolve um gerador com os pedaços do arquivo TXT
+
+    A validação (tomador, consulta) acontece antes do primeiro pedaço, então erros
+    aparecem na chamada e não no meio do download. O gerador fecha a conexão ao terminar.
+
+    :param conn: Conexão obtida com DatabaseManager.create_connection()
+    :param filtros: Filtros de notas aceitos por montar_filtro_notas (ex.: referencia)
+    :param tomador_id: Tomador cujos dados vão no cabeçalho; None usa o cabeçalho padrão
+    :param lote: Quantidade de notas lidas por fetchmany
+    :param progresso: Função opcional chamada com o total de notas formatadas após cada lote
+    :raises ValueError: se o tomador não for encontrado ou se o filtro resultar em mais de
+        MAXIMO_NOTAS notas (limite do leiaute)
+    """
+    try:
+        cursor = conn.cursor()
+        tomador = None
+        if tomador_id is not None:
+            # SELECT *: o cabeçalho usa as colunas do cadastro, inclusive email (migração 13)
+            cursor.execute("SELECT * FROM tb_config_tomador WHERE id = ?", (tomador_id,))
+            row = cursor.fetchone()
+            if not row:
+                raise ValueError("Dados do tomador não encontrados")
+            tomador = dict(zip([col[0] for col in cursor.description], row))
+        else:
+            cursor.execute("SELECT 1 FROM tb_config_tomador LIMIT 1")
+            if not cursor.fetchone():
+                raise ValueError("Dados do tomador não encontrados")
+
+        condicoes, params = montar_filtro_notas(filtros)
+        where = f"WHERE {' AND '.join(condicoes)}" if condicoes else ""
+        # Conferido antes do primeiro pedaço: o trailer não comporta mais registros
+        cursor.execute(
+            f"SELECT COUNT(*) FROM tb_notas_fiscais nf LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id {where}",
+            params
+        )
+        quantidade = cursor.fetchone()[0]
+        if quantidade > MAXIMO_NOTAS:
+            raise ValueError(
+                f"Exportação com {quantidade} notas excede o limite de {MAXIMO_NOTAS} registros "
+                "do leiaute da prefeitura; filtre por referência ou período"
+            )
+        cursor.execute(SQL_NOTAS_TXT.format(where=where), params)
+    except Exception:
+        conn.close()
+        raise
+
+    def pedacos():
+        try:
+            yield cabecalho_txt(tomador)
+            seq = 0
+            while True:
+                notas = cursor.fetchmany(lote)
+                if not notas:
+                    break
+                registros = []
+                for nota in notas:
+                    seq += 1
+                    registros.append(formatar_detalhe(seq, nota))
+                registros.append("")
+                yield "\n".join(registros)
+                if progresso:
+                    progresso(seq)
+            yield trailer_txt(seq)
+        finally:
+            conn.close()
+
+    return pedacos()
@@ -0,0 +1,349 @@
+# Arquivo: importacao_notas.py
+"""
+Importação em lote de notas fiscais (NFS-e) a partir de CSV, TXT delimitado ou XLSX
+
+O arquivo é lido em blocos; cada bloco é validado de forma vetorizada com pandas,
+os fornecedores do bloco são gravados com um único upsert e as notas válidas
+entram com executemany, uma transação por bloco. Notas que repetem uma já
+gravada (ou uma linha anterior do arquivo) são rejeitadas por padrão.
+"""
+import csv
+import itertools
+import logging
+import re
+import time
+import unicodedata
+
+import pandas as pd
+
+import deduplicacao
+from arquivamento import MENSAGEM_ARQUIVADA
+from database import MAX_ERROS_RELATORIO
+
+logger = logging.getLogger(__name__)
+
+# Colunas canônicas e os nomes aceitos no cabeçalho (já normalizados por _normalizar_cabecalho).
+# Os nomes da exportação para Excel são aceitos, então um arquivo exportado pode ser reimportado.
+ALIASES_COLUNAS = {
+    "referencia": ["referencia", "competencia"],
+    "cadastrado_goiania": ["cadastrado_goiania", "cadastrado_em_goiania"],
+    "fora_pais": ["fora_pais", "fora_do_pais"],
+    "cnpj": ["cnpj", "cnpj_cpf"],
+    "fornecedor": ["fornecedor", "descricao_fornecedor", "razao_social"],
+    "uf": ["uf"],
+    "municipio": ["municipio"],
+    "cod_municipio": ["cod_municipio", "codigo_municipio"],
+    "inscricao_municipal": ["inscricao_municipal"],
+    "tipo_servico": ["tipo_servico", "tipo_de_servico"],
+    "base_calculo": ["base_calculo", "base_de_calculo"],
+    "numero_nf": ["numero_nf", "num_nf", "n_nf", "no_nf"],
+    "dt_emissao": ["dt_emissao", "data_emissao"],
+    "dt_pagamento": ["dt_pagamento", "data_pagamento"],
+    "aliquota": ["aliquota"],
+    "valor_nf": ["valor_nf", "valor"],
+    "recolhimento": ["recolhimento"],
+    "recibo": ["recibo"],
+}
+
+COLUNAS_OBRIGATORIAS = ["referencia", "cnpj", "fornecedor", "numero_nf", "dt_emissao", "valor_nf"]
+
+EXTENSOES_IMPORTACAO = {"csv", "txt", "xlsx"}
+
+# Tratamento de notas duplicadas (mesmo CNPJ, número e referência)
+MODOS_DUPLICADAS = ("rejeitar", "permitir")
+
+
+def _normalizar_cabecalho(nome):
+    texto = unicodedata.normalize("NFKD", str(nome or "")).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "_", texto.lower()).strip("_")
+
+
+def _mapear_colunas(cabecalho):
+    """Retorna {coluna canônica: posição no arquivo} a partir do cabeçalho lido"""
+    normalizados = [_normalizar_cabecalho(nome) for nome in cabecalho]
+    mapa = {}
+    for canonica, aliases in ALIASES_COLUNAS.items():
+        for alias in aliases:
+            if alias in normalizados:
+                mapa[canonica] = normalizados.index(alias)
+                break
+    return mapa
+
+
+def _ler_blocos_delimitado(file_path, chunk_size, encoding):
+    with open(file_path, "r", encoding=encoding, newline="") as arquivo:
+        amostra = arquivo.readline()
+        delimitador = max(";,\t|", key=amostra.count)
+        arquivo.seek(0)
+        leitor = csv.reader(arquivo, delimiter=delimitador)
+        cabecalho = next(leitor, [])
+        yield cabecalho
+        while True:
+            bloco = list(itertools.islice(leitor, chunk_size))
+            if not bloco:
+                break
+            yield bloco
+
+
+def _ler_blocos_xlsx(file_path, chunk_size):
+    from openpyxl import load_workbook
+
+    wb = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        linhas = wb.worksheets[0].iter_rows(values_only=True)
+        cabecalho = next(linhas, ())
+        yield list(cabecalho)
+        while True:
+            bloco = list(itertools.islice(linhas, chunk_size))
+            if not bloco:
+                break
+            yield bloco
+    finally:
+        wb.close()
+
+
+def _para_numero(serie):
+    """Converte texto em número aceitando "1.234,56" e "1234.56"; inválidos viram NaN"""
+    texto = serie.astype(str).str.strip().str.replace("R$", "", regex=False).str.replace(" ", "", regex=False)
+    brasileiro = texto.str.contains(",", regex=False)
+    texto = texto.where(~brasileiro, texto.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return pd.to_numeric(texto, errors="coerce")
+
+
+def _para_data(serie):
+    """Converte datas ISO, dd/mm/aaaa ou datetime do Excel em texto AAAA-MM-DD; inválidas viram NaN"""
+    datas = pd.to_datetime(serie, format="%Y-%m-%d", errors="coerce")
+    faltando = datas.isna() & serie.notna()
+    if faltando.any():
+        datas[faltando] = pd.to_datetime(serie[faltando], format="%d/%m/%Y", errors="coerce")
+        faltando = datas.isna() & serie.notna()
+        if faltando.any():
+            datas[faltando] = pd.to_datetime(serie[faltando], errors="coerce")
+    return datas.dt.strftime("%Y-%m-%d")
+
+
+def _montar_bloco(linhas, mapa, primeira_linha):
+    largura = max(mapa.values()) + 1
+    linhas = [list(linha)[:largura] + [None] * (largura - len(linha)) for linha in linhas]
+    bruto = pd.DataFrame(linhas)
+    df = pd.DataFrame(index=bruto.index)
+    for canonica in ALIASES_COLUNAS:
+        if canonica in mapa:
+            df[canonica] = bruto[mapa[canonica]]
+        else:
+            df[canonica] = None
+    df["linha"] = range(primeira_linha, primeira_linha + len(df))
+    return df
+
+
+def validar_bloco(df, recolhimentos, arquivadas=frozenset()):
+    """
+    Normaliza e valida um bloco de notas de forma vetorizada
+
+    :param df: DataFrame com as colunas canônicas e a coluna "linha"
+    :param recolhimentos: Dicionário {descrição do recolhimento: id}
+    :param arquivadas: Referências arquivadas (não aceitam notas novas)
+    :return: Tupla (DataFrame das linhas válidas, lista de erros por linha)
+    """
+    texto = {}
+    for coluna in ALIASES_COLUNAS:
+        if coluna in ("valor_nf", "aliquota", "dt_emissao", "dt_pagamento"):
+            continue
+        texto[coluna] = df[coluna].fillna("").astype(str).str.strip()
+    df = df.assign(**texto)
+
+    df["cnpj"] = df["cnpj"].str.replace(r"\D", "", regex=True)
+    df["uf"] = df["uf"].str.upper()
+    df["cadastrado_goiania"] = df["cadastrado_goiania"].replace("", "Não")
+    df["fora_pais"] = df["fora_pais"].replace("", "Não")
+    df["valor_nf"] = _para_numero(df["valor_nf"])
+    df["aliquota"] = _para_numero(df["aliquota"].fillna("0").replace("", "0"))
+    df["dt_emissao"] = _para_data(df["dt_emissao"].replace("", None))
+    df["dt_pagamento"] = _para_data(df["dt_pagamento"].replace("", None))
+    df["recolhimento_id"] = df["recolhimento"].map(recolhimentos)
+
+    regras = [
+        (df["referencia"] == "", "referência vazia"),
+        (~df["cnpj"].str.len().isin([11, 14]), "CNPJ/CPF deve ter 14 ou 11 dígitos"),
+        (df["fornecedor"] == "", "fornecedor vazio"),
+        (df["numero_nf"] == "", "número da NF vazio"),
+        (df["dt_emissao"].isna(), "data de emissão inválida"),
+        (df["valor_nf"].isna() | (df["valor_nf"] < 0), "valor da NF inválido"),
+        (df["aliquota"].isna() | (df["aliquota"] < 0) | (df["aliquota"] > 100), "alíquota inválida"),
+        ((df["recolhimento"] != "") & df["recolhimento_id"].isna(), "recolhimento desconhecido"),
+        (df["referencia"].isin(arquivadas), MENSAGEM_ARQUIVADA),
+    ]
+
+    invalida = pd.Series(False, index=df.index)
+    for mascara, _ in regras:
+        invalida |= mascara
+
+    erros = []
+    for idx in df.index[invalida]:
+        mensagens = [mensagem for mascara, mensagem in regras if mascara.at[idx]]
+        erros.append({"linha": int(df.at[idx, "linha"]), "erros": mensagens})
+
+    return df[~invalida], erros
+
+
+def _gravar_bloco(conn, df, fornecedores_ids, rejeitar_duplicadas=True):
+    """
+    Faz o upsert dos fornecedores do bloco e insere as notas, numa única transação
+
+    :return: Tupla (fornecedores gravados, notas gravadas, linhas rejeitadas por duplicidade)
+    """
+    c = conn.cursor()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        duplicadas = []
+        if rejeitar_duplicadas:
+            # Conferido dentro da transação: outro escritor não grava a mesma nota no meio
+            repetidas = deduplicacao.linhas_duplicadas(c, df[
+                ["linha", "cnpj", "numero_nf", "referencia"]
+            ].itertuples(index=False, name=None))
+            if repetidas:
+                duplicadas = sorted(repetidas)
+                df = df[~df["linha"].isin(repetidas)]
+                if df.empty:
+                    conn.commit()
+                    return 0, 0, duplicadas
+
+        # Último registro de cada CNPJ no bloco prevalece
+        fornecedores = df.drop_duplicates("cnpj", keep="last")
+        c.executemany("""
+            INSERT INTO tb_fornecedores
+            (CNPJ, descricao_fornecedor, UF, municipio, cod_municipio, fora_pais, cadastrado_goiania)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (CNPJ) DO UPDATE SET
+                descricao_fornecedor = excluded.descricao_fornecedor,
+                UF = excluded.UF,
+                municipio = excluded.municipio,
+                cod_municipio = excluded.cod_municipio,
+                fora_pais = excluded.fora_pais,
+                cadastrado_goiania = excluded.cadastrado_goiania
+        """, fornecedores[[
+            "cnpj", "fornecedor", "uf", "municipio", "cod_municipio", "fora_pais", "cadastrado_goiania"
+        ]].itertuples(index=False, name=None))
+
+        faltando = [cnpj for cnpj in fornecedores["cnpj"] if cnpj not in fornecedores_ids]
+        for inicio in range(0, len(faltando), 500):
+            parte = faltando[inicio:inicio + 500]
+            c.execute(
+                f"SELECT CNPJ, id FROM tb_fornecedores WHERE CNPJ IN ({','.join('?' * len(parte))})",
+                parte
+            )
+            fornecedores_ids.update(c.fetchall())
+
+        df = df.assign(fornecedor_id=df["cnpj"].map(fornecedores_ids))
+        recolhimento_id = df["recolhimento_id"].astype(object).where(df["recolhimento_id"].notna(), None)
+        dt_pagamento = df["dt_pagamento"].astype(object).where(df["dt_pagamento"].notna(), "")
+        df = df.assign(recolhimento_id=recolhimento_id, dt_pagamento=dt_pagamento)
+
+        c.executemany("""
+            INSERT INTO tb_notas_fiscais (
+                referencia, cadastrado_goiania, fora_pais, cnpj, fornecedor_id,
+                inscricao_municipal, tipo_servico, base_calculo, numero_nf,
+                dt_emissao, dt_pagamento, aliquota, valor_nf, recolhimento_id,
+                recibo, uf, municipio, cod_municipio
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, df[[
+            "referencia", "cadastrado_goiania", "fora_pais", "cnpj", "fornecedor_id",
+            "inscricao_municipal", "tipo_servico", "base_calculo", "numero_nf",
+            "dt_emissao", "dt_pagamento", "aliquota", "valor_nf", "recolhimento_id",
+            "recibo", "uf", "municipio", "cod_municipio"
+        ]].itertuples(index=False, name=None))
+
+        conn.commit()
+        return len(fornecedores), len(df), duplicadas
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def importar_notas(db, file_path, chunk_size=2000, progresso=None, encoding="utf-8-sig", duplicadas="rejeitar"):
+    """
+    Importa notas fiscais de um arquivo CSV, TXT delimitado ou XLSX
+
+    :param db: DatabaseManager de destino
+    :param file_path: Caminho do arquivo (a extensão define o formato)
+    :param chunk_size: Quantidade de linhas por bloco/transação
+    :param progresso: Função opcional chamada com o total de linhas lidas após cada bloco
+    :param duplicadas: "rejeitar" (padrão) recusa notas já cadastradas ou repetidas no arquivo;
+        "permitir" grava todas
+    :return: Dicionário com o relatório da importação
+    :raises ValueError: se o formato, o cabeçalho ou o modo de duplicadas forem inválidos
+    """
+    if duplicadas not in MODOS_DUPLICADAS:
+        raise ValueError(f"Modo de duplicadas inválido: {duplicadas} (use {' ou '.join(MODOS_DUPLICADAS)})")
+
+    inicio = time.perf_counter()
+    extensao = file_path.rsplit(".", 1)[-1].lower()
+    if extensao not in EXTENSOES_IMPORTACAO:
+        raise ValueError(f"Formato não suportado: .{extensao}")
+
+    if extensao == "xlsx":
+        blocos = _ler_blocos_xlsx(file_path, chunk_size)
+    else:
+        blocos = _ler_blocos_delimitado(file_path, chunk_size, encoding)
+
+    mapa = _mapear_colunas(next(blocos))
+    ausentes = [coluna for coluna in COLUNAS_OBRIGATORIAS if coluna not in mapa]
+    if ausentes:
+        raise ValueError(f"Colunas obrigatórias ausentes no cabeçalho: {', '.join(ausentes)}")
+
+    relatorio = {
+        "linhas": 0, "importadas": 0, "rejeitadas": 0, "duplicadas": 0, "fornecedores_gravados": 0, "erros": []
+    }
+    # Dados de linha começam na linha 2 do arquivo (linha 1 é o cabeçalho)
+    proxima_linha = 2
+
+    conn = db.create_connection()
+    if conn is None:
+        raise RuntimeError("Não foi possível conectar ao banco de dados")
+    try:
+        recolhimentos = dict(conn.execute("SELECT recolhimento, id FROM tb_tipo_de_recolhimento").fetchall())
+        arquivadas = {linha[0] for linha in conn.execute("SELECT referencia FROM tb_arquivo_referencias")}
+        fornecedores_ids = {}
+
+        for bloco in blocos:
+            df = _montar_bloco(bloco, mapa, proxima_linha)
+            proxima_linha += len(bloco)
+
+            # Linhas totalmente vazias são ignoradas
+            celulas = df[list(ALIASES_COLUNAS)].fillna("").astype(str)
+            vazias = celulas.apply(lambda coluna: coluna.str.strip() == "").all(axis=1)
+            df = df[~vazias]
+            if df.empty:
+                continue
+
+            validas, erros = validar_bloco(df, recolhimentos, arquivadas)
+            relatorio["linhas"] += len(df)
+
+            if not validas.empty:
+                fornecedores, gravadas, repetidas = _gravar_bloco(
+                    conn, validas, fornecedores_ids, rejeitar_duplicadas=duplicadas == "rejeitar"
+                )
+                relatorio["fornecedores_gravados"] += fornecedores
+                relatorio["importadas"] += gravadas
+                relatorio["duplicadas"] += len(repetidas)
+                erros.extend({"linha": linha, "erros": [deduplicacao.MENSAGEM_DUPLICADA]} for linha in repetidas)
+                erros.sort(key=lambda erro: erro["linha"])
+
+            relatorio["rejeitadas"] += len(erros)
+            espaco = MAX_ERROS_RELATORIO - len(relatorio["erros"])
+            relatorio["erros"].extend(erros[:max(espaco, 0)])
+
+            if progresso:
+                progresso(proxima_linha - 2)
+    finally:
+        conn.close()
+
+    segundos = time.perf_counter() - inicio
+    relatorio["segundos"] = round(segundos, 3)
+    relatorio["linhas_por_segundo"] = round(relatorio["linhas"] / segundos) if segundos else 0
+    logger.info(
+        "Notas importadas: %s de %s linhas, %s rejeitadas (%s duplicadas) (%s linhas/s)",
+        relatorio['importadas'], relatorio['linhas'], relatorio['rejeitadas'], relatorio['duplicadas'],
+        relatorio['linhas_por_segundo']
+    )
+    return relatorio
@@ -0,0 +1,280 @@
+# Arquivo: journal.py
+"""
+Journal de alterações (CDC) de notas fiscais, fornecedores e tomadores
+
+tb_journal (migração 12) recebe, por triggers, uma linha por registro incluído,
+alterado ou excluído nas TABELAS_JOURNAL: operação (I, U, D), id do registro,
+imagens antes/depois (JSON com todas as colunas gravadas), momento (UTC) e
+usuário. A linha é gravada na mesma transação da alteração, então o journal
+não custa um commit (fsync) a mais: um limpar_* ou uma importação em lote
+grava todas as linhas do journal no commit que já fazia. Linhas do journal
+nunca são alteradas (trigger); só a poda (podar) as exclui.
+
+O seq (INTEGER PRIMARY KEY AUTOINCREMENT) é a versão do journal: alteracoes()
+devolve o que mudou depois de um seq, para caches e relatórios atualizarem só
+o que mudou, e desfazer() reverte tudo depois de um seq (ou de um momento).
+
+O usuário vem de usuario_atual() (contextvar definida por requisição ou
+tarefa) e as triggers chamam as funções SQL usuario_atual() e journal_ativo(),
+registradas em cada conexão do pool (registrar_funcoes): escrever nessas
+tabelas por uma conexão sqlite3 avulsa falha com "no such function".
+Movimentos internos que não são alterações dos dados (arquivamento de
+competência, cópia do cadastro para as partições) suspendem o journal na
+conexão (suspenso).
+
+Acrescentar colunas a uma tabela do journal exige uma nova migração que
+recrie as triggers (sql_triggers_journal lê as colunas atuais).
+"""
+import contextvars
+import json
+import sqlite3
+from contextlib import contextmanager
+
+# Tabelas com journal (todas com chave primária id)
+TABELAS_JOURNAL = ("tb_notas_fiscais", "tb_fornecedores", "tb_config_tomador")
+
+USUARIO_PADRAO = "sistema"
+MAXIMO_ALTERACOES = 5000
+
+_usuario = contextvars.ContextVar("usuario_journal", default=USUARIO_PADRAO)
+
+
+def definir_usuario(usuario):
+    """Usuário gravado nas próximas alterações deste contexto (requisição, tarefa ou thread)"""
+    return _usuario.set(str(usuario or USUARIO_PADRAO)[:200])
+
+
+def usuario_atual():
+    return _usuario.get()
+
+
+def registrar_funcoes(conn):
+    """Registra usuario_atual() e journal_ativo() na conexão (usadas pelas triggers)"""
+    conn.journal_ativo = True
+    conn.create_function("usuario_atual", 0, usuario_atual)
+    conn.create_function("journal_ativo", 0, lambda: 1 if getattr(conn, "journal_ativo", True) else 0)
+
+
+@contextmanager
+def suspenso(conn):
+    """Desliga o journal na conexão durante o bloco"""
+    anterior = getattr(conn, "journal_ativo", True)
+    conn.journal_ativo = False
+    try:
+        yield conn
+    finally:
+        conn.journal_ativo = anterior
+
+
+def colunas_gravadas(cursor, tabela):
+    """Colunas da tabela que podem ser gravadas (sem as geradas)"""
+    return [linha[1] for linha in cursor.execute(f"PRAGMA table_xinfo({tabela})").fetchall() if linha[6] == 0]
+
+
+def sql_triggers_journal(cursor):
+    """Comandos DROP/CREATE TRIGGER do journal, com as colunas atuais de cada tabela"""
+    comandos = []
+    for tabela in TABELAS_JOURNAL:
+        colunas = colunas_gravadas(cursor, tabela)
+
+        def imagem(p):
+            return "json_object(" + ", ".join(f"'{coluna}', {p}{coluna}" for coluna in colunas) + ")"
+
+        for evento, operacao, registro, antes, depois in (
+            ("INSERT", "I", "NEW.id", "NULL", imagem("NEW.")),
+            ("UPDATE", "U", "NEW.id", imagem("OLD."), imagem("NEW.")),
+            ("DELETE", "D", "OLD.id", imagem("OLD."), "NULL"),
+        ):
+            nome = f"tr_{tabela}_journal_{evento.lower()}"
+            comandos.append(f"DROP TRIGGER IF EXISTS {nome}")
+            comandos.append(f"""
+                CREATE TRIGGER {nome} AFTER {evento} ON {tabela}
+                WHEN journal_ativo()
+                BEGIN
+                    INSERT INTO tb_journal (tabela, operacao, registro_id, antes, depois, usuario, momento)
+                    VALUES ('{tabela}', '{operacao}', {registro}, {antes}, {depois}, usuario_atual(),
+                            strftime('%Y-%m-%d %H:%M:%f', 'now'));
+                END
+            """)
+    comandos.append("""
+        CREATE TRIGGER IF NOT EXISTS tr_journal_somente_inclusao BEFORE UPDATE ON tb_journal
+        BEGIN
+            SELECT RAISE(ABORT, 'O journal não pode ser alterado');
+        END
+    """)
+    return comandos
+
+
+def _validar_tabelas(tabelas):
+    if not tabelas:
+        return list(TABELAS_JOURNAL)
+    desconhecidas = set(tabelas) - set(TABELAS_JOURNAL)
+    if desconhecidas:
+        raise ValueError(f"Tabelas sem journal: {', '.join(sorted(desconhecidas))}")
+    return list(tabelas)
+
+
+def _linha(seq, tabela, operacao, registro_id, antes, depois, usuario, momento):
+    return {
+        "seq": seq,
+        "tabela": tabela,
+        "operacao": operacao,
+        "registro_id": registro_id,
+        "antes": json.loads(antes) if antes else None,
+        "depois": json.loads(depois) if depois else None,
+        "usuario": usuario,
+        "momento": momento,
+    }
+
+
+def versao(conn):
+    """Seq da última alteração registrada (0 com o journal vazio)"""
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM tb_journal").fetchone()[0]
+
+
+def seq_no_momento(conn, momento):
+    """Último seq registrado até o momento (UTC, 'AAAA-MM-DD HH:MM:SS'); 0 se nenhum"""
+    momento = str(momento or "").replace("T", " ").strip()
+    if not momento:
+        raise ValueError("Informe o momento (AAAA-MM-DD HH:MM:SS, UTC)")
+    return conn.execute(
+        "SELECT COALESCE(MAX(seq), 0) FROM tb_journal WHERE momento <= ?", (momento,)
+    ).fetchone()[0]
+
+
+def alteracoes(conn, desde=0, limite=1000, tabelas=None):
+    """
+    Alterações com seq maior que desde, em ordem
+
+    :return: {"alteracoes": [...], "desde", "ultimo" (seq a usar no próximo pedido),
+        "atual" (versão do journal), "mais" (há alterações além do limite)}
+    """
+    tabelas = _validar_tabelas(tabelas)
+    desde = int(desde or 0)
+    limite = max(1, min(int(limite), MAXIMO_ALTERACOES))
+    marcadores = ", ".join("?" for _ in tabelas)
+    linhas = conn.execute(f"""
+        SELECT seq, tabela, operacao, registro_id, antes, depois, usuario, momento
+        FROM tb_journal
+        WHERE seq > ? AND tabela IN ({marcadores})
+        ORDER BY seq
+        LIMIT ?
+    """, [desde, *tabelas, limite + 1]).fetchall()
+    mais = len(linhas) > limite
+    linhas = linhas[:limite]
+    return {
+        "alteracoes": [_linha(*linha) for linha in linhas],
+        "desde": desde,
+        "ultimo": linhas[-1][0] if linhas else desde,
+        "atual": versao(conn),
+        "mais": mais,
+    }
+
+
+def _reverter_trecho(cursor, tabela, operacao, primeiro, ultimo, quantidade, colunas):
+    """
+    Reverte um trecho de alterações consecutivas (mesma tabela e operação) com um comando só
+
+    As imagens são lidas do próprio tb_journal (json_extract), sem passar pelo Python.
+    Alterações (U) repetidas do mesmo registro no trecho são revertidas uma a uma, da mais nova.
+    """
+    filtro = "j.seq BETWEEN ? AND ? AND j.tabela = ? AND j.operacao = ?"
+    params = [primeiro, ultimo, tabela, operacao]
+    valores = {coluna: f"json_extract(j.antes, '$.\"{coluna}\"')" for coluna in colunas}
+    if operacao == "I":
+        cursor.execute(f"DELETE FROM {tabela} WHERE id IN (SELECT j.registro_id FROM tb_journal j WHERE {filtro})",
+                       params)
+    elif operacao == "D":
+        cursor.execute(f"""
+            INSERT INTO {tabela} ({', '.join(valores)})
+            SELECT {', '.join(valores.values())} FROM tb_journal j WHERE {filtro} ORDER BY j.seq
+        """, params)
+    else:
+        atribuicoes = ", ".join(f"{coluna} = {valor}" for coluna, valor in valores.items() if coluna != "id")
+        repetidos = cursor.execute(
+            f"SELECT COUNT(*) - COUNT(DISTINCT j.registro_id) FROM tb_journal j WHERE {filtro}", params
+        ).fetchone()[0]
+        if not repetidos:
+            cursor.execute(f"""
+                UPDATE {tabela} SET {atribuicoes}
+                FROM tb_journal j WHERE {filtro} AND j.registro_id = {tabela}.id
+            """, params)
+        else:
+            seqs = cursor.execute(f"SELECT j.seq FROM tb_journal j WHERE {filtro} ORDER BY j.seq DESC", params).fetchall()
+            cursor.executemany(f"""
+                UPDATE {tabela} SET {atribuicoes}
+                FROM tb_journal j WHERE j.seq = ? AND j.registro_id = {tabela}.id
+            """, seqs)
+    return cursor.rowcount == quantidade
+
+
+def desfazer(conn, desde, tabelas=None, simular=False):
+    """
+    Reverte, da mais nova para a mais antiga, as alterações com seq maior que desde
+
+    Inclusões são excluídas, exclusões reincluídas com o mesmo id e alterações
+    voltam à imagem anterior, tudo em uma transação BEGIN IMMEDIATE. Cada trecho de
+    alterações consecutivas com a mesma tabela e operação (ex.: as exclusões de um
+    limpar_*) é revertido com um comando só. A reversão também vai para o journal
+    (pode ser desfeita). Se algum registro não estiver mais onde o journal diz
+    (ex.: competência arquivada) ou a reinclusão violar uma restrição, nada é alterado.
+
+    :param conn: Conexão do pool (não é fechada aqui)
+    :param simular: Executa e desfaz, devolvendo a mesma contagem
+    :return: {"desde", "ate", "revertidas": {tabela: quantidade}, "simulacao"}
+    :raises ValueError: conflito na reversão ou tabela sem journal
+    """
+    tabelas = _validar_tabelas(tabelas)
+    desde = int(desde)
+    marcadores = ", ".join("?" for _ in tabelas)
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        ate = versao(conn)
+        # Trechos: sequências máximas de alterações com a mesma tabela e operação (ilhas de seq)
+        trechos = cursor.execute(f"""
+            SELECT tabela, operacao, MIN(seq), MAX(seq), COUNT(*)
+            FROM (
+                SELECT seq, tabela, operacao,
+                       ROW_NUMBER() OVER (ORDER BY seq)
+                       - ROW_NUMBER() OVER (PARTITION BY tabela, operacao ORDER BY seq) AS ilha
+                FROM tb_journal
+                WHERE seq > ? AND seq <= ? AND tabela IN ({marcadores})
+            )
+            GROUP BY tabela, operacao, ilha
+            ORDER BY MAX(seq) DESC
+        """, [desde, ate, *tabelas]).fetchall()
+        colunas = {tabela: colunas_gravadas(cursor, tabela) for tabela in tabelas}
+        revertidas = dict.fromkeys(tabelas, 0)
+        for tabela, operacao, primeiro, ultimo, quantidade in trechos:
+            faixa = f"{primeiro}" if primeiro == ultimo else f"{primeiro} a {ultimo}"
+            try:
+                completo = _reverter_trecho(cursor, tabela, operacao, primeiro, ultimo, quantidade, colunas[tabela])
+            except sqlite3.Error as e:
+                raise ValueError(f"Não foi possível reverter as alterações {faixa} ({tabela}): {e}")
+            if not completo:
+                raise ValueError(
+                    f"Não foi possível reverter as alterações {faixa} ({tabela}): há registros que não estão "
+                    "mais na tabela (excluídos fora do intervalo ou em competência arquivada)"
+                )
+            revertidas[tabela] += quantidade
+        if simular:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return {"desde": desde, "ate": ate, "revertidas": revertidas, "simulacao": bool(simular)}
+
+
+def podar(conn, ate):
+    """
+    Exclui as linhas do journal com seq até ate (inclusive)
+
+    :return: Quantidade de linhas excluídas
+    """
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM tb_journal WHERE seq <= ?", (int(ate),))
+    conn.commit()
+    return cursor.rowcount
@@ -0,0 +1,212 @@
+# Arquivo: layout_registros.py
+"""
+Motor de layout de registros de largura fixa usado nas exportações TXT da prefeitura
+
+Cada tipo de registro é declarado uma única vez como lista de campos
+(nome, largura, tipo) e compilado em um formatador (uma string de formatação
+usada com str.format_map) e em um leitor (fatias pré-calculadas). O formatador
+valida o tamanho do registro e o leitor permite conferir o arquivo gerado (ida e volta).
+
+Tipos de campo:
+    "N"     numérico, alinhado à direita com zeros (valores maiores que a largura são erro)
+    "A"     alfanumérico, alinhado à esquerda com espaços e truncado na largura
+    "=..."  conteúdo fixo (o texto após o "=" precisa ter exatamente a largura do campo)
+"""
+import sys
+import time
+
+
+class LayoutRegistro:
+    """Layout compilado de um tipo de registro de largura fixa"""
+
+    def __init__(self, nome, campos):
+        self.nome = nome
+        self.campos = list(campos)
+        self.tamanho = sum(largura for _, largura, _ in self.campos)
+
+        partes = []
+        self._fatias = []
+        posicao = 0
+        for campo, largura, tipo in self.campos:
+            if tipo.startswith("="):
+                fixo = tipo[1:]
+                if len(fixo) != largura:
+                    raise ValueError(
+                        f"{nome}.{campo}: conteúdo fixo com {len(fixo)} posições, esperado {largura}"
+                    )
+                partes.append(fixo.replace("{", "{{").replace("}", "}}"))
+            elif tipo == "N":
+                partes.append(f"{{{campo}:0>{largura}}}")
+                self._fatias.append((campo, posicao, posicao + largura, int))
+            elif tipo == "A":
+                partes.append(f"{{{campo}:<{largura}.{largura}}}")
+                self._fatias.append((campo, posicao, posicao + largura, str.rstrip))
+            else:
+                raise ValueError(f"{nome}.{campo}: tipo de campo desconhecido {tipo!r}")
+            posicao += largura
+
+        self.formato = "".join(partes)
+        # Identificador do registro (primeiro campo, quando fixo) conferido na leitura
+        primeiro = self.campos[0][2]
+        self._prefixo = primeiro[1:] if primeiro.startswith("=") else ""
+
+    def maximo(self, campo):
+        """Maior valor que cabe no campo numérico informado"""
+        for nome, largura, tipo in self.campos:
+            if nome == campo:
+                if tipo != "N":
+                    raise ValueError(f"{self.nome}.{campo}: campo não é numérico")
+                return 10 ** largura - 1
+        raise KeyError(campo)
+
+    def formatar(self, valores):
+        """
+        Formata um registro a partir de um dicionário {campo: valor}
+
+        Campos numéricos recebem inteiros (ou texto só com dígitos); alfanuméricos recebem texto.
+
+        :raises ValueError: se o registro não ficar com o tamanho do layout
+        :raises KeyError: se faltar algum campo variável
+        """
+        registro = self.formato.format_map(valores)
+        if len(registro) != self.tamanho:
+            raise ValueError(
+                f"Registro {self.nome} com {len(registro)} posições, esperado {self.tamanho}: "
+                "valor numérico maior que a largura do campo"
+            )
+        return registro
+
+    def ler(self, linha):
+        """
+        Lê um registro de volta para {campo: valor} (numéricos como int, texto sem espaços à direita)
+
+        :raises ValueError: se a linha não tiver o tamanho do layout ou um numérico for inválido
+        """
+        linha = linha.rstrip("\r\n")
+        if len(linha) != self.tamanho:
+            raise ValueError(f"Registro {self.nome} com {len(linha)} posições, esperado {self.tamanho}")
+        if not linha.startswith(self._prefixo):
+            raise ValueError(f"Linha não começa com o identificador do registro {self.nome}")
+        return {campo: conversor(linha[inicio:fim]) for campo, inicio, fim, conversor in self._fatias}
+
+
+# Layout do arquivo de serviços tomados da prefeitura (versão 2.9.7 do leiaute),
+# declarado a partir do arquivo de exemplo homologado
+
+HEADER = LayoutRegistro("H", [
+    ("tipo", 1, "=H"),
+    ("cae_inscricao", 7, "N"),
+    ("data_geracao", 8, "N"),
+    ("razao_social", 100, "A"),
+])
+
+HEADER_CNPJ = LayoutRegistro("H-CNPJ", [
+    ("cnpj", 14, "A"),
+    ("separador", 1, "= "),
+    ("optante_simples", 1, "A"),
+    ("brancos", 184, "=" + " " * 184),
+])
+
+HEADER_CONTATO = LayoutRegistro("H-CONTATO", [
+    ("data_geracao", 8, "N"),
+    # E-mail seguido da versão do leiaute e do indicador de retificação, sem separador
+    ("contato", 194, "A"),
+])
+
+DETALHE = LayoutRegistro("D", [
+    ("tipo", 1, "=D"),
+    ("sequencial", 6, "N"),
+    ("zeros_1", 15, "=" + "0" * 15),
+    ("cnpj", 14, "A"),
+    ("fornecedor", 50, "A"),
+    ("cnpj_formatado", 18, "A"),
+    ("valor", 14, "N"),
+    ("valor_iss", 15, "N"),
+    ("zeros_2", 1, "=0"),
+    ("dt_emissao", 8, "N"),
+    ("dt_pagamento", 8, "N"),
+    ("brancos_1", 50, "=" + " " * 50),
+    ("tipo_pessoa", 1, "=J"),
+    ("brancos_2", 25, "=" + " " * 25),
+    ("codigo_servico", 5, "=05002"),
+    ("dt_competencia", 8, "N"),
+    ("aliquota", 5, "N"),
+    ("indicador", 1, "=3"),
+    ("zeros_3", 104, "=" + "0" * 104),
+    ("valor_iss_retido", 14, "N"),
+    ("zeros_4", 37, "=" + "0" * 37),
+])
+
+TRAILER = LayoutRegistro("T", [
+    ("tipo", 1, "=T"),
+    ("quantidade", 5, "N"),
+    ("zeros", 10, "=" + "0" * 10),
+])
+
+VERSAO_LEIAUTE = "2.9.7"
+
+
+def ler_arquivo_prefeitura(linhas):
+    """
+    Lê um arquivo TXT da prefeitura inteiro (cabeçalho em três linhas, detalhes e trailer)
+
+    :param linhas: Iterável de linhas do arquivo
+    :return: Dicionário com "header", "detalhes" (lista) e "trailer"
+    :raises ValueError: se algum registro não bater com o layout ou o trailer não fechar
+    """
+    linhas = iter(linhas)
+    arquivo = {
+        "header": HEADER.ler(next(linhas)),
+        "header_cnpj": HEADER_CNPJ.ler(next(linhas)),
+        "header_contato": HEADER_CONTATO.ler(next(linhas)),
+        "detalhes": [],
+        "trailer": None,
+    }
+    for linha in linhas:
+        if linha.startswith("D"):
+            arquivo["detalhes"].append(DETALHE.ler(linha))
+        elif linha.startswith("T"):
+            arquivo["trailer"] = TRAILER.ler(linha)
+        elif linha.strip():
+            raise ValueError(f"Tipo de registro desconhecido: {linha[:1]!r}")
+
+    if arquivo["trailer"] is None:
+        raise ValueError("Arquivo sem registro trailer")
+    if arquivo["trailer"]["quantidade"] != len(arquivo["detalhes"]):
+        raise ValueError(
+            f"Trailer informa {arquivo['trailer']['quantidade']} registros, "
+            f"arquivo tem {len(arquivo['detalhes'])}"
+        )
+    return arquivo
+
+
+def benchmark(quantidade=1_000_000):
+    """Mede a vazão de formatação de registros de detalhe; retorna registros por segundo"""
+    valores = {
+        "sequencial": 1,
+        "cnpj": "12345678000190",
+        "fornecedor": "Empresa ABC Ltda",
+        "cnpj_formatado": "12.345.678/0001-90",
+        "valor": 50000,
+        "valor_iss": 1750,
+        "dt_emissao": "20250115",
+        "dt_pagamento": "20250115",
+        "dt_competencia": "20250115",
+        "aliquota": 350,
+        "valor_iss_retido": 1750,
+    }
+    formatar = DETALHE.formatar
+    inicio = time.perf_counter()
+    for seq in range(1, quantidade + 1):
+        valores["sequencial"] = seq % 1_000_000
+        formatar(valores)
+    segundos = time.perf_counter() - inicio
+    return quantidade / segundos
+
+
+if __name__ == "__main__":
+    # Uso: python layout_registros.py [quantidade]
+    quantidade = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    por_segundo = benchmark(quantidade)
+    print(f"{quantidade} registros D formatados: {por_segundo:,.0f} registros/s "
+          f"({1_000_000 / por_segundo:.2f} s por milhão)")
@@ -0,0 +1,270 @@
+# Arquivo: manutencao.py
+"""
+Comandos de manutenção do banco de dados
+
+O start da aplicação só confere PRAGMA user_version; as rotinas abaixo, que
+varrem tabelas ou regravam dados, rodam sob demanda.
+
+Uso: python manutencao.py [--banco app_rest_gyn.db] <comando> [opções]
+
+Comandos:
+    status          Versões (schema, inicialização) e contagem das tabelas
+    inicializar     Refaz create_tables, migrações e dados padrão (--forcar mesmo se em dia)
+    duplicatas      Relatório de duplicatas (configuração, fornecedores e notas; --corrigir mescla)
+    base-calculo    Confere a tabela tb_base_calculo (registros e duplicatas)
+    agregados       Compara os agregados com o recálculo (--corrigir regrava)
+    indices-busca   Reconstrói os índices FTS5 de busca
+    planos          Confere se as consultas críticas usam índice
+    arquivar        Arquiva as competências anteriores aos últimos --manter-meses (ou só --referencia);
+                    --compactar roda VACUUM no banco principal ao final
+    restaurar       Devolve a competência --referencia arquivada para a tabela de notas
+    journal         Versão e tamanho do journal de alterações; --podar-dias N exclui as linhas mais antigas
+    desfazer        Reverte as alterações posteriores ao seq --desde (ou ao --momento UTC); --simular só conta
+    snapshot        Regera as partições desatualizadas do snapshot colunar (--referencia: só essa)
+    tudo            duplicatas, base-calculo e agregados com --corrigir, e indices-busca
+"""
+import argparse
+import os
+import sys
+import time
+
+from configuracao_log import configurar_logging
+
+
+def _status(db, args):
+    conn = db.create_connection()
+    try:
+        user_version = conn.execute("PRAGMA user_version").fetchone()[0]
+    finally:
+        conn.close()
+    from database import VERSAO_INICIALIZACAO
+
+    print(f"Banco: {db.db_file}")
+    print(f"Schema (migrações): {db.versao_schema()}")
+    print(f"Inicialização: {user_version} (atual: {VERSAO_INICIALIZACAO})")
+    for chave, valor in sorted(db.get_database_status().items()):
+        print(f"  {chave}: {valor}")
+    return 0
+
+
+def _inicializar(db, args):
+    if db.inicializacao_em_dia() and not args.forcar:
+        print("Banco já inicializado (use --forcar para refazer)")
+        return 0
+    return 0 if db.inicializar() else 1
+
+
+def _duplicatas(db, args):
+    relatorio = db.deduplicar(executar=args.corrigir)
+    if relatorio is None:
+        return 1
+    pendentes = 0
+    for tabela, item in relatorio.items():
+        if not item["excedentes"]:
+            continue
+        print(f"{tabela}: {item['excedentes']} duplicatas em {item['grupos']} grupos")
+        for exemplo in item["exemplos"][:5]:
+            print(f"  {exemplo['chave']!r}: mantém {exemplo['manter']}, duplicados {exemplo['duplicados']}")
+        for referencia, quantidade in item.get("referencias", {}).items():
+            print(f"  {referencia}: {quantidade} reapontados")
+        if "removidos" not in item:
+            pendentes += item["excedentes"]
+    if pendentes:
+        print("Use --corrigir para mesclar")
+        return 1
+    print("Duplicatas mescladas" if any(i["excedentes"] for i in relatorio.values()) else "Sem duplicatas")
+    return 0
+
+
+def _base_calculo(db, args):
+    existe, quantidade = db.verificar_tabela_base_calculo()
+    print(f"tb_base_calculo: {'existe' if existe else 'não existe'}, {quantidade} registros")
+    return 0 if existe else 1
+
+
+def _agregados(db, args):
+    divergencias = db.verificar_agregados(corrigir=args.corrigir)
+    for dimensao, chave, mantido, recalculado in divergencias:
+        print(f"DIVERGÊNCIA {dimensao}/{chave!r}: mantido={mantido} recalculado={recalculado}")
+    if divergencias and not args.corrigir:
+        return 1
+    print("Agregados corrigidos" if divergencias else "Agregados consistentes")
+    return 0
+
+
+def _indices_busca(db, args):
+    return 0 if db.reconstruir_indices_busca() else 1
+
+
+def _planos(db, args):
+    from migrations import CONSULTAS_CRITICAS
+
+    falhas = db.verificar_planos_consulta()
+    for nome, detalhe in falhas:
+        print(f"FALHA {nome}: {detalhe}")
+    if falhas:
+        return 1
+    print(f"{len(CONSULTAS_CRITICAS)} consultas críticas usando índice")
+    return 0
+
+
+def _arquivar(db, args):
+    referencias = [args.referencia] if args.referencia else db.referencias_para_arquivar(args.manter_meses)
+    codigo = 0
+    for referencia in referencias:
+        try:
+            resumo = db.arquivar_referencia(referencia)
+        except ValueError as e:
+            print(f"{referencia}: {e}")
+            codigo = 1
+            continue
+        if resumo is None:
+            codigo = 1
+            continue
+        print(f"{referencia}: {resumo['notas']} notas -> {resumo['arquivo']} ({resumo['segundos']:.2f} s)")
+    if not referencias:
+        print("Nenhuma competência para arquivar")
+    elif args.compactar:
+        conn = db.create_connection()
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        print("Banco principal compactado")
+    return codigo
+
+
+def _restaurar(db, args):
+    if not args.referencia:
+        print("Informe --referencia MM/AAAA")
+        return 1
+    try:
+        resumo = db.restaurar_referencia(args.referencia)
+    except ValueError as e:
+        print(e)
+        return 1
+    if resumo is None:
+        return 1
+    print(f"{resumo['referencia']}: {resumo['notas']} notas restauradas")
+    return 0
+
+
+def _journal(db, args):
+    if args.podar_dias is not None:
+        excluidas = db.podar_journal(args.podar_dias)
+        if excluidas is None:
+            return 1
+        print(f"{excluidas} linhas do journal excluídas (mais de {args.podar_dias} dias)")
+    feed = db.alteracoes_journal(limite=1)
+    if feed is None:
+        return 1
+    conn = db.create_connection()
+    try:
+        linhas = conn.execute("SELECT tabela, operacao, COUNT(*) FROM tb_journal GROUP BY 1, 2").fetchall()
+    finally:
+        conn.close()
+    print(f"Versão do journal: {feed['atual']}")
+    for tabela, operacao, quantidade in linhas:
+        print(f"  {tabela} {operacao}: {quantidade}")
+    return 0
+
+
+def _desfazer(db, args):
+    if args.desde is None and not args.momento:
+        print("Informe --desde SEQ ou --momento 'AAAA-MM-DD HH:MM:SS' (UTC)")
+        return 1
+    try:
+        resumo = db.desfazer_alteracoes(args.desde, args.momento, simular=args.simular)
+    except ValueError as e:
+        print(e)
+        return 1
+    if resumo is None:
+        return 1
+    acao = "seriam revertidas" if resumo["simulacao"] else "revertidas"
+    print(f"Alterações {resumo['desde'] + 1} a {resumo['ate']} {acao}: {resumo['revertidas']}")
+    return 0
+
+
+def _snapshot(db, args):
+    if args.referencia:
+        particao = db.snapshot.particao(args.referencia)
+        if particao is None:
+            return 1
+        print(f"{particao.referencia}: {particao.quantidade} notas (gerada em {particao.gerado_em})")
+        return 0
+    resumo = db.atualizar_snapshot()
+    if resumo is None:
+        return 1
+    print(f"{resumo['referencias']} referências, {resumo['geradas']} partições geradas, "
+          f"{resumo['removidas']} removidas")
+    estado = db.snapshot.stats()
+    print(f"Pasta: {db.snapshot.pasta} ({estado['particoes']} arquivos, {estado['bytes']} bytes)")
+    return 0
+
+
+def _tudo(db, args):
+    args.corrigir = True
+    codigo = 0
+    for comando in (_duplicatas, _base_calculo, _agregados, _indices_busca):
+        codigo |= comando(db, args)
+    return codigo
+
+
+COMANDOS = {
+    "status": _status,
+    "inicializar": _inicializar,
+    "duplicatas": _duplicatas,
+    "base-calculo": _base_calculo,
+    "agregados": _agregados,
+    "indices-busca": _indices_busca,
+    "planos": _planos,
+    "arquivar": _arquivar,
+    "restaurar": _restaurar,
+    "journal": _journal,
+    "desfazer": _desfazer,
+    "snapshot": _snapshot,
+    "tudo": _tudo,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python manutencao.py", description=__doc__.splitlines()[1])
+    parser.add_argument("--banco", default=os.environ.get("DB_FILE", "app_rest_gyn.db"))
+    parser.add_argument("--log", default=None, help="Nível de log (padrão: LOG_LEVEL ou INFO)")
+    parser.add_argument("comando", choices=COMANDOS)
+    parser.add_argument("--forcar", action="store_true", help="inicializar: refaz mesmo se em dia")
+    parser.add_argument(
+        "--corrigir", action="store_true",
+        help="duplicatas: mescla os registros; agregados: regrava os divergentes"
+    )
+    parser.add_argument("--referencia", help="arquivar/restaurar/snapshot: competência MM/AAAA")
+    parser.add_argument(
+        "--manter-meses", type=int, default=12,
+        help="arquivar: competências mais recentes que ficam na tabela de notas (padrão: 12)"
+    )
+    parser.add_argument("--compactar", action="store_true", help="arquivar: VACUUM no banco principal ao final")
+    parser.add_argument("--podar-dias", type=int, help="journal: exclui as linhas com mais de N dias")
+    parser.add_argument("--desde", type=int, help="desfazer: último seq do journal que fica valendo")
+    parser.add_argument("--momento", help="desfazer: momento (UTC) que fica valendo, no lugar de --desde")
+    parser.add_argument("--simular", action="store_true", help="desfazer: só conta, sem alterar")
+    args = parser.parse_args(argv)
+
+    configurar_logging(args.log)
+    import journal
+    from database import DatabaseManager
+
+    journal.definir_usuario("manutencao")
+
+    # O próprio comando decide o que inicializar
+    db = DatabaseManager(args.banco, inicializar=args.comando != "inicializar")
+    inicio = time.perf_counter()
+    try:
+        codigo = COMANDOS[args.comando](db, args)
+    finally:
+        db.pool.fechar()
+    print(f"{args.comando}: {time.perf_counter() - inicio:.2f} s", file=sys.stderr)
+    return codigo
+
+
+if __name__ == "__main__":
+    sys.exit(main())
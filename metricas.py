@@ -0,0 +1,384 @@
+# Arquivo: metricas.py
+"""
+Métricas de desempenho no formato de texto do Prometheus
+
+- http_request_duration_seconds: duração de cada requisição por rota, método e status
+- db_method_duration_seconds: duração de cada método público do DatabaseManager
+- db_statement_duration_seconds / db_statement_rows_total: tempo e linhas de cada
+  statement SQL, por operação (SELECT, INSERT, ...)
+- db_slow_statements_total: statements acima de DB_SLOW_QUERY_MS, que também são
+  registrados no log com o plano de execução (EXPLAIN QUERY PLAN)
+
+Variáveis de ambiente:
+    METRICAS          0 desliga toda a instrumentação (padrão: 1)
+    METRICAS_LINHAS   1 mede também as linhas lidas iterando o cursor (for linha in cursor),
+                      com custo em cada linha; por padrão só execute e fetch* são medidos
+    DB_SLOW_QUERY_MS  limite de statement lento em milissegundos (padrão: 200)
+"""
+import bisect
+import functools
+import inspect
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+HABILITADO = os.environ.get("METRICAS", "1") != "0"
+POR_LINHA = os.environ.get("METRICAS_LINHAS", "0") == "1"
+LIMITE_LENTO_MS = float(os.environ.get("DB_SLOW_QUERY_MS", 200))
+
+BUCKETS_PADRAO = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Operações SQL usadas como rótulo (o resto vira OUTRO, para não explodir a cardinalidade)
+OPERACOES = {"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH", "PRAGMA", "CREATE",
+             "DROP", "ALTER", "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE", "ANALYZE", "VACUUM"}
+
+# Operações que podem ser explicadas com EXPLAIN QUERY PLAN
+_EXPLICAVEIS = {"SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH"}
+
+
+def _escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _rotulos(nomes, valores, le=None):
+    pares = [f'{nome}="{_escapar(valor)}"' for nome, valor in zip(nomes, valores)]
+    if le is not None:
+        pares.append(f'le="{le}"')
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class Histograma:
+    """Histograma com rótulos, thread-safe"""
+
+    tipo = "histogram"
+
+    def __init__(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor, *rotulos):
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                serie = self._series[rotulos] = [[0] * len(self.buckets), 0, 0.0]
+            indice = bisect.bisect_left(self.buckets, valor)
+            if indice < len(self.buckets):
+                serie[0][indice] += 1
+            serie[1] += 1
+            serie[2] += valor
+
+    def linhas(self):
+        with self._lock:
+            series = {chave: (list(s[0]), s[1], s[2]) for chave, s in self._series.items()}
+        for chave, (contagens, total, soma) in sorted(series.items()):
+            acumulado = 0
+            for limite, quantidade in zip(self.buckets, contagens):
+                acumulado += quantidade
+                yield f"{self.nome}_bucket{_rotulos(self.rotulos, chave, limite)} {acumulado}"
+            yield f"{self.nome}_bucket{_rotulos(self.rotulos, chave, '+Inf')} {total}"
+            yield f"{self.nome}_sum{_rotulos(self.rotulos, chave)} {soma}"
+            yield f"{self.nome}_count{_rotulos(self.rotulos, chave)} {total}"
+
+
+class Contador:
+    """Contador com rótulos, thread-safe"""
+
+    tipo = "counter"
+
+    def __init__(self, nome, ajuda, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, valor=1, *rotulos):
+        with self._lock:
+            self._series[rotulos] = self._series.get(rotulos, 0) + valor
+
+    def linhas(self):
+        with self._lock:
+            series = dict(self._series)
+        for chave, valor in sorted(series.items()):
+            yield f"{self.nome}{_rotulos(self.rotulos, chave)} {valor}"
+
+
+class Medidor:
+    """Valor lido na hora da coleta: funcao() retorna um número ou {rótulos (tupla): número}"""
+
+    tipo = "gauge"
+
+    def __init__(self, nome, ajuda, funcao, rotulos=()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.funcao = funcao
+        self.rotulos = tuple(rotulos)
+
+    def linhas(self):
+        try:
+            valores = self.funcao()
+        except Exception as e:
+            logger.warning("Falha ao coletar %s: %s", self.nome, e)
+            return
+        if not isinstance(valores, dict):
+            valores = {(): valores}
+        for chave, valor in sorted(valores.items()):
+            yield f"{self.nome}{_rotulos(self.rotulos, chave)} {valor}"
+
+
+class Registro:
+    """Conjunto de métricas expostas em /metrics"""
+
+    def __init__(self):
+        self._metricas = {}
+        self._lock = threading.Lock()
+
+    def _registrar(self, metrica):
+        with self._lock:
+            return self._metricas.setdefault(metrica.nome, metrica)
+
+    def histograma(self, nome, ajuda, rotulos=(), buckets=BUCKETS_PADRAO):
+        return self._registrar(Histograma(nome, ajuda, rotulos, buckets))
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(nome, ajuda, rotulos))
+
+    def medidor(self, nome, ajuda, funcao, rotulos=()):
+        """Registra (ou substitui) um medidor"""
+        medidor = Medidor(nome, ajuda, funcao, rotulos)
+        with self._lock:
+            self._metricas[nome] = medidor
+        return medidor
+
+    def renderizar(self):
+        """Texto no formato de exposição do Prometheus (text/plain; version=0.0.4)"""
+        with self._lock:
+            metricas = list(self._metricas.values())
+        saida = []
+        for metrica in metricas:
+            saida.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+            saida.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            saida.extend(metrica.linhas())
+        return "\n".join(saida) + "\n"
+
+
+REGISTRO = Registro()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+HTTP_DURACAO = REGISTRO.histograma(
+    "http_request_duration_seconds", "Duração das requisições HTTP", ("rota", "metodo", "status")
+)
+DB_METODO_DURACAO = REGISTRO.histograma(
+    "db_method_duration_seconds", "Duração dos métodos do DatabaseManager", ("metodo",)
+)
+SQL_DURACAO = REGISTRO.histograma(
+    "db_statement_duration_seconds", "Duração dos statements SQL (execute + fetch)", ("operacao",)
+)
+SQL_LINHAS = REGISTRO.contador(
+    "db_statement_rows_total", "Linhas lidas ou alteradas pelos statements SQL", ("operacao",)
+)
+SQL_LENTOS = REGISTRO.contador(
+    "db_slow_statements_total", "Statements SQL acima de DB_SLOW_QUERY_MS", ("operacao",)
+)
+
+
+def operacao_sql(sql):
+    """Primeira palavra do statement em maiúsculas (SELECT, INSERT, ...) ou OUTRO"""
+    palavra = sql.lstrip(" \t\r\n(").split(None, 1)[0].upper() if sql.strip() else ""
+    return palavra if palavra in OPERACOES else "OUTRO"
+
+
+def _resumir_sql(sql, tamanho=300):
+    resumo = " ".join(sql.split())
+    return resumo if len(resumo) <= tamanho else resumo[:tamanho] + "..."
+
+
+class CursorInstrumentado(sqlite3.Cursor):
+    """
+    Cursor que mede cada statement: tempo gasto dentro de execute e dos fetch e linhas
+
+    O statement é contabilizado quando termina: logo após o execute se não retorna
+    linhas (INSERT/UPDATE/DELETE), ou quando o resultado se esgota, o cursor é
+    fechado, um novo execute começa ou o cursor é descartado.
+
+    A iteração direta (for linha in cursor) não é medida, para não somar trabalho em
+    Python a cada linha: o tempo dela e as linhas lidas ficam de fora (ver CursorPorLinha).
+    """
+    _sql = None
+    _parametros = None
+    _operacao = None
+    _tempo = 0.0
+    _linhas = 0
+
+    def _iniciar(self, sql, parametros):
+        self._finalizar()
+        self._sql = sql
+        self._parametros = parametros
+        self._operacao = operacao_sql(sql)
+        self._tempo = 0.0
+        self._linhas = 0
+
+    def _finalizar(self, linhas=None, explicar=True):
+        sql = self._sql
+        if sql is None:
+            return
+        self._sql = None
+        if linhas is not None:
+            self._linhas = linhas
+        linhas = max(self._linhas, 0)
+        SQL_DURACAO.observar(self._tempo, self._operacao)
+        SQL_LINHAS.incrementar(linhas, self._operacao)
+        milissegundos = self._tempo * 1000
+        if milissegundos >= LIMITE_LENTO_MS:
+            SQL_LENTOS.incrementar(1, self._operacao)
+            if logger.isEnabledFor(logging.WARNING):
+                plano = self._plano(sql) if explicar else None
+                logger.warning(
+                    "Statement lento (%.1f ms, %s linhas): %s%s", milissegundos, linhas, _resumir_sql(sql),
+                    "".join(f"\n    {linha}" for linha in plano) if plano else "",
+                    extra={"duracao_ms": round(milissegundos, 3), "linhas": linhas, "operacao": self._operacao},
+                )
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%.3f ms, %s linhas: %s", milissegundos, linhas, _resumir_sql(sql, 120))
+
+    def _plano(self, sql):
+        if self._operacao not in _EXPLICAVEIS or self._parametros is None:
+            return None
+        try:
+            # Cursor comum: o EXPLAIN não entra nas métricas
+            cursor = sqlite3.Cursor(self.connection)
+            linhas = cursor.execute("EXPLAIN QUERY PLAN " + sql, self._parametros).fetchall()
+            cursor.close()
+            return [linha[-1] for linha in linhas]
+        except sqlite3.Error:
+            return None
+
+    def execute(self, sql, parametros=()):
+        self._iniciar(sql, parametros)
+        inicio = time.perf_counter()
+        try:
+            super().execute(sql, parametros)
+        finally:
+            self._tempo += time.perf_counter() - inicio
+        if self.description is None:
+            self._finalizar(self.rowcount)
+        return self
+
+    def executemany(self, sql, sequencia):
+        self._iniciar(sql, None)
+        inicio = time.perf_counter()
+        try:
+            super().executemany(sql, sequencia)
+        finally:
+            self._tempo += time.perf_counter() - inicio
+        self._finalizar(self.rowcount)
+        return self
+
+    def executescript(self, script):
+        self._iniciar(script, None)
+        inicio = time.perf_counter()
+        try:
+            super().executescript(script)
+        finally:
+            self._tempo += time.perf_counter() - inicio
+        self._finalizar(0, explicar=False)
+        return self
+
+    def fetchone(self):
+        inicio = time.perf_counter()
+        linha = super().fetchone()
+        self._tempo += time.perf_counter() - inicio
+        if linha is None:
+            self._finalizar()
+        else:
+            self._linhas += 1
+        return linha
+
+    def fetchmany(self, size=None):
+        inicio = time.perf_counter()
+        linhas = super().fetchmany(self.arraysize if size is None else size)
+        self._tempo += time.perf_counter() - inicio
+        self._linhas += len(linhas)
+        if not linhas:
+            self._finalizar()
+        return linhas
+
+    def fetchall(self):
+        inicio = time.perf_counter()
+        linhas = super().fetchall()
+        self._tempo += time.perf_counter() - inicio
+        self._linhas += len(linhas)
+        self._finalizar()
+        return linhas
+
+    def close(self):
+        self._finalizar()
+        super().close()
+
+    def __del__(self):
+        # A conexão pode já ter voltado ao pool: não roda o EXPLAIN aqui
+        self._finalizar(explicar=False)
+
+
+class CursorPorLinha(CursorInstrumentado):
+    """CursorInstrumentado que mede também a iteração direta, linha a linha (METRICAS_LINHAS=1)"""
+
+    def __next__(self):
+        inicio = time.perf_counter()
+        try:
+            linha = super().__next__()
+        except StopIteration:
+            self._tempo += time.perf_counter() - inicio
+            self._finalizar()
+            raise
+        self._tempo += time.perf_counter() - inicio
+        self._linhas += 1
+        return linha
+
+
+# Cursor usado pelas conexões do pool quando as métricas estão habilitadas
+CURSOR = CursorPorLinha if POR_LINHA else CursorInstrumentado
+
+
+def instrumentar_metodos(cls, ignorar=("create_connection", "pool_stats")):
+    """
+    Decorador de classe: mede a duração de cada método público em db_method_duration_seconds
+
+    Geradores são medidos do início ao fim da iteração. Com METRICAS=0 a classe fica intacta.
+    """
+    if not HABILITADO:
+        return cls
+    for nome, funcao in list(vars(cls).items()):
+        if nome.startswith("_") or nome in ignorar or not inspect.isfunction(funcao):
+            continue
+        setattr(cls, nome, _medir_metodo(funcao, nome))
+    return cls
+
+
+def _medir_metodo(funcao, nome):
+    if inspect.isgeneratorfunction(funcao):
+        @functools.wraps(funcao)
+        def gerador(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                yield from funcao(*args, **kwargs)
+            finally:
+                DB_METODO_DURACAO.observar(time.perf_counter() - inicio, nome)
+        return gerador
+
+    @functools.wraps(funcao)
+    def medido(*args, **kwargs):
+        inicio = time.perf_counter()
+        try:
+            return funcao(*args, **kwargs)
+        finally:
+            DB_METODO_DURACAO.observar(time.perf_counter() - inicio, nome)
+    return medido
@@ -0,0 +1,430 @@
+# Arquivo: migrations.py
+"""
+Migrações versionadas do schema do banco de dados
+
+Cada migração tem um número de versão, uma descrição e uma função que recebe o
+cursor. As migrações são aplicadas em ordem, cada uma na sua própria transação,
+e registradas na tabela schema_version. Para alterar o schema basta acrescentar
+uma nova entrada no final de MIGRACOES (nunca editar uma já publicada).
+"""
+import logging
+import sys
+from datetime import datetime
+
+from deduplicacao import CNPJ_NORMALIZADO
+
+logger = logging.getLogger(__name__)
+
+
+def _colunas(cursor, tabela):
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    return {info[1] for info in cursor.fetchall()}
+
+
+def _adicionar_coluna(cursor, tabela, coluna, definicao):
+    if coluna not in _colunas(cursor, tabela):
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+
+
+def _m001_colunas_legadas(c):
+    # Colunas que antes eram criadas com ALTER TABLE ... except: pass
+    _adicionar_coluna(c, "tb_notas_fiscais", "base_calculo", "TEXT")
+    _adicionar_coluna(c, "tb_notas_fiscais", "fora_pais", "TEXT")
+    _adicionar_coluna(c, "tb_fornecedores", "fora_pais", "TEXT DEFAULT 'Não'")
+    _adicionar_coluna(c, "tb_fornecedores", "cadastrado_goiania", "TEXT DEFAULT 'Não'")
+
+
+def _m002_indices_municipios(c):
+    # Importações repetidas deixaram linhas duplicadas: mantém a primeira de cada código
+    c.execute("""
+        DELETE FROM tb_cod_municipio
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM tb_cod_municipio GROUP BY cod_municipio
+        )
+    """)
+    c.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_cod_municipio_codigo
+        ON tb_cod_municipio (cod_municipio)
+    """)
+    # Índice de cobertura para /municipios/<uf> e /cod_municipio
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS ix_cod_municipio_uf_municipio
+        ON tb_cod_municipio (UF, municipio, cod_municipio)
+    """)
+
+
+def _m003_indices_notas(c):
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS ix_notas_dt_emissao_id
+        ON tb_notas_fiscais (dt_emissao, id)
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS ix_notas_cnpj ON tb_notas_fiscais (cnpj)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_notas_fornecedor ON tb_notas_fiscais (fornecedor_id)")
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS ix_notas_referencia
+        ON tb_notas_fiscais (referencia, dt_emissao)
+    """)
+
+
+def _m004_agregados_notas(c):
+    from agregados import recalcular_agregados, sql_triggers_agregados
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_agregados_notas (
+            dimensao TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            quantidade INTEGER NOT NULL DEFAULT 0,
+            valor_centavos INTEGER NOT NULL DEFAULT 0,
+            iss_centavos INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimensao, chave)
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_contadores (
+            tabela TEXT PRIMARY KEY,
+            quantidade INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    for comando in sql_triggers_agregados():
+        c.execute(comando)
+    recalcular_agregados(c)
+
+
+def _m005_versao_dados_referencia(c):
+    from cache_referencia import TABELAS_REFERENCIA
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_versao_dados (
+            tabela TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    # Versão inicial pelo relógio: um banco recriado do zero não repete ETags antigos
+    inicial = int(datetime.now().timestamp())
+    for tabela in TABELAS_REFERENCIA:
+        c.execute("INSERT OR IGNORE INTO tb_versao_dados (tabela, versao) VALUES (?, ?)", (tabela, inicial))
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS tr_{tabela}_versao_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    UPDATE tb_versao_dados SET versao = versao + 1 WHERE tabela = '{tabela}';
+                END
+            """)
+
+
+def _m006_indices_busca(c):
+    from busca import reconstruir_indices, sql_indices_busca
+
+    for comando in sql_indices_busca():
+        c.execute(comando)
+    reconstruir_indices(c)
+
+
+def _m007_tarefas(c):
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_tarefas (
+            id TEXT PRIMARY KEY,
+            tipo TEXT NOT NULL,
+            status TEXT NOT NULL,
+            parametros TEXT,
+            processadas INTEGER NOT NULL DEFAULT 0,
+            total INTEGER,
+            cancelar INTEGER NOT NULL DEFAULT 0,
+            processo INTEGER,
+            artefato TEXT,
+            nome_artefato TEXT,
+            resultado TEXT,
+            erro TEXT,
+            criada_em TEXT NOT NULL,
+            iniciada_em TEXT,
+            concluida_em TEXT
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS ix_tarefas_status ON tb_tarefas (status, concluida_em)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_tarefas_criada ON tb_tarefas (criada_em)")
+
+
+def _m008_chave_nota(c):
+    from deduplicacao import sql_chave_nota
+
+    # Coluna gerada (VIRTUAL): sempre coerente com cnpj/numero_nf/referencia, para qualquer escritor.
+    # PRAGMA table_info não lista colunas geradas; table_xinfo sim
+    c.execute("PRAGMA table_xinfo(tb_notas_fiscais)")
+    if "chave_nota" not in {info[1] for info in c.fetchall()}:
+        c.execute(f"""
+            ALTER TABLE tb_notas_fiscais
+            ADD COLUMN chave_nota TEXT GENERATED ALWAYS AS ({sql_chave_nota()}) VIRTUAL
+        """)
+    c.execute("CREATE INDEX IF NOT EXISTS ix_notas_chave ON tb_notas_fiscais (chave_nota)")
+
+
+def _m009_versao_apuracao(c):
+    from apuracao import TABELAS_VERSIONADAS, sql_triggers_versao_referencia
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_versao_referencia (
+            referencia TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    inicial = int(datetime.now().timestamp())
+    c.execute("""
+        INSERT OR IGNORE INTO tb_versao_referencia (referencia, versao)
+        SELECT DISTINCT COALESCE(referencia, ''), ? FROM tb_notas_fiscais
+    """, (inicial,))
+    for comando in sql_triggers_versao_referencia():
+        c.execute(comando)
+
+    # Fornecedores e tomadores ganham contador como os dados de referência (migração 5)
+    for tabela in TABELAS_VERSIONADAS:
+        c.execute("INSERT OR IGNORE INTO tb_versao_dados (tabela, versao) VALUES (?, ?)", (tabela, inicial))
+        for evento in ("INSERT", "UPDATE", "DELETE"):
+            c.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS tr_{tabela}_versao_{evento.lower()}
+                AFTER {evento} ON {tabela}
+                BEGIN
+                    UPDATE tb_versao_dados SET versao = versao + 1 WHERE tabela = '{tabela}';
+                END
+            """)
+
+
+def _m010_arquivo_competencias(c):
+    from arquivamento import sql_triggers_arquivo
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_arquivo_referencias (
+            referencia TEXT PRIMARY KEY,
+            ano INTEGER NOT NULL,
+            quantidade INTEGER NOT NULL,
+            valor_centavos INTEGER NOT NULL,
+            iss_centavos INTEGER NOT NULL,
+            dt_emissao_min TEXT,
+            dt_emissao_max TEXT,
+            arquivada_em TEXT NOT NULL
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_arquivo_agregados (
+            referencia TEXT NOT NULL,
+            dimensao TEXT NOT NULL,
+            chave TEXT NOT NULL,
+            quantidade INTEGER NOT NULL,
+            valor_centavos INTEGER NOT NULL,
+            iss_centavos INTEGER NOT NULL,
+            PRIMARY KEY (referencia, dimensao, chave)
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS ix_arquivo_agregados_dimensao ON tb_arquivo_agregados (dimensao, chave)")
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_arquivo_fornecedores (
+            referencia TEXT NOT NULL,
+            fornecedor_id INTEGER NOT NULL,
+            PRIMARY KEY (fornecedor_id, referencia)
+        ) WITHOUT ROWID
+    """)
+    for comando in sql_triggers_arquivo():
+        c.execute(comando)
+
+
+def _m011_versao_exportacao(c):
+    from cache_exportacao import sql_triggers_versao_notas
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_versao_notas (
+            referencia TEXT PRIMARY KEY,
+            versao INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    c.execute("""
+        INSERT OR IGNORE INTO tb_versao_notas (referencia, versao)
+        SELECT DISTINCT COALESCE(referencia, ''), ? FROM tb_notas_fiscais
+    """, (int(datetime.now().timestamp()),))
+    for comando in sql_triggers_versao_notas():
+        c.execute(comando)
+
+
+def _m012_journal(c):
+    from journal import sql_triggers_journal
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS tb_journal (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabela TEXT NOT NULL,
+            operacao TEXT NOT NULL CHECK (operacao IN ('I', 'U', 'D')),
+            registro_id INTEGER,
+            antes TEXT,
+            depois TEXT,
+            usuario TEXT,
+            momento TEXT NOT NULL
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS ix_journal_registro ON tb_journal (tabela, registro_id, seq)")
+    c.execute("CREATE INDEX IF NOT EXISTS ix_journal_momento ON tb_journal (momento)")
+    for comando in sql_triggers_journal(c):
+        c.execute(comando)
+
+
+def _m013_email_tomador(c):
+    from journal import sql_triggers_journal
+
+    # A coluna era criada por insert_klb_tomador, depois das triggers do journal (migração 12)
+    _adicionar_coluna(c, "tb_config_tomador", "email", "TEXT")
+    for comando in sql_triggers_journal(c):
+        c.execute(comando)
+
+
+def _m014_indice_cnpj_normalizado(c):
+    # Filtro ?cnpj= das notas compara só os dígitos (montar_filtro_notas)
+    c.execute(f"""
+        CREATE INDEX IF NOT EXISTS ix_notas_cnpj_normalizado
+        ON tb_notas_fiscais ({CNPJ_NORMALIZADO.format(p="")})
+    """)
+
+
+# (versão, descrição, função)
+MIGRACOES = [
+    (1, "Colunas legadas de notas e fornecedores", _m001_colunas_legadas),
+    (2, "Chave única e índice de cobertura de municípios", _m002_indices_municipios),
+    (3, "Índices de listagem e busca de notas fiscais", _m003_indices_notas),
+    (4, "Agregados de notas e contadores mantidos por triggers", _m004_agregados_notas),
+    (5, "Contadores de versão dos dados de referência", _m005_versao_dados_referencia),
+    (6, "Índices FTS5 de busca de fornecedores, municípios e notas", _m006_indices_busca),
+    (7, "Tabela de tarefas em segundo plano (importações e exportações)", _m007_tarefas),
+    (8, "Chave normalizada de nota fiscal (detecção de duplicatas)", _m008_chave_nota),
+    (9, "Versões por referência, fornecedores e tomadores (cache da apuração)", _m009_versao_apuracao),
+    (10, "Arquivamento de competências fechadas em bancos anuais", _m010_arquivo_competencias),
+    (11, "Versões das notas por referência (cache de exportações)", _m011_versao_exportacao),
+    (12, "Journal de alterações de notas, fornecedores e tomadores", _m012_journal),
+    (13, "Coluna email do tomador (e triggers do journal com ela)", _m013_email_tomador),
+    (14, "Índice do CNPJ da nota só com dígitos (filtro por CNPJ)", _m014_indice_cnpj_normalizado),
+]
+
+VERSAO_ATUAL = MIGRACOES[-1][0]
+
+
+def versao_schema(conn):
+    """Retorna a última versão de migração aplicada (0 se nenhuma)"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            versao INTEGER PRIMARY KEY,
+            descricao TEXT NOT NULL,
+            aplicada_em TEXT NOT NULL
+        )
+    """)
+    row = conn.execute("SELECT MAX(versao) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def aplicar_migracoes(conn):
+    """
+    Aplica, em ordem, as migrações ainda não registradas em schema_version
+
+    Cada migração roda em uma transação BEGIN IMMEDIATE; se dois processos
+    iniciarem juntos, o segundo espera o primeiro e não reaplica nada.
+
+    :return: Lista das versões aplicadas nesta chamada
+    """
+    aplicadas = []
+    versao = versao_schema(conn)
+    conn.commit()
+
+    for numero, descricao, migracao in MIGRACOES:
+        if numero <= versao:
+            continue
+
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            # Outro processo pode ter aplicado enquanto esperávamos o lock
+            c.execute("SELECT 1 FROM schema_version WHERE versao = ?", (numero,))
+            if c.fetchone():
+                conn.commit()
+                continue
+
+            migracao(c)
+            c.execute(
+                "INSERT INTO schema_version (versao, descricao, aplicada_em) VALUES (?, ?, ?)",
+                (numero, descricao, datetime.now().isoformat(timespec="seconds"))
+            )
+            conn.commit()
+            aplicadas.append(numero)
+            logger.info("Migração %s aplicada: %s", numero, descricao)
+        except Exception:
+            conn.rollback()
+            raise
+
+    return aplicadas
+
+
+# Consultas quentes que nunca devem cair em varredura completa da tabela.
+# (nome, sql, parâmetros)
+CONSULTAS_CRITICAS = [
+    ("municipios_por_uf",
+     "SELECT municipio, cod_municipio FROM tb_cod_municipio WHERE UF = ? ORDER BY municipio",
+     ("GO",)),
+    ("cod_municipio",
+     "SELECT cod_municipio FROM tb_cod_municipio WHERE UF = ? AND municipio = ?",
+     ("GO", "GOIANIA")),
+    ("fornecedor_por_cnpj",
+     "SELECT descricao_fornecedor, UF, municipio, cod_municipio FROM tb_fornecedores WHERE CNPJ = ?",
+     ("00000000000000",)),
+    ("recolhimento_por_descricao",
+     "SELECT id FROM tb_tipo_de_recolhimento WHERE recolhimento = ?",
+     ("Recolhimento",)),
+    ("notas_listagem",
+     """SELECT nf.id, f.descricao_fornecedor, tr.recolhimento
+        FROM tb_notas_fiscais nf
+        LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+        LEFT JOIN tb_tipo_de_recolhimento tr ON nf.recolhimento_id = tr.id
+        ORDER BY nf.dt_emissao DESC, nf.id DESC LIMIT 100""",
+     ()),
+    ("notas_por_referencia",
+     """SELECT nf.id FROM tb_notas_fiscais nf
+        WHERE nf.referencia = ? ORDER BY nf.dt_emissao DESC, nf.id DESC LIMIT 100""",
+     ("01/2025",)),
+    ("notas_por_cnpj",
+     # Mesma expressão do índice da migração 14 e de montar_filtro_notas
+     f"SELECT nf.id FROM tb_notas_fiscais nf WHERE {CNPJ_NORMALIZADO.format(p='nf.')} = ?",
+     ("00000000000000",)),
+    ("notas_por_fornecedor",
+     "SELECT COUNT(*) FROM tb_notas_fiscais WHERE fornecedor_id = ?",
+     (1,)),
+]
+
+
+def verificar_planos_consulta(conn):
+    """
+    Roda EXPLAIN QUERY PLAN nas consultas críticas
+
+    Uma consulta falha quando o plano contém uma varredura completa de tabela
+    (SCAN sem USING INDEX) ou uma ordenação em B-tree temporária.
+    Use uma conexão sem cache de statements: um EXPLAIN já preparado não é
+    recompilado quando outro processo cria ou remove índices.
+
+    :return: Lista de tuplas (nome, detalhe do plano) com as falhas encontradas
+    """
+    falhas = []
+    for nome, sql, params in CONSULTAS_CRITICAS:
+        for linha in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall():
+            detalhe = linha[-1]
+            varredura = detalhe.startswith("SCAN") and "USING" not in detalhe
+            if varredura or "USE TEMP B-TREE" in detalhe:
+                falhas.append((nome, detalhe))
+    return falhas
+
+
+if __name__ == "__main__":
+    # Uso: python migrations.py [caminho_do_banco] [--verificar-planos]
+    from database import DatabaseManager
+
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    db = DatabaseManager(*args[:1])
+
+    if "--verificar-planos" in sys.argv:
+        falhas = db.verificar_planos_consulta()
+        for nome, detalhe in falhas:
+            print(f"FALHA {nome}: {detalhe}")
+        if falhas:
+            sys.exit(1)
+        print(f"{len(CONSULTAS_CRITICAS)} consultas críticas usando índice")
@@ -0,0 +1,207 @@
+# Arquivo: operacoes_lote.py
+"""
+Exclusão e atualização em lote de notas fiscais, fornecedores e tomadores
+
+O alvo é um filtro (os de montar_filtro_notas) ou uma lista de IDs, nunca a
+tabela inteira por omissão (para isso existem os limpar_*). Os IDs alvo são
+materializados em uma tabela temporária (a lista recebida entra com
+executemany) e a alteração é um único UPDATE/DELETE sobre ela, em uma
+transação BEGIN IMMEDIATE. Assim um filtro sobre uma coluna alterada pelo
+próprio UPDATE (ex.: mudar a referência) não muda o alvo no meio da operação.
+
+Simulação: a exclusão só conta o alvo; a atualização é executada e desfeita,
+então a contagem e a verificação de duplicatas são as da operação real.
+"""
+from database import CAMPOS_NOTA, mapear_campos_nota, montar_atualizacao_nota, montar_filtro_notas
+from deduplicacao import MENSAGEM_DUPLICADA
+
+# Filtros aceitos para notas (montar_filtro_notas). Chave desconhecida é erro:
+# um filtro ignorado por engano ampliaria o alvo de uma exclusão.
+FILTROS_NOTAS = {"referencia", "cnpj", "fornecedor_id", "fornecedor", "dt_inicio", "dt_fim", "recolhimento"}
+FILTROS_FORNECEDORES = {"uf", "municipio", "sem_notas"}
+
+# Alterar estes campos pode fazer notas coincidirem com outras (mesma chave_nota)
+CAMPOS_CHAVE_NOTA = {"cnpj", "numero_nf", "referencia"}
+
+
+def _validar_alvo(filtros, ids, aceitos):
+    filtros = {chave: valor for chave, valor in (filtros or {}).items() if valor not in (None, "")}
+    desconhecidos = set(filtros) - aceitos
+    if desconhecidos:
+        raise ValueError(f"Filtros desconhecidos: {', '.join(sorted(desconhecidos))}")
+    if ids is not None:
+        try:
+            ids = sorted({int(id_) for id_ in ids})
+        except (TypeError, ValueError):
+            raise ValueError("A lista de IDs deve conter apenas números inteiros")
+    if not filtros and not ids:
+        raise ValueError("Informe um filtro ou uma lista de IDs")
+    return filtros, ids
+
+
+def _materializar(cursor, tabela, sql_alvo, params, ids):
+    """Preenche temp._lote_ids com os IDs alvo (filtro e/ou lista) e devolve a quantidade"""
+    cursor.execute("DROP TABLE IF EXISTS temp._lote_ids")
+    cursor.execute("CREATE TEMP TABLE _lote_ids (id INTEGER PRIMARY KEY)")
+    if ids:
+        cursor.executemany("INSERT INTO temp._lote_ids (id) VALUES (?)", ((id_,) for id_ in ids))
+        # Só os IDs que existem (e que atendem ao filtro, se houver)
+        cursor.execute(f"""
+            DELETE FROM temp._lote_ids
+            WHERE id NOT IN ({sql_alvo if sql_alvo else f"SELECT id FROM {tabela}"})
+        """, params)
+    else:
+        cursor.execute(f"INSERT INTO temp._lote_ids (id) {sql_alvo}", params)
+    return cursor.execute("SELECT COUNT(*) FROM temp._lote_ids").fetchone()[0]
+
+
+def _alvo_notas(filtros):
+    condicoes, params = montar_filtro_notas(filtros)
+    if not condicoes:
+        return "", []
+    return f"""
+        SELECT nf.id FROM tb_notas_fiscais nf
+        LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+        WHERE {' AND '.join(condicoes)}
+    """, params
+
+
+def _executar(conn, operacao, simular):
+    """Roda operacao(cursor) em BEGIN IMMEDIATE; confirma, ou desfaz se for simulação"""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        resultado = operacao(cursor)
+        cursor.execute("DROP TABLE IF EXISTS temp._lote_ids")
+        if simular:
+            conn.rollback()
+        else:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    resultado["simulacao"] = bool(simular)
+    return resultado
+
+
+def excluir_notas(conn, filtros=None, ids=None, simular=False):
+    """
+    Exclui as notas do filtro e/ou da lista de IDs
+
+    :param conn: Conexão do pool (não é fechada aqui)
+    :return: {"afetadas", "simulacao"}
+    :raises ValueError: se o alvo estiver vazio ou tiver filtro desconhecido
+    """
+    filtros, ids = _validar_alvo(filtros, ids, FILTROS_NOTAS)
+
+    def operacao(cursor):
+        afetadas = _materializar(cursor, "tb_notas_fiscais", *_alvo_notas(filtros), ids)
+        if not simular and afetadas:
+            cursor.execute("DELETE FROM tb_notas_fiscais WHERE id IN (SELECT id FROM temp._lote_ids)")
+            afetadas = cursor.rowcount
+        return {"afetadas": afetadas}
+
+    return _executar(conn, operacao, simular)
+
+
+def atualizar_notas(conn, dados, filtros=None, ids=None, simular=False, permitir_duplicadas=False):
+    """
+    Aplica o mesmo patch de campos a todas as notas do filtro e/ou da lista de IDs
+
+    :param dados: Campos a alterar, por nome do formulário ou da coluna (ver database.CAMPOS_NOTA)
+    :param permitir_duplicadas: Se False, desfaz tudo quando alguma nota alterada ficar com a
+        mesma chave (CNPJ, número e referência) de outra
+    :return: {"afetadas", "campos", "simulacao"}
+    :raises ValueError: alvo ou patch inválidos, ou duplicatas geradas
+    """
+    filtros, ids = _validar_alvo(filtros, ids, FILTROS_NOTAS)
+    campos = mapear_campos_nota(dados or {})
+    if not campos:
+        aceitos = ", ".join(sorted(set(CAMPOS_NOTA.values())))
+        raise ValueError(f"Nenhum campo válido para atualizar (aceitos: {aceitos})")
+    atribuicoes, params_set = montar_atualizacao_nota(campos)
+
+    def operacao(cursor):
+        afetadas = _materializar(cursor, "tb_notas_fiscais", *_alvo_notas(filtros), ids)
+        if afetadas:
+            cursor.execute(
+                f"UPDATE tb_notas_fiscais SET {', '.join(atribuicoes)} "
+                "WHERE id IN (SELECT id FROM temp._lote_ids)",
+                params_set
+            )
+            afetadas = cursor.rowcount
+            if not permitir_duplicadas and CAMPOS_CHAVE_NOTA & set(campos):
+                duplicadas = cursor.execute("""
+                    SELECT COUNT(*) FROM tb_notas_fiscais nf
+                    WHERE nf.id IN (SELECT id FROM temp._lote_ids)
+                      AND nf.chave_nota IS NOT NULL
+                      AND EXISTS (
+                          SELECT 1 FROM tb_notas_fiscais outra
+                          WHERE outra.chave_nota = nf.chave_nota AND outra.id != nf.id
+                      )
+                """).fetchone()[0]
+                if duplicadas:
+                    raise ValueError(f"{duplicadas} notas ficariam duplicadas: {MENSAGEM_DUPLICADA}")
+        return {"afetadas": afetadas, "campos": sorted(campos)}
+
+    return _executar(conn, operacao, simular)
+
+
+def excluir_fornecedores(conn, filtros=None, ids=None, simular=False):
+    """
+    Exclui os fornecedores do filtro (uf, municipio, sem_notas) e/ou da lista de IDs
+
+    Fornecedores com notas vinculadas (inclusive arquivadas) nunca são excluídos; aparecem em "bloqueados".
+
+    :return: {"afetadas", "bloqueados", "simulacao"}
+    """
+    filtros, ids = _validar_alvo(filtros, ids, FILTROS_FORNECEDORES)
+    condicoes, params = [], []
+    if filtros.get("uf"):
+        condicoes.append("UF = ?")
+        params.append(filtros["uf"])
+    if filtros.get("municipio"):
+        condicoes.append("municipio = ?")
+        params.append(filtros["municipio"])
+    if filtros.get("sem_notas"):
+        condicoes.append("id NOT IN (SELECT fornecedor_id FROM tb_notas_fiscais WHERE fornecedor_id IS NOT NULL)")
+        condicoes.append("id NOT IN (SELECT fornecedor_id FROM tb_arquivo_fornecedores)")
+    sql_alvo = f"SELECT id FROM tb_fornecedores WHERE {' AND '.join(condicoes)}" if condicoes else ""
+
+    def operacao(cursor):
+        alvo = _materializar(cursor, "tb_fornecedores", sql_alvo, params, ids)
+        bloqueados = cursor.execute("""
+            SELECT COUNT(*) FROM temp._lote_ids l
+            WHERE EXISTS (SELECT 1 FROM tb_notas_fiscais nf WHERE nf.fornecedor_id = l.id)
+               OR EXISTS (SELECT 1 FROM tb_arquivo_fornecedores a WHERE a.fornecedor_id = l.id)
+        """).fetchone()[0]
+        afetadas = alvo - bloqueados
+        if not simular and afetadas:
+            cursor.execute("""
+                DELETE FROM tb_fornecedores
+                WHERE id IN (SELECT id FROM temp._lote_ids)
+                  AND NOT EXISTS (SELECT 1 FROM tb_notas_fiscais nf WHERE nf.fornecedor_id = tb_fornecedores.id)
+                  AND NOT EXISTS (SELECT 1 FROM tb_arquivo_fornecedores a WHERE a.fornecedor_id = tb_fornecedores.id)
+            """)
+            afetadas = cursor.rowcount
+        return {"afetadas": afetadas, "bloqueados": bloqueados}
+
+    return _executar(conn, operacao, simular)
+
+
+def excluir_tomadores(conn, ids, simular=False):
+    """
+    Exclui os tomadores da lista de IDs
+
+    :return: {"afetadas", "simulacao"}
+    """
+    _, ids = _validar_alvo(None, ids, set())
+
+    def operacao(cursor):
+        afetadas = _materializar(cursor, "tb_config_tomador", "", [], ids)
+        if not simular and afetadas:
+            cursor.execute("DELETE FROM tb_config_tomador WHERE id IN (SELECT id FROM temp._lote_ids)")
+            afetadas = cursor.rowcount
+        return {"afetadas": afetadas}
+
+    return _executar(conn, operacao, simular)
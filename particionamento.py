@@ -0,0 +1,283 @@
+# Arquivo: particionamento.py
+"""
+Partições por tomador: um arquivo SQLite por tomador
+
+O banco principal (comum) continua com o cadastro de tomadores e os dados de
+referência (UFs, municípios, tipos de serviço, bases de cálculo e tipos de
+recolhimento), que só ele altera. Cada tomador tem um arquivo próprio com as
+suas notas e os seus fornecedores, aberto sob demanda como um DatabaseManager
+com pool próprio: cada arquivo tem o seu lock de escrita, então a carga de
+um tomador não bloqueia os demais.
+
+Cada partição guarda uma cópia das tabelas de referência e da linha do seu
+tomador (mesmos ids do banco comum), para que joins, triggers, FTS e a
+exportação funcionem com o arquivo sozinho. A cópia é refeita (ATTACH do
+banco comum + DELETE/INSERT em uma transação) quando mudam, no banco comum,
+os contadores de tb_versao_dados das tabelas copiadas (TABELAS_SINCRONIZADAS);
+o cache de referência em memória das partições é o do banco comum.
+
+Excluir um tomador do cadastro não apaga o arquivo da partição: ele só deixa
+de ser aberto e de entrar nos relatórios.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import journal
+from cache_referencia import TABELAS_REFERENCIA
+
+logger = logging.getLogger(__name__)
+
+# Contadores de tb_versao_dados que disparam uma nova cópia para as partições
+TABELAS_SINCRONIZADAS = TABELAS_REFERENCIA + ("tb_config_tomador",)
+
+# Totais da apuração somados no relatório consolidado
+CAMPOS_APURACAO_RELATORIO = (
+    "quantidade", "valor_centavos", "iss_devido_centavos", "iss_retido_centavos",
+    "iss_prestador_centavos", "iss_bruto_centavos",
+)
+CAMPOS_ESTATISTICAS_RELATORIO = ("total_notas", "total_fornecedores", "valor_total", "valor_iss")
+
+
+def _colunas(cursor, esquema, tabela):
+    return [linha[1] for linha in cursor.execute(f"PRAGMA {esquema}.table_info({tabela})").fetchall()]
+
+
+def sincronizar(conn, arquivo_comum, tomador_id):
+    """
+    Copia as tabelas de referência e a linha do tomador do banco comum para a partição
+
+    :param conn: Conexão da partição (não é fechada aqui)
+    :return: True se o tomador existe no banco comum; False (nada é alterado) caso contrário
+    """
+    cursor = conn.cursor()
+    cursor.execute("ATTACH DATABASE ? AS comum", (arquivo_comum,))
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            if cursor.execute("SELECT 1 FROM comum.tb_config_tomador WHERE id = ?", (tomador_id,)).fetchone() is None:
+                conn.rollback()
+                return False
+            for tabela in TABELAS_SINCRONIZADAS:
+                comuns = set(_colunas(cursor, "comum", tabela))
+                colunas = ", ".join(c for c in _colunas(cursor, "main", tabela) if c in comuns)
+                filtro = "WHERE id = ?" if tabela == "tb_config_tomador" else ""
+                cursor.execute(f"DELETE FROM main.{tabela}")
+                cursor.execute(
+                    f"INSERT INTO main.{tabela} ({colunas}) SELECT {colunas} FROM comum.{tabela} {filtro}",
+                    (tomador_id,) if filtro else ()
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        cursor.execute("DETACH DATABASE comum")
+    return True
+
+
+class GerenciadorParticoes:
+    """
+    Abre, sincroniza e mantém em cache (LRU) os DatabaseManager das partições
+
+    :param comum: DatabaseManager do banco comum
+    :param pasta: Pasta dos arquivos (padrão: <banco comum>_tomadores ao lado dele)
+    :param maximo_abertas: Partições com pool aberto ao mesmo tempo; a menos usada é fechada
+    """
+
+    def __init__(self, comum, pasta=None, pool_size=3, maximo_abertas=32, max_workers=8):
+        self.comum = comum
+        self.pasta = pasta or os.path.splitext(comum.db_file)[0] + "_tomadores"
+        self.pool_size = pool_size
+        self.maximo_abertas = maximo_abertas
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._abertas = OrderedDict()  # tomador_id -> DatabaseManager
+        self._versoes = {}  # tomador_id -> versões do banco comum na última cópia
+        self._locks = {}  # tomador_id -> lock da abertura e da cópia da partição
+
+    def caminho(self, tomador_id):
+        return os.path.join(self.pasta, f"tomador_{int(tomador_id)}.db")
+
+    def existe(self, tomador_id):
+        return os.path.exists(self.caminho(tomador_id))
+
+    def obter(self, tomador_id):
+        """
+        DatabaseManager da partição do tomador, criando o arquivo na primeira vez
+
+        O lock geral só protege o cache (busca e ordem LRU); abrir e sincronizar a
+        partição usa o lock dela, então tomadores diferentes não esperam um pelo outro.
+
+        :raises ValueError: se o tomador não estiver cadastrado no banco comum
+        """
+        from database import DatabaseManager
+
+        tomador_id = int(tomador_id)
+        # Só as tabelas copiadas para a partição: gravar fornecedores no comum não dispara cópia
+        versoes = {
+            tabela: versao for tabela, versao in self.comum.referencias.versoes().items()
+            if tabela in TABELAS_SINCRONIZADAS
+        }
+        banco = self._em_dia(tomador_id, versoes)
+        if banco is not None:
+            return banco
+
+        with self._lock:
+            lock_particao = self._locks.setdefault(tomador_id, threading.Lock())
+        with lock_particao:
+            # Outra thread pode ter aberto ou sincronizado enquanto esta esperava
+            banco = self._em_dia(tomador_id, versoes)
+            if banco is not None:
+                return banco
+            with self._lock:
+                banco = self._abertas.get(tomador_id)
+            nova = banco is None
+            if nova:
+                if self.comum.get_tomador_by_id(tomador_id) is None:
+                    raise ValueError(f"Tomador {tomador_id} não encontrado")
+                inicio = time.perf_counter()
+                banco = DatabaseManager(
+                    self.caminho(tomador_id), pool_size=self.pool_size,
+                    pragmas=self.comum.pool.pragmas, tomador_id=tomador_id
+                )
+                # Listas e códigos de referência vêm do banco comum
+                banco.referencias = self.comum.referencias
+                logger.info("Partição do tomador %s aberta em %.1f ms", tomador_id,
+                            (time.perf_counter() - inicio) * 1000)
+
+            conn = banco.create_connection()
+            if conn is None:
+                if nova:
+                    banco.pool.fechar()
+                raise ValueError(f"Não foi possível abrir a partição do tomador {tomador_id}")
+            try:
+                # A cópia do cadastro não entra no journal da partição (o original está no comum)
+                with journal.suspenso(conn):
+                    existe = sincronizar(conn, self.comum.db_file, tomador_id)
+            except Exception:
+                if nova:
+                    banco.pool.fechar()
+                raise
+            finally:
+                conn.close()
+
+            with self._lock:
+                if not existe:
+                    if nova:
+                        banco.pool.fechar()
+                    else:
+                        self._fechar(tomador_id)
+                    raise ValueError(f"Tomador {tomador_id} não encontrado")
+                self._abertas[tomador_id] = banco
+                self._abertas.move_to_end(tomador_id)
+                self._versoes[tomador_id] = versoes
+                self._fechar_excedentes()
+            return banco
+
+    def _em_dia(self, tomador_id, versoes):
+        # Partição aberta e copiada com as versões atuais (marca como usada); senão None
+        with self._lock:
+            banco = self._abertas.get(tomador_id)
+            if banco is None:
+                return None
+            self._abertas.move_to_end(tomador_id)
+            return banco if self._versoes.get(tomador_id) == versoes else None
+
+    def _fechar(self, tomador_id):
+        banco = self._abertas.pop(tomador_id, None)
+        self._versoes.pop(tomador_id, None)
+        if banco is not None:
+            banco.pool.fechar()
+
+    def _fechar_excedentes(self):
+        while len(self._abertas) > self.maximo_abertas:
+            self._fechar(next(iter(self._abertas)))
+
+    def fechar(self):
+        """Fecha as conexões ociosas de todas as partições abertas"""
+        with self._lock:
+            for tomador_id in list(self._abertas):
+                self._fechar(tomador_id)
+
+    def tomadores_com_particao(self):
+        """Tomadores cadastrados (com razão social) que já têm arquivo de partição"""
+        return [
+            tomador for tomador in self.comum.get_all_tomadores()
+            if tomador[1] and self.existe(tomador[0])
+        ]
+
+    def executar_em_todas(self, funcao, tomadores=None):
+        """
+        Executa funcao(banco) em cada partição, em paralelo
+
+        :param tomadores: IDs dos tomadores (padrão: todos com partição)
+        :return: Lista de (tomador_id, resultado, erro) na ordem dos tomadores
+        """
+        if tomadores is None:
+            tomadores = [tomador[0] for tomador in self.tomadores_com_particao()]
+
+        def executar(tomador_id):
+            try:
+                return tomador_id, funcao(self.obter(tomador_id)), None
+            except Exception as e:
+                logger.error("Erro na partição do tomador %s: %s", tomador_id, e)
+                return tomador_id, None, str(e)
+
+        if not tomadores:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tomadores))) as executor:
+            return list(executor.map(executar, tomadores))
+
+    def relatorio(self, referencia=None, tomadores=None):
+        """
+        Estatísticas (e apuração da referência, se informada) de cada tomador e o consolidado
+
+        :return: {"referencia", "tomadores": [...], "total": {...}, "erros": [...], "segundos"}
+        :raises ValueError: se algum dos tomadores pedidos não tiver partição
+        """
+        inicio = time.perf_counter()
+        cadastro = {tomador[0]: tomador for tomador in self.tomadores_com_particao()}
+        if tomadores is not None:
+            sem_particao = [str(t) for t in tomadores if t not in cadastro]
+            if sem_particao:
+                raise ValueError(f"Tomadores sem partição: {', '.join(sem_particao)}")
+
+        def coletar(banco):
+            dados = {"estatisticas": banco.get_estatisticas()}
+            if referencia:
+                apuracao = banco.apurar(referencia)
+                dados["apuracao"] = {campo: apuracao[campo] for campo in CAMPOS_APURACAO_RELATORIO}
+            return dados
+
+        total = dict.fromkeys(CAMPOS_ESTATISTICAS_RELATORIO, 0)
+        if referencia:
+            total.update(dict.fromkeys(CAMPOS_APURACAO_RELATORIO, 0))
+        linhas, erros = [], []
+        for tomador_id, dados, erro in self.executar_em_todas(coletar, tomadores):
+            if erro is not None:
+                erros.append({"tomador_id": tomador_id, "erro": erro})
+                continue
+            linhas.append({"tomador": {"id": tomador_id, "razao_social": cadastro[tomador_id][1],
+                                       "cnpj": cadastro[tomador_id][2]}, **dados})
+            for campo in CAMPOS_ESTATISTICAS_RELATORIO:
+                total[campo] += (dados["estatisticas"] or {}).get(campo, 0)
+            for campo in CAMPOS_APURACAO_RELATORIO if referencia else ():
+                total[campo] += dados["apuracao"][campo]
+        for campo in ("valor_total", "valor_iss"):
+            total[campo] = round(total[campo], 2)
+
+        return {
+            "referencia": referencia or None,
+            "tomadores": linhas,
+            "total": total,
+            "erros": erros,
+            "segundos": round(time.perf_counter() - inicio, 4),
+        }
+
+    def stats(self):
+        with self._lock:
+            return {"abertas": len(self._abertas), "maximo_abertas": self.maximo_abertas, "pasta": self.pasta}
@@ -0,0 +1,553 @@
+# Arquivo: snapshot_colunar.py
+"""
+Snapshot colunar das notas fiscais para relatórios e análises
+
+As notas de cada referência, já unidas a fornecedores e tipos de recolhimento,
+são materializadas num arquivo por competência (<banco>_snapshot/<referência>.colunas)
+com uma coluna por bloco contíguo, no layout dos arrays NumPy:
+
+- datas como datetime64[D] (NaT quando vazia ou inválida);
+- valor, alíquota e ISS em inteiros (centavos e centésimos de ponto
+  percentual), arredondados como nos agregados e na apuração;
+- indicadores Sim/Não como bool;
+- textos codificados em dicionário (códigos int32; os valores distintos
+  ficam no cabeçalho).
+
+O arquivo é lido com mmap e os arrays apontam direto para as páginas mapeadas
+(np.frombuffer): nada é copiado nem convertido na leitura, e as páginas são
+compartilhadas entre as threads e os processos do servidor. A leitura não
+segura transação no banco, então não disputa nada com quem grava notas.
+
+Cada partição guarda a versão dos dados de que foi gerada: o contador da
+referência em tb_versao_notas (migração 11) e os de fornecedores e tipos de
+recolhimento em tb_versao_dados. Quem pede uma partição desatualizada a
+regenera na hora (só aquela competência); atualizar() faz o mesmo para todas,
+e pode rodar periodicamente numa thread (iniciar). Competências arquivadas
+são lidas do arquivo anual e, como não mudam, só são geradas uma vez.
+
+O arquivo novo é gravado ao lado e trocado com os.replace: leitores com a
+versão anterior mapeada continuam lendo-a até soltá-la.
+"""
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from urllib.parse import quote, unquote
+
+from agregados import CENTAVOS_ISS
+
+logger = logging.getLogger(__name__)
+
+# Incrementar quando o layout ou as colunas mudarem (as partições antigas são regeradas)
+VERSAO_FORMATO = 1
+
+MAGIA = b"NFCOLUN\x01"
+ALINHAMENTO = 64
+EXTENSAO = ".colunas"
+
+# Tabelas (além das notas) cujo contador em tb_versao_dados entra na versão da partição
+TABELAS_VERSIONADAS = ("tb_fornecedores", "tb_tipo_de_recolhimento")
+
+# (coluna, tipo, expressão SQL) — tipo: "int64", "bool", "data" ou "texto" (dicionário)
+COLUNAS = [
+    ("id", "int64", "nf.id"),
+    ("dt_emissao", "data", "CAST(julianday(substr(nf.dt_emissao, 1, 10)) - 2440587.5 AS INTEGER)"),
+    ("dt_pagamento", "data", "CAST(julianday(substr(nf.dt_pagamento, 1, 10)) - 2440587.5 AS INTEGER)"),
+    # Mesmo arredondamento da apuração (meio para longe do zero sobre o valor REAL)
+    ("valor_centavos", "int64", "CAST(ROUND(COALESCE(CAST(nf.valor_nf AS REAL), 0) * 100) AS INTEGER)"),
+    ("valor_nulo", "bool", "nf.valor_nf IS NULL"),
+    ("aliquota_centesimos", "int64", "CAST(ROUND(COALESCE(CAST(nf.aliquota AS REAL), 0) * 100) AS INTEGER)"),
+    # ISS como nos agregados (valor x alíquota, arredondado uma vez)
+    ("iss_centavos", "int64", CENTAVOS_ISS.format(p="nf.")),
+    ("fora_pais", "bool", "UPPER(SUBSTR(TRIM(COALESCE(nf.fora_pais, '')), 1, 1)) = 'S'"),
+    ("cadastrado_goiania", "bool", "UPPER(SUBSTR(TRIM(COALESCE(nf.cadastrado_goiania, '')), 1, 1)) = 'S'"),
+    ("cnpj", "texto", "nf.cnpj"),
+    ("fornecedor", "texto", "f.descricao_fornecedor"),
+    ("uf", "texto", "nf.uf"),
+    ("tipo_servico", "texto", "nf.tipo_servico"),
+    ("base_calculo", "texto", "nf.base_calculo"),
+    ("recolhimento", "texto", "tr.recolhimento"),
+]
+
+DTYPES = {"int64": "<i8", "bool": "|b1", "data": "<M8[D]", "texto": "<i4"}
+
+SQL_PARTICAO = """
+    SELECT {colunas}
+    FROM tb_notas_fiscais nf
+    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+    LEFT JOIN tb_tipo_de_recolhimento tr ON nf.recolhimento_id = tr.id
+    WHERE {condicao}
+    ORDER BY nf.id
+"""
+
+# dimensão -> descrição; quebras que os agregados (por trigger) não têm
+DIMENSOES = {
+    "mes_emissao": "Mês de emissão (AAAA-MM)",
+    "mes_pagamento": "Mês de pagamento (AAAA-MM)",
+    "fornecedor": "CNPJ do prestador",
+}
+
+
+def versao(conn, referencia):
+    """Versão dos dados da partição: contador da referência, de fornecedores e de recolhimentos"""
+    notas = conn.execute("SELECT versao FROM tb_versao_notas WHERE referencia = ?", (referencia,)).fetchone()
+    tabelas = conn.execute(
+        f"SELECT tabela, versao FROM tb_versao_dados WHERE tabela IN ({', '.join('?' * len(TABELAS_VERSIONADAS))})"
+        " ORDER BY tabela",
+        TABELAS_VERSIONADAS
+    ).fetchall()
+    return [VERSAO_FORMATO, notas[0] if notas else None, [list(linha) for linha in tabelas]]
+
+
+def referencias(conn):
+    """Referências com notas: as da tabela quente (pelos agregados) e as arquivadas"""
+    return [linha[0] for linha in conn.execute("""
+        SELECT chave FROM tb_agregados_notas WHERE dimensao = 'referencia' AND quantidade > 0
+        UNION
+        SELECT referencia FROM tb_arquivo_referencias
+        ORDER BY 1
+    """)]
+
+
+def _alinhar(posicao):
+    return -posicao % ALINHAMENTO
+
+
+def gravar(caminho, cabecalho, arrays):
+    """
+    Grava as colunas no layout do arquivo: MAGIA, tamanho do cabeçalho (uint64),
+    cabeçalho JSON e os blocos das colunas, cada um alinhado em 64 bytes
+
+    :param arrays: Lista de (nome, array NumPy) na ordem das colunas
+    """
+    colunas = []
+    inicio = 0
+    for nome, array in arrays:
+        inicio += _alinhar(inicio)
+        colunas.append({"nome": nome, "dtype": array.dtype.str, "inicio": inicio, "quantidade": len(array)})
+        inicio += array.nbytes
+    bruto = json.dumps({**cabecalho, "colunas": colunas}, ensure_ascii=False).encode("utf-8")
+
+    with open(caminho, "wb") as arquivo:
+        arquivo.write(MAGIA + struct.pack("<Q", len(bruto)) + bruto)
+        arquivo.write(b"\0" * _alinhar(arquivo.tell()))
+        base = arquivo.tell()
+        for coluna, (_, array) in zip(colunas, arrays):
+            arquivo.write(b"\0" * (base + coluna["inicio"] - arquivo.tell()))
+            arquivo.write(array.tobytes())
+        arquivo.flush()
+        os.fsync(arquivo.fileno())
+
+
+class Particao:
+    """
+    Partição de uma referência mapeada em memória
+
+    colunas: {nome: array somente leitura sobre o mmap}; nas colunas de texto o
+    array tem os códigos e dicionarios[nome] os valores.
+    """
+
+    def __init__(self, caminho):
+        import numpy as np
+
+        with open(caminho, "rb") as arquivo:
+            self._mmap = mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIA)] != MAGIA:
+            raise ValueError(f"Arquivo de snapshot inválido: {caminho}")
+        (tamanho,) = struct.unpack_from("<Q", self._mmap, len(MAGIA))
+        inicio = len(MAGIA) + 8
+        cabecalho = json.loads(self._mmap[inicio:inicio + tamanho].decode("utf-8"))
+        base = inicio + tamanho + _alinhar(inicio + tamanho)
+
+        self.caminho = caminho
+        self.referencia = cabecalho["referencia"]
+        self.versao = cabecalho["versao"]
+        self.quantidade = cabecalho["quantidade"]
+        self.gerado_em = cabecalho["gerado_em"]
+        self.dicionarios = cabecalho["dicionarios"]
+        self.colunas = {
+            coluna["nome"]: np.frombuffer(
+                self._mmap, dtype=coluna["dtype"], count=coluna["quantidade"], offset=base + coluna["inicio"]
+            )
+            for coluna in cabecalho["colunas"]
+        }
+        self._textos = {}
+
+    def texto(self, coluna, aparar=False):
+        """
+        Valores da coluna de texto como array de objetos (uma entrada por nota)
+
+        :param aparar: Se True, como COALESCE(TRIM(coluna), '') no SQL
+        """
+        import numpy as np
+
+        chave = (coluna, aparar)
+        valores = self._textos.get(chave)
+        if valores is None:
+            dicionario = self.dicionarios[coluna]
+            if aparar:
+                dicionario = ["" if valor is None else str(valor).strip(" ") for valor in dicionario]
+            valores = np.empty(len(dicionario), dtype=object)
+            valores[:] = dicionario
+            self._textos[chave] = valores
+        return valores[self.colunas[coluna]]
+
+    def dataframe(self):
+        """DataFrame pandas: colunas numéricas sobre o mmap e textos como Categorical"""
+        import numpy as np
+        import pandas as pd
+
+        dados = {"referencia": pd.Categorical.from_codes(np.zeros(self.quantidade, dtype="int8"), [self.referencia])}
+        for nome, tipo, _ in COLUNAS:
+            if tipo == "texto":
+                # Categorical não aceita categoria nula nem repetida: None vira código -1
+                categorias = list(dict.fromkeys(v for v in self.dicionarios[nome] if v is not None))
+                posicao = {valor: i for i, valor in enumerate(categorias)}
+                mapa = [posicao[v] if v is not None else -1 for v in self.dicionarios[nome]]
+                codigos = self.colunas[nome]
+                if mapa != list(range(len(mapa))):
+                    codigos = np.asarray(mapa, dtype="int32")[codigos]
+                dados[nome] = pd.Categorical.from_codes(codigos, categorias)
+            else:
+                dados[nome] = self.colunas[nome]
+        return pd.DataFrame(dados, copy=False)
+
+
+def colunas_apuracao(particao):
+    """{coluna: array} no formato de apuracao.calcular, com valores já em centavos"""
+    return {
+        "id": particao.colunas["id"],
+        "cnpj": particao.texto("cnpj", aparar=True),
+        "fornecedor": particao.texto("fornecedor", aparar=True),
+        "tipo_servico": particao.texto("tipo_servico", aparar=True),
+        "base_calculo": particao.texto("base_calculo", aparar=True),
+        "valor_centavos": particao.colunas["valor_centavos"],
+        "valor_nulo": particao.colunas["valor_nulo"],
+        "aliquota_centesimos": particao.colunas["aliquota_centesimos"],
+        "fora_pais": particao.colunas["fora_pais"],
+        "cadastrado_goiania": particao.colunas["cadastrado_goiania"],
+    }
+
+
+def resumo_fornecedores(particao):
+    """
+    Linhas (fornecedor, cnpj, quantidade, valor, ISS) por CNPJ e razão social, como
+    exportacao_excel.SQL_RESUMO_FORNECEDORES, em ordem decrescente de valor
+    """
+    import numpy as np
+
+    fornecedores = particao.dicionarios["fornecedor"]
+    cnpjs = particao.dicionarios["cnpj"]
+    # Par (CNPJ, razão social) numa chave só, pelos códigos dos dicionários
+    base = max(len(fornecedores), 1)
+    chaves = particao.colunas["cnpj"].astype(np.int64) * base + particao.colunas["fornecedor"]
+    distintas, inverso = np.unique(chaves, return_inverse=True)
+    quantidades = np.bincount(inverso, minlength=len(distintas))
+    valores = np.zeros(len(distintas), dtype=np.int64)
+    np.add.at(valores, inverso, particao.colunas["valor_centavos"])
+    iss = np.zeros(len(distintas), dtype=np.int64)
+    np.add.at(iss, inverso, particao.colunas["iss_centavos"])
+
+    linhas = [
+        (fornecedores[chave % base] or "", cnpjs[chave // base],
+         int(quantidade), int(valor) / 100, int(imposto) / 100)
+        for chave, quantidade, valor, imposto in zip(distintas.tolist(), quantidades, valores, iss)
+    ]
+    linhas.sort(key=lambda linha: linha[3], reverse=True)
+    return linhas
+
+
+def _chaves_dimensao(particao, dimensao):
+    """Chave de cada nota na dimensão (array de objetos)"""
+    import numpy as np
+
+    if dimensao == "fornecedor":
+        return particao.texto("cnpj", aparar=True)
+    datas = particao.colunas["dt_emissao" if dimensao == "mes_emissao" else "dt_pagamento"]
+    meses = datas.astype("datetime64[M]")
+    chaves = np.datetime_as_string(meses, unit="M").astype(object)
+    chaves[np.isnat(meses)] = ""
+    return chaves
+
+
+class SnapshotColunar:
+    """
+    Partições colunares das notas, uma por referência, regeradas quando a versão muda
+
+    :param db: DatabaseManager cujas notas são materializadas
+    :param pasta: Pasta das partições (padrão: <banco>_snapshot ao lado dele)
+    :param maximo_abertas: Partições mantidas mapeadas em memória (descarte LRU)
+    """
+
+    def __init__(self, db, pasta=None, maximo_abertas=64):
+        self.db = db
+        self.pasta = pasta or os.path.splitext(db.db_file)[0] + "_snapshot"
+        self.maximo_abertas = maximo_abertas
+        self._lock = threading.Lock()
+        self._gravacao = threading.Lock()
+        self._abertas = OrderedDict()  # referencia -> Particao
+        self._parar = threading.Event()
+        self._thread = None
+        self.leituras = 0
+        self.geracoes = 0
+        self.ultima_atualizacao = None
+
+    def caminho(self, referencia):
+        return os.path.join(self.pasta, quote(referencia, safe="") + EXTENSAO)
+
+    def _aberta(self, referencia, atual):
+        """Partição com a versão atual, já mapeada ou lida do disco; None se não houver"""
+        with self._lock:
+            particao = self._abertas.get(referencia)
+            if particao is not None and particao.versao == atual:
+                self._abertas.move_to_end(referencia)
+                self.leituras += 1
+                return particao
+        try:
+            particao = Particao(self.caminho(referencia))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Partição do snapshot ilegível (%s), será regerada: %s", referencia, e)
+            return None
+        if particao.versao != atual:
+            return None
+        with self._lock:
+            self._abertas[referencia] = particao
+            self._abertas.move_to_end(referencia)
+            while len(self._abertas) > self.maximo_abertas:
+                self._abertas.popitem(last=False)
+            self.leituras += 1
+        return particao
+
+    def _gerar(self, conn, referencia, atual):
+        """Materializa as notas da referência lidas em conn (dentro da transação do chamador)"""
+        import numpy as np
+
+        inicio = time.perf_counter()
+        condicao = "COALESCE(nf.referencia, '') = ''" if referencia == "" else "nf.referencia = ?"
+        cursor = conn.execute(
+            SQL_PARTICAO.format(colunas=", ".join(expr for _, _, expr in COLUNAS), condicao=condicao),
+            () if referencia == "" else (referencia,)
+        )
+        partes = [[] for _ in COLUNAS]
+        dicionarios = {nome: {} for nome, tipo, _ in COLUNAS if tipo == "texto"}
+        nat = np.iinfo(np.int64).min
+        while True:
+            linhas = cursor.fetchmany(5000)
+            if not linhas:
+                break
+            for parte, (nome, tipo, _), valores in zip(partes, COLUNAS, zip(*linhas)):
+                if tipo == "texto":
+                    codigos = dicionarios[nome]
+                    valores = [codigos.setdefault(valor, len(codigos)) for valor in valores]
+                elif tipo == "data":
+                    valores = [nat if valor is None else valor for valor in valores]
+                parte.append(np.array(valores, dtype="int64" if tipo == "data" else DTYPES[tipo]))
+
+        arrays = []
+        for parte, (nome, tipo, _) in zip(partes, COLUNAS):
+            array = np.concatenate(parte) if parte else np.array([], dtype=DTYPES[tipo])
+            arrays.append((nome, array.view(DTYPES[tipo]) if tipo == "data" else array))
+        quantidade = len(arrays[0][1])
+
+        os.makedirs(self.pasta, exist_ok=True)
+        caminho = self.caminho(referencia)
+        temporario = os.path.join(self.pasta, f".{uuid.uuid4().hex}{EXTENSAO}.tmp")
+        try:
+            gravar(temporario, {
+                "formato": VERSAO_FORMATO,
+                "referencia": referencia,
+                "versao": atual,
+                "quantidade": quantidade,
+                "gerado_em": datetime.now().isoformat(timespec="seconds"),
+                "dicionarios": {nome: list(codigos) for nome, codigos in dicionarios.items()},
+            }, arrays)
+            os.replace(temporario, caminho)
+        finally:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+
+        particao = Particao(caminho)
+        with self._lock:
+            self._abertas[referencia] = particao
+            self._abertas.move_to_end(referencia)
+            while len(self._abertas) > self.maximo_abertas:
+                self._abertas.popitem(last=False)
+            self.geracoes += 1
+        logger.info("Snapshot da referência %s: %s notas em %.3f s", referencia, quantidade,
+                    time.perf_counter() - inicio)
+        return particao
+
+    def particao(self, referencia, conn=None):
+        """
+        Partição atualizada da referência, regerada na hora se os dados mudaram
+
+        :param conn: Conexão de notas já aberta (ex.: a da apuração). Se estiver numa
+            transação, versão e notas são lidas no mesmo snapshot do chamador; sem ela,
+            a conexão é obtida do banco (com o arquivo anual anexado, se preciso).
+        :return: Particao, ou None sem conexão disponível
+        """
+        referencia = (referencia or "").strip()
+        if conn is None:
+            conn = self.db.create_connection()
+            if conn is None:
+                return None
+            try:
+                particao = self._aberta(referencia, versao(conn, referencia))
+            finally:
+                conn.close()
+            if particao is not None:
+                return particao
+            conn = self.db.conexao_notas({"referencia": referencia})
+            if conn is None:
+                return None
+            try:
+                return self.particao(referencia, conn)
+            finally:
+                conn.close()
+
+        transacao = not conn.in_transaction
+        if transacao:
+            conn.execute("BEGIN")
+        try:
+            atual = versao(conn, referencia)
+            particao = self._aberta(referencia, atual)
+            if particao is None:
+                with self._gravacao:
+                    particao = self._aberta(referencia, atual) or self._gerar(conn, referencia, atual)
+            return particao
+        finally:
+            if transacao:
+                conn.rollback()
+
+    def particoes(self, lista=None):
+        """Partições atualizadas das referências (padrão: todas com notas, inclusive arquivadas)"""
+        if lista is None:
+            conn = self.db.create_connection()
+            if conn is None:
+                return []
+            try:
+                lista = referencias(conn)
+            finally:
+                conn.close()
+        return [particao for particao in (self.particao(referencia) for referencia in lista) if particao]
+
+    def atualizar(self):
+        """
+        Regera as partições desatualizadas e remove as de referências sem notas
+
+        :return: {"referencias", "geradas", "removidas", "segundos"}
+        """
+        inicio = time.perf_counter()
+        geracoes = self.geracoes
+        particoes = self.particoes()
+        removidas = 0
+        if os.path.isdir(self.pasta):
+            atuais = {os.path.basename(particao.caminho) for particao in particoes}
+            for entrada in os.scandir(self.pasta):
+                if entrada.name.endswith(EXTENSAO) and entrada.name not in atuais:
+                    with self._lock:
+                        self._abertas.pop(unquote(entrada.name[:-len(EXTENSAO)]), None)
+                    os.remove(entrada.path)
+                    removidas += 1
+        self.ultima_atualizacao = datetime.now().isoformat(timespec="seconds")
+        return {
+            "referencias": len(particoes),
+            "geradas": self.geracoes - geracoes,
+            "removidas": removidas,
+            "segundos": round(time.perf_counter() - inicio, 4),
+        }
+
+    def estatisticas_por(self, dimensao, lista=None):
+        """
+        Quantidade, valor e ISS por mês de emissão, mês de pagamento ou fornecedor (CNPJ)
+
+        Mesmo formato de agregados.estatisticas_por; o fornecedor traz a razão social
+        da última nota em "descricao".
+
+        :raises ValueError: se a dimensão não existir
+        """
+        import numpy as np
+
+        if dimensao not in DIMENSOES:
+            raise ValueError(f"Dimensão inválida: {dimensao}")
+        totais = {}
+        nomes = {}
+        for particao in self.particoes(lista):
+            chaves = _chaves_dimensao(particao, dimensao)
+            distintas, inverso = np.unique(chaves, return_inverse=True)
+            quantidades = np.bincount(inverso, minlength=len(distintas))
+            valores = np.zeros(len(distintas), dtype=np.int64)
+            np.add.at(valores, inverso, particao.colunas["valor_centavos"])
+            iss = np.zeros(len(distintas), dtype=np.int64)
+            np.add.at(iss, inverso, particao.colunas["iss_centavos"])
+            for chave, quantidade, valor, imposto in zip(distintas, quantidades, valores, iss):
+                soma = totais.setdefault(chave, [0, 0, 0])
+                soma[0] += int(quantidade)
+                soma[1] += int(valor)
+                soma[2] += int(imposto)
+            if dimensao == "fornecedor" and len(chaves):
+                ultima = np.zeros(len(distintas), dtype=np.int64)
+                ultima[inverso] = np.arange(len(inverso))
+                nomes.update(zip(distintas, particao.texto("fornecedor", aparar=True)[ultima]))
+
+        resultado = []
+        for chave in sorted(totais):
+            quantidade, valor, imposto = totais[chave]
+            item = {"chave": chave, "quantidade": quantidade, "valor_total": valor / 100, "valor_iss": imposto / 100}
+            if dimensao == "fornecedor":
+                item["descricao"] = nomes.get(chave, "")
+            resultado.append(item)
+        return resultado
+
+    def dataframe(self, lista=None):
+        """DataFrame pandas das referências (uma só referência não copia as colunas numéricas)"""
+        import pandas as pd
+
+        quadros = [particao.dataframe() for particao in self.particoes(lista)]
+        if not quadros:
+            return pd.DataFrame(columns=["referencia"] + [nome for nome, _, _ in COLUNAS])
+        if len(quadros) == 1:
+            return quadros[0]
+        return pd.concat(quadros, ignore_index=True)
+
+    def iniciar(self, intervalo):
+        """Atualiza todas as partições a cada intervalo (segundos) numa thread de fundo"""
+        if intervalo <= 0 or self._thread is not None:
+            return
+
+        def laco():
+            while not self._parar.wait(intervalo):
+                try:
+                    resultado = self.atualizar()
+                    if resultado["geradas"] or resultado["removidas"]:
+                        logger.info("Snapshot colunar atualizado: %s", resultado)
+                except Exception as e:
+                    logger.error("Erro ao atualizar o snapshot colunar: %s", e)
+
+        self._thread = threading.Thread(target=laco, name="snapshot-colunar", daemon=True)
+        self._thread.start()
+
+    def parar(self):
+        self._parar.set()
+
+    def stats(self):
+        arquivos = [
+            e for e in os.scandir(self.pasta) if e.is_file() and e.name.endswith(EXTENSAO)
+        ] if os.path.isdir(self.pasta) else []
+        with self._lock:
+            return {
+                "particoes": len(arquivos),
+                "bytes": sum(e.stat().st_size for e in arquivos),
+                "abertas": len(self._abertas),
+                "leituras": self.leituras,
+                "geracoes": self.geracoes,
+                "ultima_atualizacao": self.ultima_atualizacao,
+            }
@@ -0,0 +1,468 @@
+# Arquivo: tarefas.py
+"""
+Tarefas em segundo plano (importações e exportações) com acompanhamento de progresso
+
+Cada tarefa é uma linha em tb_tarefas: status, notas/linhas processadas, total
+(quando conhecido), artefato gerado e resultado. A execução acontece em um pool
+de threads do próprio processo; o SQLite libera o GIL durante as consultas, e o
+estado fica no banco, então qualquer worker do servidor consegue consultar ou
+cancelar uma tarefa.
+
+Status: pendente -> executando -> concluida | falhou | cancelada
+
+Os artefatos ficam na pasta de tarefas e são removidos, junto com o registro,
+depois do tempo de retenção.
+"""
+import contextvars
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+PENDENTE = "pendente"
+EXECUTANDO = "executando"
+CONCLUIDA = "concluida"
+FALHOU = "falhou"
+CANCELADA = "cancelada"
+FINALIZADAS = (CONCLUIDA, FALHOU, CANCELADA)
+
+# Intervalo mínimo (segundos) entre gravações de progresso no banco
+INTERVALO_PROGRESSO = 0.5
+
+# Intervalo (segundos) entre limpezas de tarefas e artefatos vencidos
+INTERVALO_LIMPEZA = 300
+
+
+class TarefaCancelada(Exception):
+    """Levantada pelo callback de progresso quando o cancelamento foi pedido"""
+
+
+def _agora():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _contar_linhas(caminho):
+    """Quantidade de linhas de um arquivo texto (sem decodificar)"""
+    linhas = 0
+    with open(caminho, "rb") as arquivo:
+        for bloco in iter(lambda: arquivo.read(1024 * 1024), b""):
+            linhas += bloco.count(b"\n")
+    return linhas
+
+
+def _processo_ativo(pid):
+    if pid is None:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class ContextoTarefa:
+    """Repassado à função da tarefa: informa o progresso e verifica o cancelamento"""
+
+    def __init__(self, gerenciador, tarefa_id, pasta):
+        self.gerenciador = gerenciador
+        self.id = tarefa_id
+        self.pasta = pasta
+        self.total = None
+        self.processadas = 0
+        self.cancelamento = threading.Event()
+        self._ultima_gravacao = 0.0
+
+    def definir_total(self, total):
+        self.total = total
+        self.gerenciador._atualizar(self.id, bloquear=False, total=total)
+
+    def progresso(self, processadas):
+        """
+        Callback de progresso (compatível com o parâmetro progresso do DatabaseManager)
+
+        :raises TarefaCancelada: se o cancelamento foi pedido
+        """
+        self.processadas = processadas
+        if self.cancelamento.is_set():
+            raise TarefaCancelada("Tarefa cancelada")
+        agora = time.monotonic()
+        if agora - self._ultima_gravacao < INTERVALO_PROGRESSO:
+            return
+        self._ultima_gravacao = agora
+        # O pedido de cancelamento pode ter chegado por outro processo. A gravação não
+        # espera pelo lock: a importação de municípios segura a escrita até o fim
+        if self.gerenciador._atualizar(self.id, bloquear=False, processadas=processadas):
+            self.cancelamento.set()
+            raise TarefaCancelada("Tarefa cancelada")
+
+    def caminho_artefato(self, extensao):
+        return os.path.join(self.pasta, f"{self.id}{extensao}")
+
+
+# --- Tipos de tarefa: função (db, contexto, parametros) -> (resultado, artefato, nome_artefato)
+
+def _exportar_excel(db, ctx, parametros):
+    ctx.definir_total(db.contar_notas(parametros.get("filtros")))
+    caminho = ctx.caminho_artefato(".xlsx")
+    ok = db.export_to_excel(
+        caminho, parametros.get("filtros"), parametros.get("tomador_id"),
+        parametros.get("resumo", True), progresso=ctx.progresso
+    )
+    if not ok:
+        raise RuntimeError("Erro ao exportar para Excel")
+    return {"bytes": os.path.getsize(caminho)}, caminho, "notas_fiscais.xlsx"
+
+
+def _exportar_txt(db, ctx, parametros):
+    ctx.definir_total(db.contar_notas(parametros.get("filtros")))
+    caminho = ctx.caminho_artefato(".txt")
+    ok = db.export_to_txt(
+        caminho, parametros.get("filtros"), parametros.get("tomador_id"), progresso=ctx.progresso
+    )
+    if not ok:
+        raise RuntimeError("Erro ao exportar para TXT")
+    return {"bytes": os.path.getsize(caminho)}, caminho, "notas_fiscais.txt"
+
+
+def _importar_municipios(db, ctx, parametros):
+    caminho = parametros["arquivo"]
+    try:
+        ctx.definir_total(_contar_linhas(caminho))
+        relatorio = db.import_municipios_from_txt(caminho, progresso=ctx.progresso)
+    finally:
+        os.remove(caminho)
+    if relatorio is None:
+        raise RuntimeError("Erro ao importar municípios")
+    return relatorio, None, None
+
+
+def _importar_notas(db, ctx, parametros):
+    caminho = parametros["arquivo"]
+    try:
+        if not caminho.lower().endswith(".xlsx"):
+            # Menos a linha de cabeçalho
+            ctx.definir_total(max(_contar_linhas(caminho) - 1, 0))
+        relatorio = db.import_notas_from_file(
+            caminho, progresso=ctx.progresso, duplicadas=parametros.get("duplicadas", "rejeitar")
+        )
+    finally:
+        os.remove(caminho)
+    return relatorio, None, None
+
+
+TIPOS = {
+    "exportar_excel": _exportar_excel,
+    "exportar_txt": _exportar_txt,
+    "importar_municipios": _importar_municipios,
+    "importar_notas": _importar_notas,
+}
+
+
+class GerenciadorTarefas:
+    """
+    Executa as tarefas em segundo plano e mantém tb_tarefas atualizada
+
+    :param db: DatabaseManager (já com as migrações aplicadas)
+    :param pasta: Pasta dos artefatos gerados
+    :param max_workers: Tarefas executadas ao mesmo tempo neste processo
+    :param retencao: Segundos que tarefas finalizadas e seus artefatos são mantidos
+    """
+
+    def __init__(self, db, pasta, max_workers=2, retencao=3600):
+        self.db = db
+        self.pasta = pasta
+        self.retencao = retencao
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tarefa")
+        self._contextos = {}
+        self._lock = threading.Lock()
+        self._ultima_limpeza = 0.0
+        self._busy_timeout = db.pool.pragmas.get("busy_timeout", 5000)
+        os.makedirs(self.pasta, exist_ok=True)
+        self._marcar_interrompidas()
+
+    # --- Persistência
+
+    def _atualizar(self, tarefa_id, bloquear=True, **campos):
+        """
+        Atualiza campos da tarefa; retorna True se o cancelamento foi pedido
+
+        Com bloquear=False a atualização é descartada se o banco estiver com a escrita
+        ocupada (o progresso em memória continua disponível para obter()).
+        """
+        conn = self.db.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                if campos:
+                    atribuicoes = ", ".join(f"{campo} = ?" for campo in campos)
+                    if not bloquear:
+                        cursor.execute("PRAGMA busy_timeout = 0")
+                    try:
+                        cursor.execute(
+                            f"UPDATE tb_tarefas SET {atribuicoes} WHERE id = ?",
+                            list(campos.values()) + [tarefa_id]
+                        )
+                        conn.commit()
+                    except sqlite3.OperationalError as e:
+                        if bloquear:
+                            raise
+                        logger.debug("Progresso da tarefa %s não gravado: %s", tarefa_id, e)
+                    finally:
+                        if not bloquear:
+                            cursor.execute(f"PRAGMA busy_timeout = {self._busy_timeout}")
+                cursor.execute("SELECT cancelar FROM tb_tarefas WHERE id = ?", (tarefa_id,))
+                row = cursor.fetchone()
+                return bool(row and row[0])
+            except Exception as e:
+                logger.error("Erro ao atualizar tarefa %s: %s", tarefa_id, e)
+                conn.rollback()
+            finally:
+                conn.close()
+        return False
+
+    def _marcar_interrompidas(self):
+        # Tarefas de um processo que não existe mais nunca vão terminar
+        conn = self.db.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(
+                    "SELECT id, processo FROM tb_tarefas WHERE status IN (?, ?)", (PENDENTE, EXECUTANDO)
+                )
+                orfas = [tarefa_id for tarefa_id, pid in cursor.fetchall() if not _processo_ativo(pid)]
+                cursor.executemany(
+                    "UPDATE tb_tarefas SET status = ?, erro = ?, concluida_em = ? WHERE id = ?",
+                    [(FALHOU, "Interrompida (o processo que a executava terminou)", _agora(), tarefa_id)
+                     for tarefa_id in orfas]
+                )
+                conn.commit()
+            except Exception as e:
+                logger.error("Erro ao verificar tarefas interrompidas: %s", e)
+                conn.rollback()
+            finally:
+                conn.close()
+
+    # --- API
+
+    def submeter(self, tipo, parametros=None):
+        """
+        Registra a tarefa e agenda a execução
+
+        :param tipo: Chave de TIPOS (exportar_excel, exportar_txt, importar_municipios, importar_notas)
+        :param parametros: Dicionário serializável em JSON repassado à função da tarefa; com
+            "particao" (ID de tomador) a tarefa usa a partição desse tomador
+        :return: ID da tarefa
+        :raises ValueError: se o tipo não existir
+        """
+        if tipo not in TIPOS:
+            raise ValueError(f"Tipo de tarefa inválido: {tipo}")
+        self.limpar_se_necessario()
+
+        tarefa_id = uuid.uuid4().hex
+        parametros = parametros or {}
+        conn = self.db.create_connection()
+        if conn is None:
+            raise RuntimeError("Não foi possível conectar ao banco de dados")
+        try:
+            conn.execute("""
+                INSERT INTO tb_tarefas (id, tipo, status, parametros, processo, criada_em)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (tarefa_id, tipo, PENDENTE, json.dumps(parametros, ensure_ascii=False), os.getpid(), _agora()))
+            conn.commit()
+        finally:
+            conn.close()
+
+        contexto = ContextoTarefa(self, tarefa_id, self.pasta)
+        with self._lock:
+            self._contextos[tarefa_id] = contexto
+        # Cópia do contexto: as alterações da tarefa vão para o journal com o usuário que a pediu
+        self._executor.submit(contextvars.copy_context().run, self._executar, tipo, contexto, parametros)
+        return tarefa_id
+
+    def _executar(self, tipo, ctx, parametros):
+        inicio = time.perf_counter()
+        try:
+            if ctx.cancelamento.is_set() or self._atualizar(ctx.id, status=EXECUTANDO, iniciada_em=_agora()):
+                raise TarefaCancelada("Tarefa cancelada")
+            # "particao": a tarefa roda no arquivo do tomador em vez do banco comum
+            banco = self.db if parametros.get("particao") is None else self.db.banco_tomador(parametros["particao"])
+            resultado, artefato, nome = TIPOS[tipo](banco, ctx, parametros)
+            if ctx.cancelamento.is_set():
+                raise TarefaCancelada("Tarefa cancelada")
+            # Importações relatam as linhas lidas; exportações, o último progresso
+            processadas = resultado.get("linhas", ctx.processadas) if isinstance(resultado, dict) else ctx.processadas
+            self._atualizar(
+                ctx.id, status=CONCLUIDA, concluida_em=_agora(), artefato=artefato, nome_artefato=nome,
+                processadas=processadas, total=ctx.total if ctx.total is not None else processadas,
+                resultado=json.dumps(resultado, ensure_ascii=False, default=str)
+            )
+            logger.info("Tarefa %s (%s) concluída em %.1f s", ctx.id, tipo, time.perf_counter() - inicio)
+        except Exception as e:
+            cancelada = isinstance(e, TarefaCancelada) or ctx.cancelamento.is_set()
+            for extensao in (".xlsx", ".txt"):
+                if os.path.exists(ctx.caminho_artefato(extensao)):
+                    os.remove(ctx.caminho_artefato(extensao))
+            if cancelada:
+                self._atualizar(ctx.id, status=CANCELADA, concluida_em=_agora())
+                logger.info("Tarefa %s (%s) cancelada", ctx.id, tipo)
+            else:
+                self._atualizar(ctx.id, status=FALHOU, concluida_em=_agora(), erro=str(e))
+                logger.error("Tarefa %s (%s) falhou: %s", ctx.id, tipo, e)
+        finally:
+            with self._lock:
+                self._contextos.pop(ctx.id, None)
+
+    def obter(self, tarefa_id):
+        """Estado da tarefa com percentual e estimativa de término (eta_segundos), ou None"""
+        conn = self.db.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM tb_tarefas WHERE id = ?", (tarefa_id,))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                return self._para_dict(dict(zip([col[0] for col in cursor.description], row)))
+            finally:
+                conn.close()
+        return None
+
+    def listar(self, limite=50):
+        """Tarefas mais recentes primeiro"""
+        conn = self.db.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT * FROM tb_tarefas ORDER BY criada_em DESC LIMIT ?", (limite,))
+                colunas = [col[0] for col in cursor.description]
+                return [self._para_dict(dict(zip(colunas, row))) for row in cursor.fetchall()]
+            finally:
+                conn.close()
+        return []
+
+    def _para_dict(self, tarefa):
+        tarefa.pop("processo", None)
+        with self._lock:
+            contexto = self._contextos.get(tarefa["id"])
+        if contexto is not None and tarefa["status"] == EXECUTANDO:
+            # Executando neste processo: o progresso em memória é o mais recente
+            tarefa["processadas"] = max(tarefa["processadas"], contexto.processadas)
+            if contexto.total is not None:
+                tarefa["total"] = contexto.total
+        tarefa["cancelar"] = bool(tarefa["cancelar"])
+        tarefa["parametros"] = json.loads(tarefa["parametros"]) if tarefa["parametros"] else {}
+        tarefa["parametros"].pop("arquivo", None)
+        tarefa["resultado"] = json.loads(tarefa["resultado"]) if tarefa["resultado"] else None
+        tarefa["disponivel"] = bool(
+            tarefa["status"] == CONCLUIDA and tarefa["artefato"] and os.path.exists(tarefa["artefato"])
+        )
+        tarefa.pop("artefato")
+
+        processadas, total = tarefa["processadas"], tarefa["total"]
+        tarefa["percentual"] = round(min(processadas / total, 1) * 100, 1) if total else None
+        tarefa["eta_segundos"] = None
+        if tarefa["status"] == EXECUTANDO and total and processadas and tarefa["iniciada_em"]:
+            decorrido = (datetime.now() - datetime.fromisoformat(tarefa["iniciada_em"])).total_seconds()
+            tarefa["eta_segundos"] = round(max(decorrido / processadas * (total - processadas), 0), 1)
+        return tarefa
+
+    def artefato(self, tarefa_id):
+        """(caminho, nome para download) do artefato de uma tarefa concluída, ou None"""
+        conn = self.db.create_connection()
+        if conn is not None:
+            try:
+                row = conn.execute(
+                    "SELECT artefato, nome_artefato FROM tb_tarefas WHERE id = ? AND status = ?",
+                    (tarefa_id, CONCLUIDA)
+                ).fetchone()
+            finally:
+                conn.close()
+            if row and row[0] and os.path.exists(row[0]):
+                return row[0], row[1]
+        return None
+
+    def cancelar(self, tarefa_id):
+        """
+        Pede o cancelamento; a tarefa para no próximo aviso de progresso
+
+        :return: False se a tarefa não existe ou já terminou
+        """
+        conn = self.db.create_connection()
+        if conn is None:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"UPDATE tb_tarefas SET cancelar = 1 WHERE id = ? AND status NOT IN ({', '.join('?' * len(FINALIZADAS))})",
+                (tarefa_id,) + FINALIZADAS
+            )
+            conn.commit()
+            if not cursor.rowcount:
+                return False
+        finally:
+            conn.close()
+        with self._lock:
+            contexto = self._contextos.get(tarefa_id)
+        if contexto:
+            contexto.cancelamento.set()
+        return True
+
+    def limpar_se_necessario(self):
+        if time.monotonic() - self._ultima_limpeza >= INTERVALO_LIMPEZA:
+            self.limpar()
+
+    def limpar(self):
+        """
+        Remove tarefas finalizadas há mais que o tempo de retenção, seus artefatos e
+        arquivos órfãos da pasta (ex.: exportação interrompida no meio)
+
+        :return: Quantidade de arquivos removidos
+        """
+        self._ultima_limpeza = time.monotonic()
+        limite = (datetime.now() - timedelta(seconds=self.retencao)).isoformat(timespec="seconds")
+        conn = self.db.create_connection()
+        if conn is None:
+            return 0
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, artefato FROM tb_tarefas WHERE status IN ({', '.join('?' * len(FINALIZADAS))}) "
+                "AND concluida_em < ?", FINALIZADAS + (limite,)
+            )
+            vencidas = cursor.fetchall()
+            cursor.executemany("DELETE FROM tb_tarefas WHERE id = ?", [(tarefa_id,) for tarefa_id, _ in vencidas])
+            conn.commit()
+            cursor.execute("SELECT artefato FROM tb_tarefas WHERE artefato IS NOT NULL")
+            em_uso = {row[0] for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error("Erro ao limpar tarefas: %s", e)
+            conn.rollback()
+            return 0
+        finally:
+            conn.close()
+
+        removidos = 0
+        corte = time.time() - self.retencao
+        for nome in os.listdir(self.pasta):
+            caminho = os.path.join(self.pasta, nome)
+            try:
+                if caminho not in em_uso and os.path.isfile(caminho) and os.path.getmtime(caminho) < corte:
+                    os.remove(caminho)
+                    removidos += 1
+            except OSError:
+                continue
+        if vencidas or removidos:
+            logger.info("Limpeza de tarefas: %s registros, %s arquivos removidos", len(vencidas), removidos)
+        return removidos
+
+    def encerrar(self, aguardar=True):
+        self._executor.shutdown(wait=aguardar, cancel_futures=not aguardar)
@@ -0,0 +1,103 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from arquivamento import caminho_arquivo
+from database import DatabaseManager
+
+
+class MesclagemComArquivoTest(unittest.TestCase):
+    """Mesclar fornecedores duplicados com notas em competência arquivada"""
+
+    def setUp(self):
+        self.pasta = tempfile.TemporaryDirectory()
+        self.db = DatabaseManager(os.path.join(self.pasta.name, "teste.db"))
+        conn = self.db.create_connection()
+        try:
+            conn.execute("DELETE FROM tb_notas_fiscais")
+            conn.execute("DELETE FROM tb_fornecedores")
+            self.mantido = conn.execute(
+                "INSERT INTO tb_fornecedores (CNPJ, descricao_fornecedor) VALUES ('12.345.678/0001-90', 'Formatado')"
+            ).lastrowid
+            self.duplicado = conn.execute(
+                "INSERT INTO tb_fornecedores (CNPJ, descricao_fornecedor) VALUES ('12345678000190', 'Sem máscara')"
+            ).lastrowid
+            for numero, fornecedor_id in (("1", self.mantido), ("2", self.duplicado)):
+                conn.execute("""
+                    INSERT INTO tb_notas_fiscais (referencia, cnpj, fornecedor_id, numero_nf, dt_emissao, valor_nf, aliquota)
+                    VALUES ('01/2024', '12345678000190', ?, ?, '2024-01-10', 100, 2)
+                """, (fornecedor_id, numero))
+            conn.commit()
+        finally:
+            conn.close()
+        self.db.arquivar_referencia("01/2024", compactar=False)
+
+    def tearDown(self):
+        self.db.pool.fechar()
+        self.pasta.cleanup()
+
+    def test_reaponta_notas_arquivadas_e_catalogo(self):
+        relatorio = self.db.deduplicar(["tb_fornecedores"], executar=True)
+
+        item = relatorio["tb_fornecedores"]
+        self.assertEqual(item["removidos"], 1)
+        self.assertEqual(item["referencias"]["arquivo.tb_notas_fiscais.fornecedor_id"], 1)
+
+        conn = self.db.create_connection()
+        try:
+            self.assertEqual(
+                conn.execute("SELECT id FROM tb_fornecedores").fetchall(), [(self.mantido,)]
+            )
+            self.assertEqual(
+                conn.execute("SELECT referencia, fornecedor_id FROM tb_arquivo_fornecedores").fetchall(),
+                [("01/2024", self.mantido)]
+            )
+        finally:
+            conn.close()
+
+        arquivo = sqlite3.connect(caminho_arquivo(self.db.pasta_arquivo, 2024))
+        try:
+            self.assertEqual(
+                {linha[0] for linha in arquivo.execute("SELECT fornecedor_id FROM tb_notas_fiscais")},
+                {self.mantido}
+            )
+        finally:
+            arquivo.close()
+
+        # Restaurada, a competência volta com as notas apontando para o fornecedor mantido
+        self.db.restaurar_referencia("01/2024")
+        conn = self.db.create_connection()
+        try:
+            orfas = conn.execute("""
+                SELECT COUNT(*) FROM tb_notas_fiscais nf
+                LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+                WHERE nf.referencia = '01/2024' AND f.id IS NULL
+            """).fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(orfas, 0)
+
+    def test_limpeza_mantem_fornecedores_de_notas_arquivadas(self):
+        conn = self.db.create_connection()
+        try:
+            sem_notas = conn.execute(
+                "INSERT INTO tb_fornecedores (CNPJ, descricao_fornecedor) VALUES ('98765432000110', 'Sem notas')"
+            ).lastrowid
+            conn.commit()
+        finally:
+            conn.close()
+
+        self.assertTrue(self.db.limpar_fornecedores())
+
+        conn = self.db.create_connection()
+        try:
+            restantes = {linha[0] for linha in conn.execute("SELECT id FROM tb_fornecedores")}
+        finally:
+            conn.close()
+        self.assertNotIn(sem_notas, restantes)
+        self.assertEqual(restantes, {self.mantido, self.duplicado})
+
+
+if __name__ == "__main__":
+    unittest.main()